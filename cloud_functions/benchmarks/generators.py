@@ -0,0 +1,94 @@
+"""synthetic inputs for the benchmarks, seeded so a run can be replayed exactly"""
+import random
+from typing import Dict, List, Tuple
+
+Row = Tuple[str, int, str, str, str] #paper_id, version, type, abs_categories, extra, as _get_days_announcements yields them
+Event = Tuple[str, str] #bucket, object name
+
+METHODS=("new", "cross", "rep", "jref", "wdr")
+DEFAULT_MIX={"new": 5, "cross": 2, "rep": 3, "jref": 1, "wdr": 1}
+
+CATEGORIES=[
+    "cs.LG", "cs.CV", "cs.CL", "cs.AI", "cs.NA", "cs.SD", "cs.CR", "cs.DS", "cs.RO", "cs.IT",
+    "math.NA", "math.AP", "math.PR", "math.ST", "math.CO", "math.AG", "math.IT", "math.OC",
+    "stat.ML", "stat.TH", "stat.ME", "hep-th", "hep-ph", "hep-ex", "hep-lat", "gr-qc", "nucl-th",
+    "astro-ph.SR", "astro-ph.GA", "astro-ph.CO", "astro-ph.HE", "cond-mat.mes-hall", "cond-mat.str-el",
+    "cond-mat.supr-con", "cond-mat.stat-mech", "quant-ph", "physics.optics", "physics.flu-dyn",
+    "eess.AS", "eess.SP", "q-bio.NC", "q-fin.ST", "econ.EM",
+]
+
+def parse_mix(text: str) -> Dict[str, int]:
+    """new=5,cross=2,... into weights, methods left out get no rows"""
+    mix={}
+    for part in text.split(","):
+        method, _, weight=part.partition("=")
+        method=method.strip()
+        if method not in METHODS:
+            raise ValueError(f"unknown announcement type {method}, expected one of {METHODS}")
+        mix[method]=int(weight)
+    if not any(mix.values()):
+        raise ValueError("mix needs at least one type with a weight above 0")
+    return mix
+
+def category_strings(spread: int, seed: int=0) -> List[str]:
+    """spread distinct abs_categories strings, a primary category with up to two cross lists"""
+    rand=random.Random(seed)
+    strings: Dict[str, None]={category: None for category in rand.sample(CATEGORIES, min(spread, len(CATEGORIES)))}
+    while len(strings) < spread:
+        strings[" ".join(rand.sample(CATEGORIES, rand.choice([2, 2, 3])))]=None
+    return list(strings)
+
+def mailing(rows: int, mix: Dict[str, int]=DEFAULT_MIX, spread: int=40, skew: float=1.0, seed: int=0) -> List[Row]:
+    """an announce day mailing of rows rows
+    mix weights the announcement types, spread is the number of distinct category strings
+    and skew how unevenly papers fall on them, 0 even, higher piles more on the first few as real mailings do
+    """
+    rand=random.Random(seed)
+    strings=category_strings(spread, seed)
+    weights=[1 / (rank + 1) ** skew for rank in range(len(strings))]
+    methods=[method for method in METHODS if mix.get(method)]
+    method_weights=[mix[method] for method in methods]
+    announcements=[]
+    for n in range(rows):
+        method=rand.choices(methods, method_weights)[0]
+        if method == "new":
+            paper_id=f"2410.{n:05d}"
+        else:
+            year=rand.randint(8, 24)
+            yymm=f"{year:02d}{rand.randint(1, 12):02d}"
+            paper_id=f"{yymm}.{rand.randint(1, 9999):04d}" if year < 15 else f"{yymm}.{rand.randint(1, 29999):05d}"
+        categories=rand.choices(strings, weights)[0]
+        extra=categories.split()[-1] if method == "cross" else ""
+        announcements.append((paper_id, 1 if method == "new" else rand.randint(1, 5), method, categories, extra))
+    return announcements
+
+def storm(papers: int, objects_per_paper: int=10, html_share: float=0.5, noise: float=0.1,
+          bucket: str="arxiv-production-data", latexml_bucket: str="latexml_document_conversions", seed: int=0) -> List[Event]:
+    """bucket change events for a bulk regeneration of papers, each writing a pdf and objects_per_paper-1 other objects
+    html_share of the papers are latexml conversions written to latexml_bucket, the rest ps_cache html assets,
+    noise is the share of extra events for objects that never need a purge
+    events are interleaved across papers the way a regeneration job writes them
+    """
+    rand=random.Random(seed)
+    events: List[Event]=[]
+    latexml=[rand.random() < html_share for _ in range(papers)]
+    for n in range(objects_per_paper):
+        for p in range(papers):
+            paper_id=f"2409.{p:05d}v1"
+            if n == 0:
+                events.append((bucket, f"ps_cache/arxiv/pdf/2409/{paper_id}.pdf"))
+            elif latexml[p]:
+                events.append((latexml_bucket, f"{paper_id}/{'index.html' if n == 1 else f'x{n}.png'}"))
+            else:
+                events.append((bucket, f"ps_cache/arxiv/html/2409/{paper_id}/x{n}.png"))
+            if rand.random() < noise:
+                events.append((latexml_bucket, f"{paper_id}/__stdout.txt"))
+    return events
+
+def keys(count: int, seed: int=0) -> List[str]:
+    """surrogate keys shaped like the ones the functions send, for driving the purge layer on its own"""
+    rand=random.Random(seed)
+    families=["abs-{id}", "paper-id-{id}-current", "paper-id-{id}v{v}", "list-{yymm}-{cat}", "year-{cat}-{yy}"]
+    return [rand.choice(families).format(id=f"2410.{n:05d}", v=rand.randint(1, 5), yymm=f"{rand.randint(8, 24):02d}{rand.randint(1, 12):02d}",
+                                         cat=rand.choice(CATEGORIES), yy=f"{rand.randint(8, 24):02d}")
+            for n in range(count)]
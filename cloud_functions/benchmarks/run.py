@@ -0,0 +1,114 @@
+"""runs the purge benchmarks against a local fake fastly and saves the results as json, to compare between commits
+
+run from cloud_functions with the functions' requirements installed
+` python benchmarks/run.py --out /tmp/bench-before.json `
+` python benchmarks/run.py --out /tmp/bench-after.json --compare /tmp/bench-before.json `
+each scenario runs in its own process, see scenarios.py, and reports keys, requests sent, keys/sec, p50/p99 latency and peak rss
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+HERE=os.path.dirname(os.path.abspath(__file__))
+sys.path.append(HERE)
+from scenarios import SCENARIOS
+
+#for these higher is better, for the other compared measures lower is
+HIGHER_IS_BETTER={"keys_per_sec", "events_per_sec"}
+COMPARED=["keys_per_sec", "events_per_sec", "requests", "p50_ms", "p99_ms", "request_p99_ms", "peak_rss_kb", "key_rss_kb"]
+
+
+def params(args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    fastly={"latency": args.latency, "jitter": args.jitter, "rate_limit": args.rate_limit, "error_rate": args.error_rate, "seed": args.seed}
+    mailing={"rows": args.rows, "mix": args.mix, "spread": args.spread, "skew": args.skew, "seed": args.seed}
+    return {
+        "announce_keys": {**mailing, "repeats": args.repeats},
+        "announce_memory_list": mailing,
+        "announce_memory_stream": mailing,
+        "announce_purge": {**mailing, "fastly": fastly, "max_in_flight": args.max_in_flight},
+        "bucket_storm": {"papers": args.papers, "objects_per_paper": args.objects_per_paper, "html_share": args.html_share,
+                         "noise": args.noise, "seed": args.seed, "fastly": fastly, "concurrency": args.concurrency,
+                         "env": dict(setting.split("=", 1) for setting in args.storm_env)},
+        "purge_layer": {"keys": args.keys, "seed": args.seed, "fastly": fastly, "max_in_flight": args.max_in_flight},
+    }
+
+def run_scenario(name: str, scenario_params: Dict[str, Any]) -> Dict[str, Any]:
+    completed=subprocess.run([sys.executable, os.path.join(HERE, "scenarios.py"), name, json.dumps(scenario_params)],
+                             capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f"exit {completed.returncode}"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=HERE, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """a line per measure that both runs have, with the change, a ! marks a change for the worse of more than 10%"""
+    lines=[f"compared with {baseline.get('commit')} from {baseline.get('started')}"]
+    for name, result in results["scenarios"].items():
+        before=baseline.get("scenarios", {}).get(name)
+        if not before or "error" in result or "error" in before:
+            continue
+        for measure in COMPARED:
+            if measure not in result or measure not in before or not before[measure]:
+                continue
+            change=(result[measure] - before[measure]) / before[measure]
+            worse=-change if measure in HIGHER_IS_BETTER else change
+            lines.append(f"{'!' if worse > 0.1 else ' '} {name:<15} {measure:<15} {before[measure]:>12} -> {result[measure]:>12} {change:+7.1%}")
+    return lines
+
+def main() -> None:
+    parser=argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run, all by default, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rows", type=int, default=20000, help="rows in the announce mailing")
+    parser.add_argument("--mix", default="new=5,cross=2,rep=3,jref=1,wdr=1", help="weights of the announcement types")
+    parser.add_argument("--spread", type=int, default=40, help="distinct category strings in the mailing")
+    parser.add_argument("--skew", type=float, default=1.0, help="how unevenly papers fall on the category strings, 0 is even")
+    parser.add_argument("--repeats", type=int, default=5, help="runs of _process_announcements, the median is reported")
+    parser.add_argument("--papers", type=int, default=500, help="papers regenerated in the bucket storm")
+    parser.add_argument("--objects-per-paper", type=int, default=10)
+    parser.add_argument("--html-share", type=float, default=0.5, help="share of storm papers that are latexml conversions")
+    parser.add_argument("--noise", type=float, default=0.1, help="share of extra storm events that need no purge")
+    parser.add_argument("--concurrency", type=int, default=80, help="storm events handled at once")
+    parser.add_argument("--storm-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="environment for the bucket function, e.g. PURGE_BATCH_WINDOW=0.5, can be repeated")
+    parser.add_argument("--keys", type=int, default=50000, help="keys sent through the purge layer")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds fake fastly takes to answer each purge")
+    parser.add_argument("--jitter", type=float, default=0, help="up to this many more seconds per purge, at random")
+    parser.add_argument("--rate-limit", type=float, default=0, help="purges a second fake fastly accepts before answering 429")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of purges fake fastly fails with a 503")
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--out", help="file to save the results in")
+    parser.add_argument("--compare", help="results file of an earlier run to compare with")
+    args=parser.parse_args()
+    if unknown := set(args.scenarios) - set(SCENARIOS):
+        parser.error(f"unknown scenarios {sorted(unknown)}")
+
+    all_params=params(args)
+    results: Dict[str, Any]={"commit": commit(), "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                             "python": platform.python_version(), "params": {}, "scenarios": {}}
+    for name in args.scenarios or SCENARIOS:
+        results["params"][name]=all_params[name]
+        result=results["scenarios"][name]=run_scenario(name, all_params[name])
+        print(f"{name}: {json.dumps(result)}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            print(*compare(results, json.load(f)), sep="\n")
+    if any("error" in result for result in results["scenarios"].values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""the benchmark scenarios, each run by run.py in a process of its own so the functions' main modules don't clash
+and peak rss is the scenario's alone
+
+` python scenarios.py <scenario> '<params json>' ` prints the scenario's result as one json line, run.py builds the params from its options
+"""
+import gc
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List
+from unittest.mock import patch
+
+HERE=os.path.dirname(os.path.abspath(__file__))
+sys.path.append(HERE)
+import generators
+
+SERVICE_IDS={"arxiv.org": "bench-arxiv-org", "browse.dev.arxiv.org": "bench-browse-dev"}
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50 and p99 in milliseconds"""
+    if not samples:
+        return {"p50_ms": 0.0, "p99_ms": 0.0}
+    if len(samples) == 1:
+        return {"p50_ms": round(samples[0] * 1000, 3), "p99_ms": round(samples[0] * 1000, 3)}
+    cuts=statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50_ms": round(cuts[49] * 1000, 3), "p99_ms": round(cuts[98] * 1000, 3)}
+
+
+class Timed:
+    """wraps a callable, keeping how long each call took, safe to share between threads"""
+    def __init__(self, fun: Callable[..., Any]) -> None:
+        self.fun=fun
+        self.samples: List[float]=[]
+        self._lock=threading.Lock()
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        start=time.perf_counter()
+        try:
+            return self.fun(*args, **kwargs)
+        finally:
+            seconds=time.perf_counter() - start
+            with self._lock:
+                self.samples.append(seconds)
+
+
+def _use_function(name: str) -> None:
+    sys.path.insert(0, os.path.join(HERE, "..", name, "src"))
+
+class FakeFastlyProcess:
+    def __init__(self, url: str) -> None:
+        self.url=url
+
+    def stats(self) -> Dict[str, int]:
+        with urllib.request.urlopen(f"{self.url}/_stats") as response:
+            return json.loads(response.read())
+
+@contextmanager
+def fake_fastly(options: Dict[str, Any]) -> Iterator[FakeFastlyProcess]:
+    """fake_fastly.py in a process of its own, with the function's environment pointed at it
+    options are its command line options, {"rate_limit": 100} for --rate-limit 100
+    """
+    args=[f"--{name.replace('_', '-')}={value}" for name, value in options.items() if value]
+    server=subprocess.Popen([sys.executable, os.path.join(HERE, "..", "fake_fastly.py"), *args], stdout=subprocess.PIPE, text=True)
+    try:
+        fake=FakeFastlyProcess(server.stdout.readline().strip())
+        os.environ["FASTLY_SERVICE_IDS"]=json.dumps(SERVICE_IDS)
+        os.environ["FASTLY_API_URL"]=fake.url
+        os.environ["FASTLY_PURGE_TOKEN"]="bench"
+        yield fake
+    finally:
+        server.terminate()
+        server.wait()
+
+def _result(stats: Dict[str, int], seconds: float, latency: List[float], **extra: Any) -> Dict[str, Any]:
+    return {"keys": stats["keys"], "requests": stats["requests"], "seconds": round(seconds, 6),
+            "keys_per_sec": round(stats["keys"] / seconds, 1) if seconds else 0.0,
+            **percentiles(latency), **{name: stats[name] for name in ("rate_limited", "failed") if stats.get(name)}, **extra}
+
+
+def announce_keys(params: Dict[str, Any]) -> Dict[str, Any]:
+    """_process_announcements on a synthetic mailing, latency is per run, the list key caches are cleared before each one"""
+    _use_function("fastly_announce_purge")
+    import main
+    rows=generators.mailing(params["rows"], generators.parse_mix(params["mix"]), params["spread"], params["skew"], params["seed"])
+    times=[]
+    for _ in range(params["repeats"]):
+        main._list_keys_for.cache_clear()
+        main._year_keys_for.cache_clear()
+        start=time.perf_counter()
+        keys=main._process_announcements(rows)
+        times.append(time.perf_counter() - start)
+    return _result({"keys": len(keys), "requests": 0}, statistics.median(times), times, rows=len(rows))
+
+def _key_memory(params: Dict[str, Any], streamed: bool) -> Dict[str, Any]:
+    """the keys of a synthetic mailing, key_rss_kb is how much peak rss grew while they were worked out
+    the taxonomy is loaded and the mailing generated before the start, so only the keys are counted.
+    the list scenario also runs on commits from before key_store.py, for a baseline with --compare
+    """
+    _use_function("fastly_announce_purge")
+    import main
+    rows=generators.mailing(params["rows"], generators.parse_mix(params["mix"]), params["spread"], params["skew"], params["seed"])
+    main._process_announcements(rows[:1])
+    gc.collect()
+    before=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start=time.perf_counter()
+    if streamed:
+        from key_priority import KeyScheduler
+        from key_store import KeyStore
+        from purge_dispatch import FASTLY_MAX_KEYS_PER_PURGE, batched
+        store=KeyStore()
+        keys=main._announcement_codes(rows, store)
+        count=sum(len(batch) for batch in batched(KeyScheduler().order_codes(keys, store), FASTLY_MAX_KEYS_PER_PURGE))
+    else:
+        count=len(main._process_announcements(rows))
+    seconds=time.perf_counter() - start
+    grown=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    return _result({"keys": count, "requests": 0}, seconds, [seconds], rows=len(rows), key_rss_kb=grown)
+
+def announce_memory_list(params: Dict[str, Any]) -> Dict[str, Any]:
+    """_process_announcements, every key of the mailing as a string in one list"""
+    return _key_memory(params, streamed=False)
+
+def announce_memory_stream(params: Dict[str, Any]) -> Dict[str, Any]:
+    """the keys the way the announce purge takes them, kept as codes and rendered a batch at a time"""
+    return _key_memory(params, streamed=True)
+
+def announce_purge(params: Dict[str, Any]) -> Dict[str, Any]:
+    """_purge_announced_papers from rows to fake fastly, the database read replaced by the synthetic mailing
+    latency is per purge request, time_to_purge_ms is how long each priority tier took to be purged, see key_priority.py
+    """
+    _use_function("fastly_announce_purge")
+    os.environ["ENVIRONMENT"]="PRODUCTION"
+    os.environ["PURGE_MAX_IN_FLIGHT"]=str(params["max_in_flight"])
+    os.environ.pop("PURGE_STATE_PATH", None)
+    import main
+    from metrics import invocation
+    rows=generators.mailing(params["rows"], generators.parse_mix(params["mix"]), params["spread"], params["skew"], params["seed"])
+    with fake_fastly(params["fastly"]) as fake:
+        dispatcher=main._get_dispatcher()
+        dispatcher.client.transport=transport=Timed(dispatcher.client.transport)
+        start=time.perf_counter()
+        with patch("main._get_days_announcements", lambda **kwargs: iter(rows)), invocation("announce_purge") as metrics:
+            main._purge_announced_papers()
+        seconds=time.perf_counter() - start
+        time_to_purge={tier: round(seconds * 1000, 3) for tier, seconds in metrics.fields["time_to_purge"].items()}
+        return _result(fake.stats(), seconds, transport.samples, rows=len(rows), time_to_purge_ms=time_to_purge)
+
+def bucket_storm(params: Dict[str, Any]) -> Dict[str, Any]:
+    """invalidate_for_gs_change for every event of a storm, concurrency events at a time as an instance would take them
+    the invalidator is built from the environment, so PURGE_BATCH_WINDOW and PURGE_DEDUP_WINDOW in params env apply
+    latency is per event, request_p50_ms and request_p99_ms are per purge request
+    """
+    _use_function("purge_on_bucket_change")
+    os.environ.update({name: str(value) for name, value in params["env"].items()})
+    import main
+    events=generators.storm(params["papers"], params["objects_per_paper"], params["html_share"], params["noise"], seed=params["seed"])
+    with fake_fastly(params["fastly"]) as fake:
+        purger=main._purger()
+        purger.send=send=Timed(purger.send)
+        handle=Timed(lambda event: main.invalidate_for_gs_change(event[0], event[1], main._invalidator()))
+        start=time.perf_counter()
+        with ThreadPoolExecutor(params["concurrency"]) as pool:
+            list(pool.map(handle, events))
+        seconds=time.perf_counter() - start
+        requests=percentiles(send.samples)
+        return _result(fake.stats(), seconds, handle.samples, events=len(events),
+                       events_per_sec=round(len(events) / seconds, 1), request_p50_ms=requests["p50_ms"], request_p99_ms=requests["p99_ms"])
+
+def purge_layer(params: Dict[str, Any]) -> Dict[str, Any]:
+    """PurgeDispatcher with the pooled http transport sending synthetic keys to fake fastly, latency is per purge request"""
+    _use_function("fastly_announce_purge")
+    from purge_dispatch import HttpPurgeTransport, PurgeDispatcher
+    keys=generators.keys(params["keys"], params["seed"])
+    with fake_fastly(params["fastly"]) as fake:
+        transport=Timed(HttpPurgeTransport(SERVICE_IDS, "bench", fake.url, pool_size=params["max_in_flight"]))
+        dispatcher=PurgeDispatcher(transport, max_in_flight=params["max_in_flight"])
+        start=time.perf_counter()
+        dispatcher.purge(keys)
+        seconds=time.perf_counter() - start
+        return _result(fake.stats(), seconds, transport.samples)
+
+SCENARIOS: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]]={
+    "announce_keys": announce_keys,
+    "announce_memory_list": announce_memory_list,
+    "announce_memory_stream": announce_memory_stream,
+    "announce_purge": announce_purge,
+    "bucket_storm": bucket_storm,
+    "purge_layer": purge_layer,
+}
+
+def main() -> None:
+    os.environ.setdefault("LOG_LOCALLY", "True")
+    logging.basicConfig(level=logging.WARNING) #the scenarios call below the entry points, which would set up logging
+    name, params=sys.argv[1], json.loads(sys.argv[2])
+    result=SCENARIOS[name](params)
+    result["peak_rss_kb"]=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss #kilobytes on linux
+    print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""a local stand in for the fastly surrogate key purge api, for load and correctness testing of the purge paths offline
+
+POST /service/{service_id}/purge          keys in the Surrogate-Key header, or a {"surrogate_keys": [...]} json body, at most 256
+POST /service/{service_id}/purge/{key}    a single key
+Fastly-Soft-Purge: 1 marks a purge soft, with a token set requests need a matching Fastly-Key
+every purge request is recorded, with the status it got, and can be appended as json lines to a log file
+GET /_stats, GET /_requests and POST /_reset let tests check a server running in another process
+
+responses can be slowed with latency and jitter, rate limited (429 with Retry-After) above rate_limit purges a second,
+and failed: the next n requests with fail_next, any request with a key in fail_keys, or a random error_rate share of them
+
+run it on its own, so it doesn't share a process or the gil with what is being measured
+` python fake_fastly.py --latency 0.005 --rate-limit 100 --log /tmp/purges.jsonl ` prints the url to set FASTLY_API_URL to
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+FASTLY_MAX_KEYS_PER_PURGE=256
+
+
+@dataclass
+class PurgeRequest:
+    service_id: str
+    keys: List[str]
+    soft: bool
+    status: int
+    received: float
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads=True
+    request_queue_size=256 #the default of 5 makes a burst of new connections wait on syn retries
+
+
+class FakeFastly:
+    """runs in a background thread with start(), or as a context manager, url is what FASTLY_API_URL should be set to"""
+    def __init__(self, latency: float=0, jitter: float=0, rate_limit: float=0, error_rate: float=0, error_status: int=503,
+                 fail_keys: Iterable[str]=(), token: Optional[str]=None, log: Optional[str]=None,
+                 host: str="127.0.0.1", port: int=0, seed: Optional[int]=None) -> None:
+        self.latency=latency
+        self.jitter=jitter
+        self.rate_limit=rate_limit
+        self.error_rate=error_rate
+        self.error_status=error_status
+        self.fail_keys: Set[str]=set(fail_keys)
+        self.token=token
+        self.requests: List[PurgeRequest]=[]
+        self._log=open(log, "a") if log else None
+        self._failures: Deque[Tuple[int, Dict[str, str]]]=deque()
+        self._accepted: Deque[float]=deque() #times of the purges accepted in the last second, for the rate limit
+        self._rand=random.Random(seed)
+        self._lock=threading.Lock()
+        self._server=_Server((host, port), self._handler())
+        self._thread: Optional[threading.Thread]=None
+
+    @property
+    def url(self) -> str:
+        host, port=self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def purged(self) -> List[str]:
+        """keys of the purges that were answered with 200, in the order they arrived, repeats included"""
+        with self._lock:
+            return [key for request in self.requests if request.status == 200 for key in request.keys]
+
+    def purged_keys(self, service_id: Optional[str]=None, soft: Optional[bool]=None) -> Set[str]:
+        with self._lock:
+            return {key for request in self.requests if request.status == 200
+                    and service_id in (None, request.service_id) and soft in (None, request.soft) for key in request.keys}
+
+    def fail_next(self, n: int=1, status: int=503, headers: Optional[Dict[str, str]]=None) -> None:
+        """answers the next n purges with status, whatever their keys"""
+        with self._lock:
+            self._failures.extend([(status, headers or {})] * n)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            accepted=[request for request in self.requests if request.status == 200]
+            return {"requests": len(self.requests), "accepted": len(accepted),
+                    "rate_limited": sum(1 for request in self.requests if request.status == 429),
+                    "failed": sum(1 for request in self.requests if request.status not in (200, 429)),
+                    "keys": sum(len(request.keys) for request in accepted),
+                    "unique_keys": len({key for request in accepted for key in request.keys})}
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests=[]
+            self._failures.clear()
+            self._accepted.clear()
+
+    def start(self) -> "FakeFastly":
+        self._thread=threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._log:
+            self._log.close()
+
+    def __enter__(self) -> "FakeFastly":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _answer(self, keys: List[str]) -> Tuple[int, Dict[str, str]]:
+        """the status and extra headers for a purge of keys"""
+        with self._lock:
+            if self._failures:
+                return self._failures.popleft()
+            if self.fail_keys.intersection(keys):
+                return 500, {}
+            if self.error_rate and self._rand.random() < self.error_rate:
+                return self.error_status, {}
+            if self.rate_limit:
+                now=time.monotonic()
+                while self._accepted and now - self._accepted[0] >= 1:
+                    self._accepted.popleft()
+                if len(self._accepted) >= self.rate_limit:
+                    reset=self._accepted[0] + 1 - now
+                    return 429, {"Retry-After": str(max(1, round(reset))), "Fastly-RateLimit-Remaining": "0",
+                                 "Fastly-RateLimit-Reset": str(int(time.time() + reset))}
+                self._accepted.append(now)
+            return 200, {}
+
+    def _record(self, request: PurgeRequest) -> None:
+        with self._lock:
+            self.requests.append(request)
+            if self._log:
+                self._log.write(json.dumps(asdict(request)) + "\n")
+                self._log.flush()
+
+    def _delay(self) -> None:
+        if self.latency or self.jitter:
+            with self._lock:
+                jitter=self._rand.uniform(0, self.jitter) if self.jitter else 0
+            time.sleep(self.latency + jitter)
+
+    def _handler(self):
+        fake=self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version="HTTP/1.1" #keep alive, so pooled clients reuse their connections
+            disable_nagle_algorithm=True #headers and body go out as separate writes, without this each response waits on a delayed ack
+
+            def do_POST(self) -> None:
+                body=self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.path == "/_reset":
+                    fake.reset()
+                    self._reply(200, {"status": "ok"})
+                    return
+                parts=self.path.strip("/").split("/")
+                if len(parts) not in (3, 4) or parts[0] != "service" or parts[2] != "purge":
+                    self._reply(404, {"msg": "Record not found"})
+                    return
+                if fake.token is not None and self.headers.get("Fastly-Key") != fake.token:
+                    self._reply(401, {"msg": "Provided credentials are missing or invalid"})
+                    return
+                keys=self._keys(parts, body)
+                if keys is None:
+                    self._reply(400, {"msg": "Bad request", "detail": "no surrogate keys, or a body that isn't json"})
+                    return
+                if len(keys) > FASTLY_MAX_KEYS_PER_PURGE:
+                    self._reply(400, {"msg": "Bad request", "detail": f"at most {FASTLY_MAX_KEYS_PER_PURGE} keys per purge"})
+                    return
+
+                status, headers=fake._answer(keys)
+                fake._delay()
+                fake._record(PurgeRequest(parts[1], keys, self.headers.get("Fastly-Soft-Purge") == "1", status, time.time()))
+                if status != 200:
+                    self._reply(status, {"msg": "rate limited" if status == 429 else "injected error"}, headers)
+                elif len(parts) == 4:
+                    self._reply(200, {"status": "ok", "id": f"purge-{keys[0]}"})
+                else:
+                    self._reply(200, {key: f"purge-{key}" for key in keys})
+
+            def do_GET(self) -> None:
+                if self.path == "/_stats":
+                    self._reply(200, fake.stats())
+                elif self.path == "/_requests":
+                    with fake._lock:
+                        self._reply(200, [asdict(request) for request in fake.requests])
+                else:
+                    self._reply(404, {"msg": "Record not found"})
+
+            def _keys(self, parts: List[str], body: bytes) -> Optional[List[str]]:
+                if len(parts) == 4:
+                    return [parts[3]]
+                if header := self.headers.get("Surrogate-Key", "").split():
+                    return header
+                try:
+                    keys=json.loads(body).get("surrogate_keys") if body else None
+                except (ValueError, AttributeError):
+                    return None
+                return [str(key) for key in keys] if isinstance(keys, list) and keys else None
+
+            def _reply(self, status: int, payload, headers: Optional[Dict[str, str]]=None) -> None:
+                body=json.dumps(payload).encode()
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        return Handler
+
+
+def main() -> None:
+    parser=argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--latency", type=float, default=0, help="seconds to wait before answering each purge")
+    parser.add_argument("--jitter", type=float, default=0, help="up to this many more seconds, at random")
+    parser.add_argument("--rate-limit", type=float, default=0, help="purges accepted a second before answering 429, 0 for no limit")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of purges answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--fail-key", action="append", default=[], help="purges with this key get a 500, can be repeated")
+    parser.add_argument("--token", help="Fastly-Key requests must have, any is accepted when not set")
+    parser.add_argument("--log", help="file to append every request to, as json lines")
+    parser.add_argument("--seed", type=int)
+    args=parser.parse_args()
+    fake=FakeFastly(args.latency, args.jitter, args.rate_limit, args.error_rate, args.error_status, args.fail_key,
+                    args.token, args.log, args.host, args.port, args.seed)
+    print(fake.url, flush=True)
+    try:
+        fake.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
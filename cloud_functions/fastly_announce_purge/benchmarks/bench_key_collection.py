@@ -0,0 +1,91 @@
+"""compares accumulating announce keys with a new set per row (lists = lists | ...) against KeyCollector
+
+run from the fastly_announce_purge folder
+` python benchmarks/bench_key_collection.py --rows 20000 `
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Callable, List, Tuple
+
+os.environ.setdefault("LOG_LOCALLY", "True")
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from arxiv.identifier import Identifier
+from main import _process_announcements, _list_keys_for, _year_keys_for
+
+Row = Tuple[str, int, str, str, str]
+
+CATEGORY_STRINGS=[
+    "cs.LG", "cs.LG stat.ML", "cs.CV", "cs.CL cs.AI", "math.NA cs.NA", "math.AP", "math.PR math.ST stat.TH",
+    "hep-th", "hep-ph hep-ex", "hep-lat", "astro-ph.SR", "astro-ph.GA astro-ph.CO", "cond-mat.mes-hall",
+    "cond-mat.str-el cond-mat.supr-con", "quant-ph", "gr-qc hep-th", "eess.AS cs.SD", "q-bio.NC", "econ.EM",
+]
+METHODS=["new"]*5 + ["cross"]*2 + ["rep"]*3 + ["jref", "wdr"]
+
+def synthetic_mailing(rows: int, seed: int=0) -> List[Row]:
+    """a mailing shaped like a heavy announce day, older papers spread over the years of modern ids"""
+    rand=random.Random(seed)
+    mailing=[]
+    for n in range(rows):
+        method=rand.choice(METHODS)
+        if method == "new":
+            paper_id=f"2410.{n:05d}"
+        else:
+            year=rand.randint(8, 24)
+            yymm=f"{year:02d}{rand.randint(1, 12):02d}"
+            paper_id=f"{yymm}.{rand.randint(1, 9999):04d}" if year < 15 else f"{yymm}.{rand.randint(1, 29999):05d}"
+        categories=rand.choice(CATEGORY_STRINGS)
+        extra=categories.split()[-1] if method == "cross" else ""
+        mailing.append((paper_id, rand.randint(1, 5), method, categories, extra))
+    return mailing
+
+def legacy_keys(announcements: List[Row]) -> List[str]:
+    """key accumulation the way it was done before KeyCollector, a new set is built for every row
+    uses the same cached list key expansions as _process_announcements
+    """
+    keys=[]
+    lists=set()
+    for paper_id, version, method, categories, extra in announcements:
+        keys.append(f"abs-{paper_id}")
+        if method == "new":
+            keys.append(f"paper-id-{paper_id}-current")
+            keys.append(f"paper-id-{paper_id}v1")
+            continue
+        if method == "rep":
+            keys.append(f"paper-id-{paper_id}-current")
+        if method in ("rep", "wdr"):
+            keys.append(f"paper-id-{paper_id}v{version}")
+        arxiv_id=Identifier(paper_id)
+        lists= lists | _list_keys_for(categories, arxiv_id.year, arxiv_id.month)
+        if method == "cross":
+            lists= lists | _year_keys_for(extra, arxiv_id.year)
+    return keys + list(lists)
+
+def best_of(fun: Callable[[List[Row]], List[str]], mailing: List[Row], repeats: int) -> Tuple[float, int]:
+    times=[]
+    for _ in range(repeats):
+        start=time.perf_counter()
+        keys=fun(mailing)
+        times.append(time.perf_counter()-start)
+    return min(times), len(keys)
+
+def main() -> None:
+    parser=argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args=parser.parse_args()
+
+    mailing=synthetic_mailing(args.rows)
+    _process_announcements(mailing) #warm the list key caches for both runs
+
+    legacy_time, legacy_count=best_of(legacy_keys, mailing, args.repeats)
+    new_time, new_count=best_of(_process_announcements, mailing, args.repeats)
+    print(f"rows: {args.rows}")
+    print(f"set union per row: {legacy_time*1000:.1f} ms, {legacy_count} keys")
+    print(f"KeyCollector:      {new_time*1000:.1f} ms, {new_count} keys")
+    print(f"speedup: {legacy_time/new_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
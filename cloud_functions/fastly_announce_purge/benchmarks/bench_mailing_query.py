@@ -0,0 +1,108 @@
+"""times the mailing query against a generated sqlite classic db with millions of metadata rows,
+before and after the recommended indexes, comparing the old max(mail_id) subquery with looking the mail_id up first
+
+run from the fastly_announce_purge folder, the db file is regenerated on every run
+` python benchmarks/bench_mailing_query.py --documents 1000000 --db /tmp/announce_bench.db `
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Callable, List, Tuple
+
+os.environ.setdefault("LOG_LOCALLY", "True")
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "tests") )
+from sqlalchemy import func
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, aliased
+
+from arxiv.db.models import Metadata, NextMail
+from announce_db import fixture_engine, fixture_session, create_indexes, mail_table, meta_table
+from mailing_query import explain, latest_mail_id, mailing_rows
+
+CATEGORY_STRINGS=["cs.LG stat.ML", "math.NA cs.NA", "hep-th", "hep-ph hep-ex", "astro-ph.GA astro-ph.CO", "quant-ph", "cond-mat.str-el"]
+METHODS=["new", "new", "new", "cross", "rep", "rep", "jref", "wdr"]
+CHUNK=50000
+
+def generate(engine: Engine, documents: int, mailings: int, mailing_size: int, seed: int=0) -> None:
+    """documents with one to four metadata versions each, the last one current, and mailings of mailing_size rows"""
+    rand=random.Random(seed)
+    with engine.begin() as conn:
+        metadata=[]
+        for document_id in range(1, documents + 1):
+            versions=rand.randint(1, 4)
+            for version in range(1, versions + 1):
+                metadata.append({"document_id": document_id, "abs_categories": rand.choice(CATEGORY_STRINGS), "is_current": int(version == versions)})
+            if len(metadata) >= CHUNK:
+                conn.execute(meta_table.insert(), metadata)
+                metadata=[]
+        if metadata:
+            conn.execute(meta_table.insert(), metadata)
+
+        for mailing in range(mailings):
+            mail_id=f"{240000 + mailing:06d}"
+            conn.execute(mail_table.insert(), [
+                {"mail_id": mail_id, "document_id": (document_id := rand.randint(1, documents)), "paper_id": f"2401.{document_id:05d}",
+                 "version": rand.randint(1, 4), "type": rand.choice(METHODS), "extra": ""}
+                for _ in range(mailing_size)])
+
+def subquery_rows(session: Session) -> List[Tuple]:
+    """the query as it was, the latest mail_id as a scalar subquery and is_current as a filter"""
+    mail= aliased(NextMail)
+    meta=aliased(Metadata)
+    today=session.query(func.max(mail.mail_id)).scalar_subquery()
+    return (
+        session.query(mail.paper_id, mail.version, mail.type, meta.abs_categories, mail.extra)
+        .join(meta, mail.document_id == meta.document_id)
+        .filter(mail.mail_id == today)
+        .filter(meta.is_current==1)
+        .all()
+    )
+
+def lookup_first_rows(session: Session) -> List[Tuple]:
+    return list(mailing_rows(session, latest_mail_id(session), 1000))
+
+def best_of(fun: Callable[[Session], List[Tuple]], session: Session, repeats: int) -> Tuple[float, int]:
+    times=[]
+    for _ in range(repeats):
+        start=time.perf_counter()
+        rows=fun(session)
+        times.append(time.perf_counter()-start)
+    return min(times), len(rows)
+
+def run(label: str, session: Session, repeats: int) -> None:
+    for name, fun in (("max(mail_id) subquery", subquery_rows), ("mail_id looked up first", lookup_first_rows)):
+        seconds, rows=best_of(fun, session, repeats)
+        print(f"{label:<16} {name:<24} {seconds*1000:9.1f} ms  {rows} rows")
+
+def main() -> None:
+    parser=argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=1000000, help="documents, each with 1 to 4 metadata rows")
+    parser.add_argument("--mailings", type=int, default=300)
+    parser.add_argument("--mailing-size", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--db", default="/tmp/announce_bench.db", help="sqlite file, replaced on every run")
+    args=parser.parse_args()
+
+    if os.path.exists(args.db):
+        os.remove(args.db) #indexes are added part way through, so always start from an unindexed db
+    engine=fixture_engine(f"sqlite:///{args.db}", indexes=False)
+    start=time.perf_counter()
+    generate(engine, args.documents, args.mailings, args.mailing_size)
+    with engine.connect() as conn:
+        print(f"generated {conn.scalar(func.count().select().select_from(meta_table))} metadata rows and "
+              f"{conn.scalar(func.count().select().select_from(mail_table))} mailing rows in {time.perf_counter()-start:.0f}s")
+
+    session=fixture_session(engine)
+    run("no indexes", session, args.repeats)
+    session.close()
+    create_indexes(engine)
+    session=fixture_session(engine)
+    run("with indexes", session, args.repeats)
+    print("plan:", *explain(session, latest_mail_id(session)), sep="\n    ")
+    session.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""engine and connection pool for the classic db, kept between warm invocations, with query timing for each invocation
+
+the engine is shared by every invocation of the instance, so its timings are counted on the metrics of the invocation
+running the query, see metrics.py, rather than on the Database
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, Optional, TypeVar
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, sessionmaker
+
+from metrics import current
+
+T = TypeVar("T")
+
+
+@dataclass
+class PoolSettings:
+    pool_size: int=2 #one query per invocation, the spare covers a retry overlapping a slow close
+    max_overflow: int=0
+    pool_timeout: float=30
+    pool_recycle: int=3600 #seconds, replaces connections before mysql's wait_timeout drops them
+    pre_ping: bool=True #announcements are a day apart, so check a pooled connection is still alive before using it
+
+    @classmethod
+    def from_env(cls) -> "PoolSettings":
+        return cls(pool_size=int(os.environ.get("DB_POOL_SIZE", cls.pool_size)),
+                   max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", cls.max_overflow)),
+                   pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", cls.pool_timeout)),
+                   pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", cls.pool_recycle)),
+                   pre_ping=os.environ.get("DB_POOL_PRE_PING", "true").lower() not in ("0", "false", "no"))
+
+    def engine_kwargs(self, url: str) -> Dict[str, Any]:
+        kwargs: Dict[str, Any]={"pool_pre_ping": self.pre_ping, "pool_recycle": self.pool_recycle}
+        if make_url(url).get_backend_name() != "sqlite": #sqlite's in memory pool takes no size settings
+            kwargs.update(pool_size=self.pool_size, max_overflow=self.max_overflow, pool_timeout=self.pool_timeout)
+        return kwargs
+
+
+@dataclass
+class QueryStats:
+    """what one invocation did with the database"""
+    queries: int=0
+    execute_seconds: float=0 #running statements
+    fetch_seconds: float=0 #waiting on rows passed through Database.timed, includes executing their query
+    rows: int=0
+    connects: int=0 #new connections opened, 0 when a warm invocation reuses a pooled one
+    checkouts: int=0
+
+    @classmethod
+    def of_invocation(cls) -> "QueryStats":
+        """the stats counted on the running invocation's metrics, across all its sessions"""
+        metrics=current()
+        return cls(queries=metrics.counts["db_queries"], execute_seconds=metrics.stages["db_execute"],
+                   fetch_seconds=metrics.stages["db_fetch"], rows=metrics.counts["db_rows"],
+                   connects=metrics.counts["db_connects"], checkouts=metrics.counts["db_checkouts"])
+
+
+class Database:
+    """owns the engine, hands out a session per invocation and times what runs on it"""
+    def __init__(self, url: str, settings: Optional[PoolSettings]=None, **engine_kwargs: Any) -> None:
+        self.settings=settings or PoolSettings()
+        self.engine: Engine=create_engine(url, **self.settings.engine_kwargs(url), **engine_kwargs)
+        self._sessions=sessionmaker(bind=self.engine)
+        event.listen(self.engine, "connect", self._on_connect)
+        event.listen(self.engine, "checkout", self._on_checkout)
+        event.listen(self.engine, "before_cursor_execute", self._before_execute)
+        event.listen(self.engine, "after_cursor_execute", self._after_execute)
+
+    @property
+    def stats(self) -> QueryStats:
+        return QueryStats.of_invocation()
+
+    @contextmanager
+    def session(self) -> Iterator[Session]:
+        """a session for one invocation, its connection goes back to the pool when done and the invocation's timings so far are logged"""
+        session=self._sessions()
+        try:
+            yield session
+        finally:
+            session.close()
+            stats=self.stats
+            logging.info(f"DB: {stats.queries} queries in {stats.execute_seconds*1000:.1f}ms, {stats.rows} rows waited on for {stats.fetch_seconds*1000:.1f}ms, "
+                         f"{stats.connects} new connections for {stats.checkouts} checkouts, pool: {self.engine.pool.status()}")
+
+    def timed(self, rows: Iterable[T]) -> Iterator[T]:
+        """yields rows, adding the time spent waiting for each to this invocation's fetch time"""
+        metrics=current()
+        for row in metrics.timed(rows, "db_fetch"):
+            metrics.count("db_rows")
+            yield row
+
+    def dispose(self) -> None:
+        self.engine.dispose()
+
+    def _on_connect(self, dbapi_connection, connection_record) -> None:
+        current().count("db_connects")
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        current().count("db_checkouts")
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        metrics=current()
+        metrics.add_time("db_execute", time.perf_counter() - conn.info["query_start"].pop())
+        metrics.count("db_queries")
+
+
+def database_from_env() -> Database:
+    """the classic db at CLASSIC_DB_URI, falling back to arxiv-base's setting, with pool settings from DB_POOL_* variables"""
+    url=os.environ.get("CLASSIC_DB_URI")
+    if not url:
+        from arxiv.config import settings
+        url=str(settings.CLASSIC_DB_URI)
+    return Database(url, PoolSettings.from_env())
@@ -0,0 +1,45 @@
+"""deduplicating accumulator for purge keys"""
+from collections import Counter
+from typing import Hashable, Iterable, Iterator, Set, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+
+def key_family(key: str) -> str:
+    """the kind of page a key purges, ex abs, paper-id, list, year"""
+    if key.startswith("paper-id-"):
+        return "paper-id"
+    return key.split("-", 1)[0]
+
+
+class KeyCollector:
+    """collects keys in the order they are first seen, dropping repeats
+    keeps a running count of new keys per family and of how many repeats were dropped
+    """
+    def __init__(self) -> None:
+        self._seen: Set[Hashable]=set()
+        self.families: Counter=Counter()
+        self.duplicates=0
+
+    family=staticmethod(key_family)
+
+    def add(self, key: Hashable) -> bool:
+        """adds key, returns False if it was already collected"""
+        if key in self._seen:
+            self.duplicates+=1
+            return False
+        self._seen.add(key)
+        self.families[self.family(key)]+=1
+        return True
+
+    def new(self, keys: Iterable[K]) -> Iterator[K]:
+        """adds keys, yielding only the ones not collected before"""
+        for key in keys:
+            if self.add(key):
+                yield key
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._seen
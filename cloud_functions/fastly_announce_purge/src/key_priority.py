@@ -0,0 +1,112 @@
+"""orders purge keys so the pages read most right after an announcement are purged first
+
+hot          abstracts, current (versionless) paper pages and list pages of this and last month
+versions     the pages of a paper's specific versions
+recent_lists list and year pages of this and last month's years
+archive      list and year pages of older years, most of the keys on a big day and the least read
+
+hot keys are passed on as soon as they are generated, so the purge still starts while rows are being read,
+the others are held until the keys run out and then passed on tier by tier. the top tier always goes out first,
+however many old list pages a mailing touches and however slowly the rate limit lets batches through
+"""
+import time
+from array import array
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from key_store import ABS, CURRENT, VERSION, LIST_MONTH, NUMBER_MASK, TEMPLATE_BITS, TEMPLATE_MASK, KeyStore
+
+TIERS=("hot", "versions", "recent_lists", "archive")
+HOT, VERSIONS, RECENT_LISTS, ARCHIVE=range(len(TIERS))
+
+
+class KeyPriority:
+    """the tier of a key, with this and last month as of today counted as current"""
+    def __init__(self, today: Optional[date]=None) -> None:
+        today=today or datetime.now(timezone.utc).date()
+        last=today.replace(day=1) - timedelta(days=1) #papers announced early in a month are mostly from the month before
+        self.months=frozenset(f"{day.year:04d}-{day.month:02d}" for day in (today, last))
+        self.years=frozenset(month[:4] for month in self.months)
+        #the same, as the numbers of key codes
+        self.month_numbers=frozenset(day.year * 100 + day.month for day in (today, last))
+        self.year_numbers=frozenset(day.year for day in (today, last))
+
+    def tier(self, key: str) -> int:
+        if key.startswith("abs-"):
+            return HOT
+        if key.startswith("paper-id-"):
+            return HOT if key.endswith("-current") else VERSIONS
+        if key.startswith("list-"): #list-YYYY-cat or list-YYYY-MM-cat
+            if key[10:12].isdigit() and key[12:13] == "-" and key[5:12] in self.months:
+                return HOT
+            return RECENT_LISTS if key[5:9] in self.years else ARCHIVE
+        if key.startswith("year-"): #year-arch-YYYY
+            return RECENT_LISTS if key[-4:] in self.years else ARCHIVE
+        return HOT #nothing known to put it behind
+
+    def code_tier(self, code: int) -> int:
+        """the tier of a key code from key_store.py, without rendering it"""
+        template, number=code & TEMPLATE_MASK, code >> TEMPLATE_BITS & NUMBER_MASK
+        if template in (ABS, CURRENT):
+            return HOT
+        if template == VERSION:
+            return VERSIONS
+        if template == LIST_MONTH:
+            if number in self.month_numbers:
+                return HOT
+            number//=100
+        return RECENT_LISTS if number in self.year_numbers else ARCHIVE
+
+
+class KeyScheduler:
+    """puts keys in priority order and keeps, per tier, how many keys it had and when the last of them was confirmed purged
+    times are seconds from start on clock, the start of the invocation, so they are what a reader waits after announce
+    """
+    def __init__(self, priority: Optional[KeyPriority]=None, clock: Callable[[], float]=time.perf_counter,
+                 start: Optional[float]=None) -> None:
+        self.priority=priority or KeyPriority()
+        self.clock=clock
+        self.start=clock() if start is None else start
+        self.counts: Counter=Counter()
+        self.purged_at: Dict[str, float]={}
+
+    def order(self, keys: Iterable[str]) -> Iterator[str]:
+        """yields hot keys as they come, then once keys run out the rest a tier at a time, each in the order it was generated"""
+        held: List[List[str]]=[[] for _ in TIERS]
+        for key in keys:
+            tier=self.priority.tier(key)
+            self.counts[TIERS[tier]]+=1
+            if tier == HOT:
+                yield key
+            else:
+                held[tier].append(key)
+        for tier_keys in held:
+            yield from tier_keys
+            tier_keys.clear()
+
+    def order_codes(self, codes: Iterable[int], store: KeyStore) -> Iterator[str]:
+        """order for key codes, held back as 8 bytes each and rendered only as they are yielded"""
+        held: List[array]=[array("q") for _ in TIERS]
+        for code in codes:
+            tier=self.priority.code_tier(code)
+            self.counts[TIERS[tier]]+=1
+            if tier == HOT:
+                yield store.render(code)
+            else:
+                held[tier].append(code)
+        for tier in range(len(TIERS)):
+            tier_codes, held[tier]=held[tier], array("q")
+            for code in tier_codes:
+                yield store.render(code)
+
+    def confirmed(self, batch: Iterable[str]) -> None:
+        """marks the keys of a batch fastly accepted as purged now, across services a tier's time is its slowest"""
+        elapsed=self.clock() - self.start
+        for tier in {self.priority.tier(key) for key in batch}:
+            name=TIERS[tier]
+            self.purged_at[name]=max(elapsed, self.purged_at.get(name, 0.0))
+
+    def time_to_purge(self) -> Dict[str, float]:
+        """seconds until the last key of each tier was purged, in tier order"""
+        return {name: round(self.purged_at[name], 3) for name in TIERS if name in self.purged_at}
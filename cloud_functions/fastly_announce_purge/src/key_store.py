@@ -0,0 +1,160 @@
+"""announce keys as integer codes, a template and what fills it in, rendered to text only as a batch is sent
+
+a big mailing touches tens of thousands of keys, most of them two or three per paper. as strings each is an object of 60 to 80 bytes,
+held in the set of keys seen, in the lists kept back for priority and in what the services haven't taken yet.
+as codes a paper is its id, interned once, and a few bits and bytes of what was collected for it, a key held back for priority is 8 bytes
+in an array, and the text of a key only exists from when a batch is filled until its purge request is sent.
+list and year keys come from the few categories and months of a mailing and stay in the set of codes seen
+
+code = name << NAME_SHIFT | number << TEMPLATE_BITS | template, see encode and decode. code that runs for every key decodes
+it inline with the constants below rather than calling decode
+name     index of the paper id in the KeyStore, or of the category id in the table shared by the instance
+number   the version, year or year*100+month the template needs
+"""
+import threading
+from array import array
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Tuple
+
+from key_collector import KeyCollector
+
+ABS, CURRENT, VERSION, LIST_YEAR, LIST_MONTH, YEAR=range(6)
+FAMILIES=("abs", "paper-id", "paper-id", "list", "list", "year")
+PAPER_TEMPLATES=frozenset({ABS, CURRENT, VERSION})
+PHYSICS_GROUP="grp_physics"
+
+TEMPLATE_BITS=4
+TEMPLATE_MASK=(1 << TEMPLATE_BITS) - 1
+NAME_SHIFT=24
+NUMBER_MASK=(1 << (NAME_SHIFT - TEMPLATE_BITS)) - 1
+
+
+class _Names:
+    """strings interned to the index they were first seen at"""
+    def __init__(self) -> None:
+        self.names: List[str]=[]
+        self._index: Dict[str, int]={}
+        self._lock=threading.Lock()
+
+    def intern(self, name: str) -> int:
+        found=self._index.get(name)
+        if found is not None:
+            return found
+        with self._lock:
+            if name not in self._index:
+                self._index[name]=len(self.names)
+                self.names.append(name)
+            return self._index[name]
+
+#category and archive ids, bounded by the taxonomy, kept for the instance like the list key caches whose codes point into it
+_categories=_Names()
+
+
+def encode(template: int, name: int, number: int=0) -> int:
+    return name << NAME_SHIFT | number << TEMPLATE_BITS | template
+
+def decode(code: int) -> Tuple[int, int, int]:
+    """(template, name, number) of a code"""
+    return code & TEMPLATE_MASK, code >> NAME_SHIFT, code >> TEMPLATE_BITS & NUMBER_MASK
+
+def list_codes(lists: Iterable[str], year: int, month: int, physics: bool) -> FrozenSet[int]:
+    """codes of the list pages of TaxonomyIndex.list_keys"""
+    codes=set()
+    for id in lists:
+        name=_categories.intern(id)
+        codes.add(encode(LIST_YEAR, name, year))
+        codes.add(encode(LIST_MONTH, name, year * 100 + month))
+    if physics:
+        codes.add(encode(LIST_MONTH, _categories.intern(PHYSICS_GROUP), year * 100 + month))
+    return frozenset(codes)
+
+def year_codes(archives: Iterable[str], year: int) -> FrozenSet[int]:
+    """codes of the year pages of TaxonomyIndex.year_keys"""
+    return frozenset(encode(YEAR, _categories.intern(arch), year) for arch in archives)
+
+
+class KeyStore(KeyCollector):
+    """a KeyCollector of codes, with the paper ids of its paper keys, one per mailing
+    paper keys are marked collected on their paper rather than kept in the set of codes seen
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self._papers: List[str]=[]
+        self._paper_index: Dict[str, int]={} #only the invocation's own thread uses it, so no _Names and its lock
+        self._flags=bytearray() #per paper, a bit for each of ABS and CURRENT once collected
+        self._versions=array("I") #per paper, the version of its VERSION key once collected, 0 before
+        self._paper_keys=0
+
+    def paper(self, paper_id: str) -> int:
+        """the name of paper_id for encode"""
+        name=self._paper_index.get(paper_id)
+        if name is None:
+            name=self._paper_index[paper_id]=len(self._papers)
+            self._papers.append(paper_id)
+            self._flags.append(0)
+            self._versions.append(0)
+        return name
+
+    def add(self, code: int) -> bool:  # type: ignore[override]
+        template=code & TEMPLATE_MASK
+        if template > VERSION:
+            return super().add(code)
+        name=code >> NAME_SHIFT
+        if template == VERSION:
+            version=code >> TEMPLATE_BITS & NUMBER_MASK
+            seen=self._versions[name]
+            if seen == version:
+                self.duplicates+=1
+                return False
+            if seen: #another version of the paper in the same mailing, rare enough for the set
+                return super().add(code)
+            self._versions[name]=version
+        else:
+            bit=1 << template
+            if self._flags[name] & bit:
+                self.duplicates+=1
+                return False
+            self._flags[name]|=bit
+        self._paper_keys+=1
+        self.families[FAMILIES[template]]+=1
+        return True
+
+    def new(self, codes: Iterable[int]) -> Iterator[int]:  # type: ignore[override]
+        """KeyCollector.new with add inline, it runs for every key of the mailing"""
+        add=self.add
+        seen=self._seen
+        for code in codes:
+            if code & TEMPLATE_MASK > VERSION and code in seen: #most list and year keys are repeats, counted without a call
+                self.duplicates+=1
+            elif add(code):
+                yield code
+
+    def __len__(self) -> int:
+        return super().__len__() + self._paper_keys
+
+    def __contains__(self, code: object) -> bool:
+        if not isinstance(code, int) or code & TEMPLATE_MASK > VERSION or code >> NAME_SHIFT >= len(self._flags):
+            return super().__contains__(code)
+        name=code >> NAME_SHIFT
+        if code & TEMPLATE_MASK == VERSION:
+            return self._versions[name] == code >> TEMPLATE_BITS & NUMBER_MASK or super().__contains__(code)
+        return bool(self._flags[name] & 1 << (code & TEMPLATE_MASK))
+
+    @staticmethod
+    def family(code: int) -> str:
+        return FAMILIES[code & TEMPLATE_MASK]
+
+    def render(self, code: int) -> str:
+        template, number, name=code & TEMPLATE_MASK, code >> TEMPLATE_BITS & NUMBER_MASK, code >> NAME_SHIFT
+        if template in PAPER_TEMPLATES:
+            paper_id=self._papers[name]
+            if template == ABS:
+                return f"abs-{paper_id}"
+            if template == CURRENT:
+                return f"paper-id-{paper_id}-current"
+            return f"paper-id-{paper_id}v{number}"
+        id=_categories.names[name]
+        if template == LIST_YEAR:
+            return f"list-{number:04d}-{id}"
+        if template == LIST_MONTH:
+            return f"list-{number // 100:04d}-{number % 100:02d}-{id}"
+        return f"year-{id}-{number}"
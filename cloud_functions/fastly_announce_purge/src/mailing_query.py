@@ -0,0 +1,64 @@
+"""the query for the most recent mailing, and the indexes it is planned around
+
+the latest mail_id is resolved first on its own, so the mailing query is a lookup of one mail_id's rows
+joined to just the current metadata of each document, reading only the columns the keys are built from.
+with the indexes below both steps are index only lookups, however much history the tables hold.
+` python mailing_query.py ` prints the index ddl
+"""
+import logging
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import Select, func, select, text
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from arxiv.db.models import Metadata, NextMail
+
+
+def recommended_indexes() -> List[Tuple[str, str, List[str]]]:
+    """(index name, table, columns) for the classic db
+    mail_id first serves max(mail_id) from the end of the index and finds the mailing's rows, document_id is carried for the join.
+    document_id, is_current, abs_categories answers the metadata side of the join without reading the table
+    """
+    mail=NextMail.__table__.c
+    meta=Metadata.__table__.c
+    return [
+        ("ix_next_mail_mail_id_document", NextMail.__tablename__, [mail.mail_id.name, mail.document_id.name]),
+        ("ix_metadata_document_current", Metadata.__tablename__, [meta.document_id.name, meta.is_current.name, meta.abs_categories.name]),
+    ]
+
+
+def index_ddl() -> List[str]:
+    return [f"CREATE INDEX {name} ON {table} ({', '.join(columns)});" for name, table, columns in recommended_indexes()]
+
+
+def latest_mail_id(session: Session) -> Optional[str]:
+    return session.scalar(select(func.max(NextMail.mail_id)))
+
+
+def mailing_query(mail_id: str) -> Select:
+    """(paper_id, version, type of announcement, the papers category string, extra data) for each row of one mailing"""
+    return (
+        select(NextMail.paper_id, NextMail.version, NextMail.type, Metadata.abs_categories, NextMail.extra)
+        .join(Metadata, (NextMail.document_id == Metadata.document_id) & (Metadata.is_current == 1))
+        .where(NextMail.mail_id == mail_id)
+    )
+
+
+def mailing_rows(session: Session, mail_id: str, batch_size: int) -> Iterator[Row]:
+    """streams the mailing's rows batch_size at a time"""
+    yield from session.execute(mailing_query(mail_id).execution_options(yield_per=batch_size))
+
+
+def explain(session: Session, mail_id: str) -> List[str]:
+    """the database's plan for the mailing query, one line per step (EXPLAIN QUERY PLAN on sqlite, EXPLAIN on mysql)"""
+    dialect=session.get_bind().dialect
+    statement=mailing_query(mail_id).compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+    prefix="EXPLAIN QUERY PLAN" if dialect.name == "sqlite" else "EXPLAIN"
+    plan=[" ".join(str(value) for value in row) for row in session.execute(text(f"{prefix} {statement}"))]
+    logging.debug(f"Plan for mailing {mail_id}: {plan}")
+    return plan
+
+
+if __name__ == "__main__":
+    print("\n".join(index_ddl()))
@@ -1,150 +1,308 @@
 import json
 import base64
+import logging
 import os
-from typing import List, Tuple, Set
+from functools import lru_cache
+from itertools import chain, islice, tee
+from typing import TYPE_CHECKING, Callable, Dict, FrozenSet, Iterable, Iterator, List, Sequence, Tuple, Optional
 
 import functions_framework
 from cloudevents.http import CloudEvent
 
-from sqlalchemy.orm import aliased
-from sqlalchemy import func
+from key_priority import KeyScheduler
+from key_store import ABS, CURRENT, VERSION, KeyStore, encode, list_codes, year_codes
+from metrics import current, instrumented
+from paper_ids import year_months
+from purge_dispatch import DispatchResult, PurgeDispatcher, PurgeError, batched, dispatcher_from_env
+from run_state import MailingRun, RunStateStore, run_state_from_env
+from services import service_plan
+from startup import Lazy, setup_logging
+from taxonomy_index import TaxonomyIndex, taxonomy_index_from_env
 
-from arxiv.db import Session
-from arxiv.db.models import Metadata, NextMail
-from arxiv.identifier import Identifier
-from arxiv.integration.fastly.purge import purge_fastly_keys
-from arxiv.taxonomy.category import get_all_cats_from_string, Archive, Category, Group
+#sqlalchemy, arxiv.db (and the engine it creates) and the taxonomy are imported on first use to keep cold starts short
+if TYPE_CHECKING:
+    from sqlalchemy.orm import Session as SQLSession
+    from database import Database
 
-#logging setup
-if not(os.environ.get('LOG_LOCALLY')):
-    import google.cloud.logging
-    client = google.cloud.logging.Client()
-    client.setup_logging()
+LIST_KEY_CACHE_SIZE=int(os.environ.get('LIST_KEY_CACHE_SIZE', '4096'))
+ID_PARSE_BATCH=500
 
-import logging 
-log_level_str = os.getenv('LOG_LEVEL', 'INFO')
-log_level = getattr(logging, log_level_str.upper(), logging.INFO)
-logging.basicConfig(level=log_level)
+def _send_through_base(keys: List[str], service_name: str, soft_purge: bool) -> None:
+    purge_fastly_keys(keys, service_name, soft_purge=soft_purge)
+
+def _build_dispatcher() -> PurgeDispatcher:
+    return dispatcher_from_env(_send_through_base)
+
+#kept between warm invocations so its connection pool gets reused
+_dispatcher: Lazy[PurgeDispatcher]=Lazy(_build_dispatcher)
+
+def _get_dispatcher() -> PurgeDispatcher:
+    return _dispatcher.get()
+
+def _build_database() -> "Database":
+    from database import database_from_env
+    return database_from_env()
+
+#engine and its connection pool are kept between warm invocations
+_database: "Lazy[Database]"=Lazy(_build_database)
+
+def _get_database() -> "Database":
+    return _database.get()
+
+#every category's list and year page ids, worked out once per instance
+_taxonomy: Lazy[TaxonomyIndex]=Lazy(taxonomy_index_from_env)
+
+def _get_taxonomy() -> TaxonomyIndex:
+    return _taxonomy.get()
+
+#None unless PURGE_STATE_PATH is set
+_run_state: Lazy[Optional[RunStateStore]]=Lazy(run_state_from_env)
+
+def _get_run_state() -> Optional[RunStateStore]:
+    return _run_state.get()
+
+def purge_fastly_keys(*args, **kwargs) -> None:
+    """arxiv.integration.fastly.purge.purge_fastly_keys, imported on first use"""
+    from arxiv.integration.fastly.purge import purge_fastly_keys as purge
+    purge(*args, **kwargs)
 
 @functions_framework.cloud_event
+@instrumented("purge_for_announce")
 def purge_for_announce(cloud_event: CloudEvent):
     """ this function runs at the end of announce, purges all things from fastly that needs to be purged for the new announcement.
     functions-framework --target=purge_for_announce --signature-type=cloudevent
     """
+    setup_logging()
 
     data=json.loads(base64.b64decode(cloud_event.get_data()['message']['data']).decode())
     event= data.get("event")
+    current().set("event", event)
 
     if event =="announcement_complete":
-        _purge_announced_papers()
+        #with run state a redelivered event resumes the mailing's purge, or does nothing once it completed. "force": true purges it all again
+        state=_get_run_state()
+        mail_id=_latest_mail_id() if state is not None else None
+        if state is not None and mail_id is not None:
+            if data.get("force"):
+                state.forget(mail_id)
+            elif state.completed(mail_id):
+                logging.info(f"Mailing {mail_id} already purged, ignoring repeated announcement_complete")
+                current().set("skipped", f"mailing {mail_id} already complete")
+                return
 
-        #purge everything with daily data
-        environment = os.environ.get('ENVIRONMENT')
-        if environment == "PRODUCTION":
-            purge_fastly_keys("announce")
-            purge_fastly_keys("announce","rss.arxiv.org")
-            #purge_fastly_keys("announce","export.arxiv.org") #not currently live from fastly
-            logging.info("Purged announcement key for production")
-        elif environment == "DEVELOPMENT":
-            purge_fastly_keys("announce", "browse.dev.arxiv.org")
-            logging.info("Purged announcement key for development")
-        else:
+        environment=os.environ.get('ENVIRONMENT')
+        plan=service_plan(environment)
+        if plan is None:
             logging.warning(f"Announcement event caught, but no environment to purge cache. ENVIRONMENT: {environment}")
+            return
+        _purge_announced_papers(mail_id, plan.papers)
+
+        #purge everything with daily data
+        if not plan.announce:
+            logging.warning(f"Announcement event caught, but no services to purge the announce key on. ENVIRONMENT: {environment}")
+            return
+        _purge_announce_key(plan.announce)
+        logging.info(f"Purged announcement key for {environment} on {', '.join(plan.announce)}")
+        if state is not None and mail_id is not None:
+            state.complete(mail_id)
+
+
+def _purge_announce_key(services: Sequence[str]) -> Dict[str, DispatchResult]:
+    """the announce key, on every service at once"""
+    results: Dict[str, DispatchResult]={}
+    try:
+        results=_get_dispatcher().purge_services({service: ["announce"] for service in services})
+        return results
+    except PurgeError as ex:
+        results=ex.services
+        raise
+    finally:
+        _record_services("announce_services", results)
+
+def _purge_announced_papers(mail_id: Optional[str]=None, services: Optional[Sequence[str]]=None) -> Dict[str, DispatchResult]:
+    """this function purges fastly's data for papers that have been created or updated since the last announcement
+    rows are streamed from the database and turned into keys as they arrive, so purges start before the query is finished
+    the keys go to all services at once, by default those configured for ENVIRONMENT, see services.py. returns the result of each
+    with run state, keys an earlier run confirmed for this mailing are skipped
+    """
+    if services is None:
+        plan=service_plan(os.environ.get('ENVIRONMENT'))
+        services=plan.papers if plan is not None else ()
+    state=_get_run_state()
+    if state is not None and mail_id is None:
+        mail_id=_latest_mail_id()
+    metrics=current()
+    announcements= metrics.timed(_get_days_announcements(mail_id=mail_id), "query")
+    store=KeyStore()
+    codes=metrics.timed(_announcement_codes(announcements, store), "generate_keys")
+    #hot pages first, see key_priority.py. keys are kept as codes and only rendered as the purge takes them, see key_store.py
+    scheduler=KeyScheduler(clock=metrics.clock, start=metrics.start)
+    keys=scheduler.order_codes(codes, store)
 
+    #send purge request(s) to the configured fastly services
+    results: Dict[str, DispatchResult]={}
+    try:
+        with metrics.stage("purge"):
+            if services:
+                results=_purge_keys(keys, services, state, mail_id, scheduler.confirmed)
+            else:
+                first=list(islice(keys, 20))
+                count=len(first) + sum(1 for _ in keys)
+                logging.info(f"No services to purge. Would have purged {count} keys.")
+                logging.debug(f"First keys not purged: {first}")
+    finally:
+        #keys are generated, and rows read, while the purge pulls them, so leave each stage only its own time
+        metrics.stages["purge"]-=metrics.stages["generate_keys"]
+        metrics.stages["generate_keys"]-=metrics.stages["query"]
+        metrics.set("mail_id", mail_id)
+        metrics.set("keys_by_family", dict(store.families))
+        metrics.count("keys", len(store))
+        metrics.count("duplicate_keys_dropped", store.duplicates)
+        metrics.set("keys_by_tier", dict(scheduler.counts))
+        metrics.set("time_to_purge", scheduler.time_to_purge())
+    logging.info(f"Seconds from the start until each tier was purged: {scheduler.time_to_purge()}, keys by tier: {dict(scheduler.counts)}")
+    logging.info(f"Generated {len(store)} keys by family: {dict(store.families)}, duplicates dropped: {store.duplicates}")
+    _log_key_cache_stats()
+    return results
 
-def _purge_announced_papers():
-    """this function purges fastly's data for papers that have been created or updated since the last announcement"""
-    announcements= _get_days_announcements()
-    keys=_process_announcements(announcements)
-
-    #send purge request(s) to appropriate fastly services
-    environment = os.environ.get('ENVIRONMENT')
-    if environment == "PRODUCTION":
-        purge_fastly_keys(keys)
-        #purge_fastly_keys(keys,"export.arxiv.org") #currently not in use
-    elif environment == "DEVELOPMENT":
-        purge_fastly_keys(keys, "browse.dev.arxiv.org")
-    elif environment == "TESTING":
-        logging.info(f"In TESTING enviroment. Would have purged keys {len(keys)}: {keys}\nAbove keys ({len(keys)}) not purged, in TESTING enviroment.")
-    return
-
-def _get_days_announcements()-> List[Tuple[str, int, str, str, str]]:
-    """gets data for most recent days announcement
+def _purge_keys(keys: Iterable[str], services: Sequence[str], state: Optional[RunStateStore], mail_id: Optional[str],
+                on_batch: Optional[Callable[[List[str]], None]]=None) -> Dict[str, DispatchResult]:
+    """purges keys on every service at once, with run state skipping keys already confirmed and confirming each batch as it goes through
+    keys are generated once and teed to the services, the one furthest ahead pulls more
+    on_batch is also called with each batch fastly confirmed, on any service
+    """
+    streams: Dict[str, Iterable[str]]=dict(zip(services, tee(keys, len(services))))
+    runs={service: MailingRun(state, mail_id, service) for service in services} if state is not None and mail_id is not None else {}
+
+    def confirm(service: str, batch: List[str]) -> None:
+        if runs:
+            runs[service].confirm(batch)
+        if on_batch is not None:
+            on_batch(batch)
+    try:
+        return _dispatch({service: runs[service].new(stream) if runs else stream for service, stream in streams.items()}, on_batch=confirm)
+    finally:
+        for run in runs.values():
+            run.log()
+            current().count("keys_skipped_as_confirmed", run.skipped)
+
+def _dispatch(purges: Dict[str, Iterable[str]], **kwargs) -> Dict[str, DispatchResult]:
+    results: Dict[str, DispatchResult]={}
+    try:
+        results=_get_dispatcher().purge_services(purges, **kwargs)
+        return results
+    except PurgeError as ex:
+        results=ex.services
+        raise
+    finally:
+        metrics=current()
+        for result in results.values():
+            metrics.count("purge_batches", result.batches)
+            metrics.count("purge_retries", result.retries)
+            metrics.count("purge_failed_batches", len(result.failed))
+        _record_services("services", results)
+
+def _record_services(name: str, results: Dict[str, DispatchResult]) -> None:
+    """how long each service took and whether all its batches went through"""
+    current().set(name, {service: {"ok": result.ok, "seconds": round(result.seconds, 3), "keys": result.keys, "batches": result.batches}
+                         for service, result in results.items()})
+    for service, result in results.items():
+        logging.info(f"{name} {service}: {'ok' if result.ok else 'failed'} in {result.seconds:.3f}s, {result.keys} keys in {result.batches} batches")
+
+def _latest_mail_id() -> Optional[str]:
+    from mailing_query import latest_mail_id
+    with _get_database().session() as session:
+        return latest_mail_id(session)
+
+def _get_days_announcements(session: Optional["SQLSession"]=None, batch_size: Optional[int]=None, mail_id: Optional[str]=None)-> Iterator[Tuple[str, int, str, str, str]]:
+    """streams data for most recent days announcement
+    the latest mail_id is looked up first, unless one is given, and the mailing's rows are then read on their own, see mailing_query.py
+    rows are fetched batch_size at a time with a server side cursor rather than loaded all at once
+    without a session one is taken from the pooled database for as long as the rows are being read, and the query is timed on the invocation's db_ metrics
     return values are (paper_id, version, type of announcement, the papers category string, extra data (contains newly crosslisted categories))
     """
-    mail= aliased(NextMail)
-    meta=aliased(Metadata)
-    today=Session.query(func.max(mail.mail_id)).scalar_subquery()
-    result = (
-        Session.query(mail.paper_id, mail.version, mail.type, meta.abs_categories, mail.extra)
-        .join(meta, mail.document_id == meta.document_id)
-        .filter(mail.mail_id == today)
-        .filter(meta.is_current==1)
-        .all()
-    )
-    return result
-
-def _process_announcements(announcements:List[Tuple[str, int, str, str, str]])->List[str]:
+    if session is None:
+        database=_get_database()
+        with database.session() as pooled:
+            yield from database.timed(_get_days_announcements(pooled, batch_size, mail_id))
+        return
+    from mailing_query import latest_mail_id, mailing_rows
+    if batch_size is None:
+        batch_size=int(os.environ.get('ANNOUNCE_QUERY_BATCH', '1000'))
+    if mail_id is None:
+        mail_id=latest_mail_id(session)
+    if mail_id is None:
+        logging.warning("No mailings found, nothing to purge")
+        return
+    logging.info(f"Reading announcements for mailing {mail_id}")
+    yield from mailing_rows(session, mail_id, batch_size)
+
+def _process_announcements(announcements:Iterable[Tuple[str, int, str, str, str]])->List[str]:
     """ Processes the data for the mailing table to find the keys needed for each entry
-    returns list of keys to purge
     parameters values are (paper_id, version, type of announcement, the papers category string, extra data (contains newly crosslisted categories))
-    returns a list of all keys to purge
+    returns a list of all keys to purge, in the order they would be purged
+    """
+    store=KeyStore()
+    return list(KeyScheduler().order_codes(_announcement_codes(announcements, store), store))
+
+def _announcement_codes(announcements:Iterable[Tuple[str, int, str, str, str]], store: KeyStore)->Iterator[int]:
+    """ yields the keys needed for each entry of the mailing table as the entries are read, as codes of store, see key_store.py
+    entries are taken ID_PARSE_BATCH at a time so their paper ids can be parsed together, new papers have no list keys so theirs aren't parsed
+    each key is only yielded the first time it is seen, store keeps the counts of what was generated
     """
-    keys=[]
-    lists=set() #also includes year pages, kept as set because of potential duplicates
-    for row in announcements:
-        paper_id, version, method, categories, extra= row
-        keys.append(f"abs-{paper_id}") #always the abstract page
-
-        if method == "new":
-            keys.append(f"paper-id-{paper_id}-current") #all current (versionless) pages
-            keys.append(f"paper-id-{paper_id}v1") #all urls with v1 in them
-            #all new/recent/current lists are cleared every announce
-
-        elif method == "cross":
-            #category data appears on lists
-            groups, archs, cats= get_all_cats_from_string(categories)
-            arxiv_id= Identifier(paper_id)
-            lists= lists | _all_list_keys(arxiv_id.year, arxiv_id.month, groups, archs, cats)
-
-            #clear year pages that have a new number added to their count
-            _, new_archs, _ = get_all_cats_from_string(extra)
-            for arch in new_archs:
-                lists.add(f"year-{arch.id}-{arxiv_id.year}")
-        
-        elif method == "rep":
-            keys.append(f"paper-id-{paper_id}-current") #all current (versionless) pages
-            keys.append(f"paper-id-{paper_id}v{version}") #all urls for the new version
-
-            groups, archs, cats= get_all_cats_from_string(categories)
-            arxiv_id= Identifier(paper_id)
-            lists= lists | _all_list_keys(arxiv_id.year, arxiv_id.month, groups, archs, cats) #clear lists the paper is on
-
-        elif method == "jref":
-            #jrefs appear on lists
-            groups, archs, cats= get_all_cats_from_string(categories)
-            arxiv_id= Identifier(paper_id)
-            lists= lists | _all_list_keys(arxiv_id.year, arxiv_id.month, groups, archs, cats)
-
-        elif method == "wdr":
-            keys.append(f"paper-id-{paper_id}v{version}") #all urls for the withdrawn version
-            #withdrawl comments appear on lists
-            groups, archs, cats= get_all_cats_from_string(categories)
-            arxiv_id= Identifier(paper_id)
-            lists= lists | _all_list_keys(arxiv_id.year, arxiv_id.month, groups, archs, cats)
-        
-    return keys + list(lists)
-
-def _all_list_keys(year: int, month: int, groups: List[Group], archs: List[Archive], cats: List[Category])->Set[str]:
-    """generates a set of all list pages a paper would be on given its year, month and categories"""
-    lists=set()
-    for cat in cats:
-        lists.add(f"list-{year:04d}-{cat.id}") #the year listing for the category
-        lists.add(f"list-{year:04d}-{month:02d}-{cat.id}") #the year and month the paper came out
-    for arch in archs:
-        lists.add(f"list-{year:04d}-{arch.id}") #paper also present on archive pages
-        lists.add(f"list-{year:04d}-{month:02d}-{arch.id}") 
-    for group in groups: #catchup filters by and tags for the physics group
-        if group.id=='grp_physics':
-            lists.add(f"list-{year:04d}-{month:02d}-{group.id}") 
-    return lists
\ No newline at end of file
+    for chunk in batched(announcements, ID_PARSE_BATCH):
+        years, months= year_months([row[0] for row in chunk if row[2] != "new"])
+        dates=zip(years, months)
+        for row in chunk:
+            paper_id, version, method, categories, extra= row
+            year, month= next(dates) if method != "new" else (0, 0)
+            paper=store.paper(paper_id)
+            keys=[encode(ABS, paper)] #always the abstract page
+            lists: Iterable[int]=() #also includes year pages
+
+            if method == "new":
+                keys.append(encode(CURRENT, paper)) #all current (versionless) pages
+                keys.append(encode(VERSION, paper, 1)) #all urls with v1 in them
+                #all new/recent/current lists are cleared every announce
+
+            elif method == "cross":
+                #category data appears on lists
+                #also clear year pages that have a new number added to their count
+                lists= chain(_list_keys_for(categories, year, month), _year_keys_for(extra, year))
+            
+            elif method == "rep":
+                keys.append(encode(CURRENT, paper)) #all current (versionless) pages
+                keys.append(encode(VERSION, paper, int(version))) #all urls for the new version
+                lists= _list_keys_for(categories, year, month) #clear lists the paper is on
+
+            elif method == "jref":
+                #jrefs appear on lists
+                lists= _list_keys_for(categories, year, month)
+
+            elif method == "wdr":
+                keys.append(encode(VERSION, paper, int(version))) #all urls for the withdrawn version
+                #withdrawl comments appear on lists
+                lists= _list_keys_for(categories, year, month)
+
+            yield from store.new(keys)
+            yield from store.new(lists)
+
+@lru_cache(maxsize=LIST_KEY_CACHE_SIZE)
+def _list_keys_for(categories: str, year: int, month: int)->FrozenSet[int]:
+    """all list pages for a category string in a given year and month, as key codes
+    cached because most papers in a mailing share a small number of category strings and months
+    """
+    lists, _, physics= _get_taxonomy().expand(categories)
+    return list_codes(lists, year, month, physics)
+
+@lru_cache(maxsize=LIST_KEY_CACHE_SIZE)
+def _year_keys_for(categories: str, year: int)->FrozenSet[int]:
+    """year pages for the archives of a category string, as key codes"""
+    _, archives, _= _get_taxonomy().expand(categories)
+    return year_codes(archives, year)
+
+def _log_key_cache_stats():
+    for cached in (_list_keys_for, _year_keys_for):
+        info=cached.cache_info()
+        current().set(f"{cached.__name__.strip('_')}_cache", info._asdict())
+        logging.info(f"{cached.__name__} cache hits: {info.hits} misses: {info.misses} size: {info.currsize}/{info.maxsize}")
@@ -0,0 +1,42 @@
+"""batch parsing of the year and month out of paper ids"""
+from array import array
+from typing import Iterable, Tuple
+
+
+FIRST_MODERN_YYMM=704 #0704, the first month of YYMM.NNNN ids
+FIVE_DIGIT_YYMM=1501 #from 1501 the number after the dot has 5 digits, before it 4
+
+
+def _modern_year_month(paper_id: str) -> Tuple[int, int]:
+    """year and month of a YYMM.NNNN(N)(vN) id without building an Identifier, (0, 0) if it isn't a valid one
+    anything else, including ids Identifier would reject, is left to Identifier
+    """
+    if len(paper_id) < 9 or paper_id[4] != "." or not paper_id[:4].isdigit():
+        return 0, 0
+    yymm=int(paper_id[:4])
+    month=yymm % 100
+    if yymm < FIRST_MODERN_YYMM or not 1 <= month <= 12:
+        return 0, 0
+    digits=5 if yymm >= FIVE_DIGIT_YYMM else 4
+    number, version=paper_id[5:5 + digits], paper_id[5 + digits:]
+    if len(number) != digits or not number.isdigit() or (version and not (version[0] == "v" and version[1:].isdigit())):
+        return 0, 0
+    return 2000 + yymm // 100, month
+
+
+def year_months(paper_ids: Iterable[str]) -> Tuple[array, array]:
+    """years and months of paper_ids as compact unsigned arrays, in the same order
+    modern ids are read directly, old style archive/YYMMNNN ids (and anything odd) go through arxiv.identifier.Identifier
+    which raises IdentifierException for invalid ids
+    """
+    years=array("H")
+    months=array("B")
+    for paper_id in paper_ids:
+        year, month=_modern_year_month(paper_id)
+        if not year:
+            from arxiv.identifier import Identifier
+            arxiv_id=Identifier(paper_id)
+            year, month=arxiv_id.year, arxiv_id.month
+        years.append(year)
+        months.append(month)
+    return years, months
@@ -0,0 +1,163 @@
+"""progress of each mailing's announce purge, so a redelivered announcement_complete resumes where the last run stopped
+
+keys are confirmed a batch at a time as fastly accepts them, and a mailing is marked complete once everything,
+including the announce keys, has been purged. a redelivery skips the confirmed keys, and one for a completed mailing does nothing.
+once a list or year page has been purged for a mailing its content won't change again until the next mailing, so skipping is safe.
+
+SqliteRunState and FileRunState keep the state on the instance's own disk, which on cloud functions is its in memory /tmp.
+a redelivery handled by another instance, or after the instance was stopped, doesn't see it, so they are for local runs and
+single instance deployments. DbRunState in run_state_db.py keeps it in a sql database every instance shares
+"""
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional, Protocol, Set
+
+
+class RunStateStore(Protocol):
+    def confirmed(self, mail_id: str, service: str) -> Set[str]: ...
+    def confirm(self, mail_id: str, service: str, keys: Iterable[str]) -> None: ...
+    def completed(self, mail_id: str) -> bool: ...
+    def complete(self, mail_id: str) -> None: ...
+    def forget(self, mail_id: str) -> None: ...
+
+
+class SqliteRunState:
+    """run state in a sqlite file (or :memory:), only the latest keep mailings are kept"""
+    def __init__(self, path: str, keep: int=7) -> None:
+        self.path=path
+        self.keep=keep
+        self._lock=threading.Lock()
+        self._conn=sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS confirmed (service TEXT, mail_id TEXT, key TEXT, PRIMARY KEY (service, mail_id, key)) WITHOUT ROWID")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS runs (mail_id TEXT PRIMARY KEY, completed_at REAL)")
+
+    def confirmed(self, mail_id: str, service: str) -> Set[str]:
+        with self._lock:
+            return {key for key, in self._conn.execute("SELECT key FROM confirmed WHERE service=? AND mail_id=?", (service, mail_id))}
+
+    def confirm(self, mail_id: str, service: str, keys: Iterable[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO confirmed VALUES (?, ?, ?)", ((service, mail_id, key) for key in keys))
+
+    def completed(self, mail_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM runs WHERE mail_id=?", (mail_id,)).fetchone() is not None
+
+    def complete(self, mail_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?)", (mail_id, time.time()))
+            self._prune()
+
+    def _prune(self) -> None:
+        """drops all but the latest keep mailings, call holding the lock in a transaction"""
+        kept="SELECT mail_id FROM (SELECT mail_id FROM confirmed UNION SELECT mail_id FROM runs) ORDER BY mail_id DESC LIMIT ?"
+        self._conn.execute(f"DELETE FROM confirmed WHERE mail_id NOT IN ({kept})", (self.keep,))
+        self._conn.execute(f"DELETE FROM runs WHERE mail_id NOT IN ({kept})", (self.keep,))
+
+    def forget(self, mail_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM confirmed WHERE mail_id=?", (mail_id,))
+            self._conn.execute("DELETE FROM runs WHERE mail_id=?", (mail_id,))
+
+    def mailings(self) -> List[str]:
+        with self._lock:
+            return [mail_id for mail_id, in self._conn.execute("SELECT mail_id FROM confirmed UNION SELECT mail_id FROM runs ORDER BY mail_id")]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class FileRunState:
+    """run state as plain files, a folder per mailing holding a file of confirmed keys per service and a complete marker
+    keys are appended and synced a batch at a time, so a run killed part way keeps what it confirmed
+    """
+    def __init__(self, directory: str, keep: int=7) -> None:
+        self.directory=directory
+        self.keep=keep
+        self._lock=threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, mail_id: str, name: str) -> str:
+        return os.path.join(self.directory, mail_id, name)
+
+    def confirmed(self, mail_id: str, service: str) -> Set[str]:
+        try:
+            with open(self._path(mail_id, f"{service}.keys")) as f:
+                return set(f.read().split())
+        except FileNotFoundError:
+            return set()
+
+    def confirm(self, mail_id: str, service: str, keys: Iterable[str]) -> None:
+        with self._lock:
+            os.makedirs(os.path.join(self.directory, mail_id), exist_ok=True)
+            with open(self._path(mail_id, f"{service}.keys"), "a") as f:
+                f.write("".join(f"{key}\n" for key in keys))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def completed(self, mail_id: str) -> bool:
+        return os.path.exists(self._path(mail_id, "complete"))
+
+    def complete(self, mail_id: str) -> None:
+        with self._lock:
+            os.makedirs(os.path.join(self.directory, mail_id), exist_ok=True)
+            with open(self._path(mail_id, "complete"), "w") as f:
+                f.write(f"{time.time()}\n")
+            for old in self.mailings()[:-self.keep]:
+                shutil.rmtree(os.path.join(self.directory, old), ignore_errors=True)
+
+    def forget(self, mail_id: str) -> None:
+        with self._lock:
+            shutil.rmtree(os.path.join(self.directory, mail_id), ignore_errors=True)
+
+    def mailings(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.directory) if os.path.isdir(os.path.join(self.directory, name)))
+
+
+class MailingRun:
+    """one mailing's purge on one service, skipping keys an earlier run confirmed and confirming batches as fastly accepts them"""
+    def __init__(self, store: RunStateStore, mail_id: str, service: str) -> None:
+        self.store=store
+        self.mail_id=mail_id
+        self.service=service
+        self.previous=store.confirmed(mail_id, service)
+        self.confirmed=0
+        self.skipped=0
+
+    def new(self, keys: Iterable[str]) -> Iterator[str]:
+        for key in keys:
+            if key in self.previous:
+                self.skipped+=1
+                continue
+            yield key
+
+    def confirm(self, batch: List[str]) -> None:
+        self.store.confirm(self.mail_id, self.service, batch)
+        self.confirmed+=len(batch)
+
+    def log(self) -> None:
+        logging.info(f"Mailing {self.mail_id} on {self.service}: {self.confirmed} keys confirmed, {self.skipped} skipped as confirmed by an earlier run")
+
+
+def run_state_from_env() -> Optional[RunStateStore]:
+    """the store at PURGE_STATE_PATH, by PURGE_STATE_BACKEND: a sqlite file (the default), a folder (file) or a sqlalchemy url (db)
+    None, every run purges everything, when it isn't set
+    """
+    path=os.environ.get("PURGE_STATE_PATH")
+    if not path:
+        return None
+    keep=int(os.environ.get("PURGE_STATE_KEEP", "7"))
+    backend=os.environ.get("PURGE_STATE_BACKEND", "sqlite")
+    if backend == "file":
+        return FileRunState(path, keep)
+    if backend == "sqlite":
+        return SqliteRunState(path, keep)
+    if backend == "db":
+        from run_state_db import DbRunState #imports sqlalchemy, only needed for this backend
+        return DbRunState(path, keep)
+    raise ValueError(f"PURGE_STATE_BACKEND must be sqlite, file or db, not {backend}")
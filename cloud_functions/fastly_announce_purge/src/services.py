@@ -0,0 +1,39 @@
+"""which fastly services each environment purges after an announcement
+
+papers are the services the mailing's paper, list and year keys are purged on
+announce are the services the announce key, on every page with daily data, is purged on
+an environment with no services, like TESTING, works the keys out and logs them without purging anything
+
+PURGE_SERVICES, a json object like {"papers": ["arxiv.org"], "announce": ["arxiv.org", "rss.arxiv.org"]},
+replaces the lists of the environment, e.g. to turn on export.arxiv.org or to point at services of a local fake fastly
+"""
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class ServicePlan:
+    papers: Tuple[str, ...]=()
+    announce: Tuple[str, ...]=()
+
+
+SERVICE_PLANS: Dict[str, ServicePlan]={
+    "PRODUCTION": ServicePlan(papers=("arxiv.org",), #"export.arxiv.org" currently not in use
+                              announce=("arxiv.org", "rss.arxiv.org")), #"export.arxiv.org" not currently live from fastly
+    "DEVELOPMENT": ServicePlan(papers=("browse.dev.arxiv.org",),
+                               announce=("browse.dev.arxiv.org",)),
+    "TESTING": ServicePlan(),
+}
+
+def service_plan(environment: Optional[str]) -> Optional[ServicePlan]:
+    """the services to purge for environment, None for an environment that isn't configured"""
+    plan=SERVICE_PLANS.get(environment or "")
+    override=os.environ.get("PURGE_SERVICES")
+    if override:
+        services=json.loads(override)
+        base=plan or ServicePlan()
+        plan=ServicePlan(papers=tuple(services.get("papers", base.papers)),
+                         announce=tuple(services.get("announce", base.announce)))
+    return plan
@@ -0,0 +1,56 @@
+"""sqlite stand in for the classic db, holding only the columns the announce query reads"""
+from typing import Iterable, Tuple
+
+from sqlalchemy import create_engine, func, select, text, Column, Integer, MetaData, String, Table
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from arxiv.db.models import Metadata, NextMail
+from mailing_query import index_ddl
+
+def _column(model, key, type_, **kwargs) -> Column:
+    return Column(model.__table__.c[key].name, type_, **kwargs)
+
+schema=MetaData()
+mail_table=Table(NextMail.__tablename__, schema,
+                 _column(NextMail, "next_mail_id", Integer, primary_key=True),
+                 _column(NextMail, "mail_id", String),
+                 _column(NextMail, "document_id", Integer),
+                 _column(NextMail, "paper_id", String),
+                 _column(NextMail, "version", Integer),
+                 _column(NextMail, "type", String),
+                 _column(NextMail, "extra", String))
+meta_table=Table(Metadata.__tablename__, schema,
+                 _column(Metadata, "metadata_id", Integer, primary_key=True),
+                 _column(Metadata, "document_id", Integer),
+                 _column(Metadata, "abs_categories", String),
+                 _column(Metadata, "is_current", Integer))
+
+def create_indexes(engine: Engine) -> None:
+    """adds the indexes mailing_query.py recommends for the classic db"""
+    with engine.begin() as conn:
+        for ddl in index_ddl():
+            conn.execute(text(ddl))
+
+def fixture_engine(url: str="sqlite://", indexes: bool=True) -> Engine:
+    engine=create_engine(url)
+    schema.create_all(engine)
+    if indexes:
+        create_indexes(engine)
+    return engine
+
+def add_mailing(engine: Engine, mail_id: str, rows: Iterable[Tuple[str, int, str, str, str]]) -> None:
+    """adds announcement rows in the (paper_id, version, type, categories, extra) shape the query returns
+    each row gets a current metadata row and an older non current one with different categories
+    """
+    with engine.begin() as conn:
+        document_id=conn.scalar(select(func.count()).select_from(mail_table))
+        for paper_id, version, method, categories, extra in rows:
+            document_id+=1
+            conn.execute(mail_table.insert().values(mail_id=mail_id, document_id=document_id, paper_id=paper_id,
+                                                    version=version, type=method, extra=extra))
+            conn.execute(meta_table.insert().values(document_id=document_id, abs_categories=categories, is_current=1))
+            conn.execute(meta_table.insert().values(document_id=document_id, abs_categories="hep-th", is_current=0))
+
+def fixture_session(engine: Engine) -> Session:
+    return sessionmaker(bind=engine)()
@@ -0,0 +1,90 @@
+import unittest
+import tempfile
+import threading
+from unittest.mock import patch
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from sqlalchemy import text
+from database import Database, PoolSettings
+from metrics import invocation
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.dir=tempfile.TemporaryDirectory()
+        self.url=f"sqlite:///{os.path.join(self.dir.name, 'classic.db')}"
+        self.database=Database(self.url, PoolSettings(pool_size=1))
+        with self.database.engine.begin() as conn:
+            conn.execute(text("create table rows (n integer)"))
+            conn.execute(text("insert into rows values (1), (2), (3)"))
+
+    def tearDown(self):
+        self.database.dispose()
+        self.dir.cleanup()
+
+    def _invocation(self):
+        return invocation("test", sink=lambda record: None)
+
+    def test_connection_reused_between_invocations(self):
+        with self._invocation(), self.database.session() as session:
+            session.execute(text("select 1")).all()
+        with self._invocation(), self.database.session() as session:
+            session.execute(text("select 1")).all()
+            stats=self.database.stats
+        self.assertEqual(stats.connects, 0)
+        self.assertEqual(stats.checkouts, 1)
+
+    def test_query_timing(self):
+        with self._invocation() as metrics:
+            with self.database.session() as session:
+                rows=list(self.database.timed(session.execute(text("select n from rows")).yield_per(2)))
+            stats=self.database.stats
+        self.assertEqual(metrics.counts["db_queries"], 1)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(stats.rows, 3)
+        self.assertEqual(stats.queries, 1)
+        self.assertGreater(stats.execute_seconds, 0)
+        self.assertGreater(stats.fetch_seconds, 0)
+
+    def test_stats_per_invocation_across_sessions(self):
+        with self._invocation():
+            with self.database.session() as session:
+                session.execute(text("select 1"))
+            with self.database.session() as session:
+                session.execute(text("select 2"))
+            self.assertEqual(self.database.stats.queries, 2)
+        with self._invocation(), self.database.session():
+            self.assertEqual(self.database.stats.queries, 0)
+
+    def test_concurrent_invocations_counted_apart(self):
+        database=Database(self.url, PoolSettings(pool_size=4))
+        start=threading.Barrier(4)
+        queries={}
+        def invoke(n):
+            with self._invocation():
+                start.wait()
+                for _ in range(n):
+                    with database.session() as session:
+                        session.execute(text("select n from rows")).all()
+                queries[n]=database.stats.queries
+        threads=[threading.Thread(target=invoke, args=(n,)) for n in (5, 10, 20, 40)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        database.dispose()
+        self.assertEqual(queries, {5: 5, 10: 10, 20: 20, 40: 40})
+
+    def test_in_memory_sqlite(self):
+        database=Database("sqlite://", PoolSettings(pool_size=5, max_overflow=3))
+        with database.session() as session:
+            self.assertEqual(session.execute(text("select 1")).scalar(), 1)
+
+    def test_settings_from_env(self):
+        with patch.dict('os.environ', {'DB_POOL_SIZE': '4', 'DB_POOL_RECYCLE': '600', 'DB_POOL_PRE_PING': 'false'}):
+            settings=PoolSettings.from_env()
+        self.assertEqual((settings.pool_size, settings.pool_recycle, settings.pre_ping), (4, 600, False))
+        self.assertEqual(settings.max_overflow, 0)
+        kwargs=settings.engine_kwargs("mysql://user@localhost/arXiv")
+        self.assertEqual(kwargs["pool_size"], 4)
+        self.assertNotIn("pool_size", settings.engine_kwargs("sqlite://"))
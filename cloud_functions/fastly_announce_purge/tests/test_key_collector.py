@@ -0,0 +1,24 @@
+import unittest
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from key_collector import KeyCollector, key_family
+
+class TestKeyCollector(unittest.TestCase):
+    def test_families(self):
+        self.assertEqual(key_family("abs-1204.1234"), "abs")
+        self.assertEqual(key_family("paper-id-1204.1234v1"), "paper-id")
+        self.assertEqual(key_family("list-2011-04-hep-lat"), "list")
+        self.assertEqual(key_family("year-astro-ph-2011"), "year")
+
+    def test_dedup_in_order(self):
+        collector=KeyCollector()
+        first=list(collector.new(["abs-1", "list-2011-cs", "abs-1"]))
+        second=list(collector.new(["list-2011-cs", "year-cs-2011", "abs-2"]))
+
+        self.assertEqual(first, ["abs-1", "list-2011-cs"])
+        self.assertEqual(second, ["year-cs-2011", "abs-2"])
+        self.assertEqual(len(collector), 4)
+        self.assertIn("abs-2", collector)
+        self.assertEqual(collector.duplicates, 2)
+        self.assertEqual(dict(collector.families), {"abs": 2, "list": 1, "year": 1})
@@ -0,0 +1,71 @@
+import unittest
+from datetime import date
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from key_priority import KeyPriority, KeyScheduler, TIERS, HOT, VERSIONS, RECENT_LISTS, ARCHIVE
+
+class TestKeyPriority(unittest.TestCase):
+    priority=KeyPriority(date(2025, 1, 3))
+
+    def test_tiers(self):
+        expected={
+            "abs-2501.00001": HOT,
+            "paper-id-2412.01234-current": HOT,
+            "list-2025-01-cs.LG": HOT,
+            "list-2024-12-grp_physics": HOT, #last month, early in the month most papers are from it
+            "paper-id-2412.01234v3": VERSIONS,
+            "list-2025-cs.LG": RECENT_LISTS,
+            "list-2024-11-cs.LG": RECENT_LISTS,
+            "year-hep-th-2024": RECENT_LISTS,
+            "list-2011-04-hep-lat": ARCHIVE,
+            "list-2011-math": ARCHIVE,
+            "year-math-2011": ARCHIVE,
+            "announce": HOT,
+        }
+        self.assertEqual({key: self.priority.tier(key) for key in expected}, expected)
+
+    def test_two_digit_category_not_a_month(self):
+        self.assertEqual(self.priority.tier("list-2025-01"), RECENT_LISTS)
+
+class TestKeyScheduler(unittest.TestCase):
+    keys=["list-2011-math", "abs-2501.00001", "paper-id-2501.00001v1", "year-math-2024", "abs-1104.1234", "list-2025-01-cs.LG", "list-2009-hep-lat"]
+
+    def scheduler(self):
+        now=[0.0]
+        scheduler=KeyScheduler(KeyPriority(date(2025, 1, 3)), clock=lambda: now[0], start=0.0)
+        return scheduler, now
+
+    def test_priority_order(self):
+        scheduler, _=self.scheduler()
+        self.assertEqual(list(scheduler.order(self.keys)), [
+            "abs-2501.00001", "abs-1104.1234", "list-2025-01-cs.LG",
+            "paper-id-2501.00001v1",
+            "year-math-2024",
+            "list-2011-math", "list-2009-hep-lat"])
+        self.assertEqual(dict(scheduler.counts), {"hot": 3, "versions": 1, "recent_lists": 1, "archive": 2})
+
+    def test_hot_keys_not_held(self):
+        scheduler, _=self.scheduler()
+        read=[]
+        def keys():
+            for key in self.keys:
+                read.append(key)
+                yield key
+        ordered=scheduler.order(keys())
+        self.assertEqual(next(ordered), "abs-2501.00001")
+        self.assertEqual(read, self.keys[:2], "the first hot key goes out before the rest are generated")
+
+    def test_time_to_purge(self):
+        scheduler, now=self.scheduler()
+        now[0]=0.5
+        scheduler.confirmed(["abs-2501.00001", "paper-id-2501.00001v1"])
+        now[0]=2.0
+        scheduler.confirmed(["list-2011-math"])
+        now[0]=1.0 #another service, confirming hot keys again
+        scheduler.confirmed(["abs-1104.1234"])
+        self.assertEqual(scheduler.time_to_purge(), {"hot": 1.0, "versions": 0.5, "archive": 2.0})
+        self.assertEqual(list(scheduler.time_to_purge()), [name for name in TIERS if name in scheduler.time_to_purge()])
+
+if __name__ == '__main__':
+    unittest.main()
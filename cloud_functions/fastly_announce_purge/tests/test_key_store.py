@@ -0,0 +1,68 @@
+import unittest
+from datetime import date
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from key_collector import key_family
+from key_priority import KeyPriority, KeyScheduler
+from key_store import ABS, CURRENT, VERSION, LIST_MONTH, NUMBER_MASK, KeyStore, decode, encode, list_codes, year_codes
+from taxonomy_index import TaxonomyIndex
+
+class TestKeyStore(unittest.TestCase):
+    def setUp(self):
+        self.store=KeyStore()
+
+    def paper_codes(self, paper_id, version):
+        paper=self.store.paper(paper_id)
+        return [encode(ABS, paper), encode(CURRENT, paper), encode(VERSION, paper, version)]
+
+    def test_paper_keys(self):
+        codes=self.paper_codes("2501.00001", 12) + self.paper_codes("hep-th/9901001", 1)
+        self.assertEqual([self.store.render(code) for code in codes], [
+            "abs-2501.00001", "paper-id-2501.00001-current", "paper-id-2501.00001v12",
+            "abs-hep-th/9901001", "paper-id-hep-th/9901001-current", "paper-id-hep-th/9901001v1"])
+
+    def test_list_and_year_keys_match_index(self):
+        index=TaxonomyIndex.build(["hep-lat", "astro-ph.SR", "cs.GL", "math.NA"])
+        for categories in ("hep-lat astro-ph.SR", "cs.GL", "math.NA cs.GL"):
+            lists, archives, physics=index.expand(categories)
+            self.assertEqual({self.store.render(code) for code in list_codes(lists, 2011, 4, physics)}, index.list_keys(categories, 2011, 4))
+            self.assertEqual({self.store.render(code) for code in year_codes(archives, 1999)}, index.year_keys(categories, 1999))
+
+    def test_deduplicates_and_counts_families(self):
+        codes=self.paper_codes("2501.00001", 2) + list(list_codes(["cs.GL"], 2025, 1, False))
+        self.assertEqual(list(self.store.new(codes + codes[:2])), codes)
+        self.assertEqual(self.store.duplicates, 2)
+        self.assertEqual(dict(self.store.families), {"abs": 1, "paper-id": 2, "list": 2})
+        self.assertEqual({key_family(self.store.render(code)) for code in codes}, set(self.store.families))
+
+    def test_paper_keys_deduplicated_without_the_set(self):
+        first=self.paper_codes("2501.00001", 2)
+        other_version=encode(VERSION, self.store.paper("2501.00001"), 3)
+        self.assertEqual(list(self.store.new(first + first + [other_version, other_version])), first + [other_version])
+        self.assertEqual((len(self.store), self.store.duplicates), (4, 4))
+        self.assertTrue(all(code in self.store for code in first + [other_version]))
+        self.assertNotIn(encode(VERSION, self.store.paper("2501.00001"), 4), self.store)
+        self.assertNotIn(encode(ABS, self.store.paper("2501.00002")), self.store)
+
+    def test_decode(self):
+        for template, name, number in ((ABS, 0, 0), (VERSION, 123456, 17), (LIST_MONTH, 5, 202501), (VERSION, 1, NUMBER_MASK)):
+            self.assertEqual(decode(encode(template, name, number)), (template, name, number))
+
+    def test_code_tier_matches_key_tier(self):
+        priority=KeyPriority(date(2025, 1, 3))
+        codes=(self.paper_codes("2501.00001", 2) + list(list_codes(["cs.GL", "grp_x"], 2025, 1, True))
+               + list(list_codes(["cs.GL"], 2024, 11, False)) + list(list_codes(["math"], 2011, 4, False))
+               + list(year_codes(["math"], 2024)) + list(year_codes(["math"], 2011)))
+        for code in codes:
+            key=self.store.render(code)
+            self.assertEqual(priority.code_tier(code), priority.tier(key), key)
+
+    def test_scheduled_codes_rendered_in_order(self):
+        priority=KeyPriority(date(2025, 1, 3))
+        codes=list(year_codes(["math"], 2011)) + self.paper_codes("2501.00001", 2) + list(list_codes(["cs.GL"], 2025, 1, False))
+        keys=[self.store.render(code) for code in codes]
+        self.assertEqual(list(KeyScheduler(priority).order_codes(codes, self.store)), list(KeyScheduler(priority).order(keys)))
+
+if __name__ == '__main__':
+    unittest.main()
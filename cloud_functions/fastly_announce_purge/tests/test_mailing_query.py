@@ -0,0 +1,45 @@
+import unittest
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from arxiv.db.models import Metadata, NextMail
+from mailing_query import explain, latest_mail_id, mailing_rows
+from announce_db import fixture_engine, fixture_session, add_mailing
+
+class TestMailingQuery(unittest.TestCase):
+    rows=[
+        ("1204.1234", 1, "new", "math.NA", ""),
+        ("1104.1234", 3, "cross", "hep-lat astro-ph.SR", "astro-ph.SR"),
+    ]
+
+    def session(self, indexes: bool):
+        engine=fixture_engine(indexes=indexes)
+        add_mailing(engine, "240101", [("1101.0001", 1, "new", "cs.AI", "")])
+        add_mailing(engine, "240102", self.rows)
+        session=fixture_session(engine)
+        self.addCleanup(session.close)
+        return session
+
+    def test_latest_mailing(self):
+        session=self.session(indexes=True)
+        self.assertEqual(latest_mail_id(session), "240102")
+        self.assertEqual(sorted(tuple(row) for row in mailing_rows(session, "240102", 1)), sorted(self.rows))
+
+    def test_no_mailings(self):
+        session=fixture_session(fixture_engine())
+        self.addCleanup(session.close)
+        self.assertIsNone(latest_mail_id(session))
+
+    def test_plan_uses_indexes(self):
+        plan=explain(self.session(indexes=True), "240102")
+        mail=[step for step in plan if NextMail.__tablename__ in step]
+        meta=[step for step in plan if Metadata.__tablename__ in step]
+
+        self.assertTrue(mail and meta, plan)
+        for step in mail + meta:
+            self.assertIn("SEARCH", step, plan)
+        self.assertIn("COVERING INDEX ix_metadata_document_current", meta[0], plan)
+
+    def test_plan_scans_without_indexes(self):
+        plan=explain(self.session(indexes=False), "240102")
+        self.assertTrue(any("SCAN" in step for step in plan), plan)
@@ -0,0 +1,71 @@
+import io
+import json
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from metrics import Metrics, current, instrumented, invocation
+
+class FakeClock:
+    def __init__(self):
+        self.now=0.0
+    def __call__(self):
+        return self.now
+
+class TestMetrics(unittest.TestCase):
+    def test_stages_and_counts(self):
+        clock=FakeClock()
+        metrics=Metrics("test", clock=clock)
+        with metrics.stage("query"):
+            clock.now+=2
+        def rows():
+            for n in range(3):
+                clock.now+=1
+                yield n
+        self.assertEqual(list(metrics.timed(rows(), "query")), [0, 1, 2])
+        metrics.count("keys", 5)
+        metrics.count("keys")
+        metrics.set("mail_id", "240102")
+
+        record=metrics.record()
+        self.assertEqual(record["stages"], {"query": 5})
+        self.assertEqual(record["counts"], {"keys": 6})
+        self.assertEqual(record["mail_id"], "240102")
+        self.assertEqual(record["seconds"], 5)
+
+    def test_invocation_emits_once(self):
+        records=[]
+        with invocation("test", records.append) as metrics:
+            current().count("keys", 3)
+            self.assertIs(current(), metrics)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["counts"], {"keys": 3})
+        self.assertEqual(current().function, "none")
+
+    def test_error_recorded(self):
+        records=[]
+        with self.assertRaises(ValueError):
+            with invocation("test", records.append):
+                raise ValueError("bad")
+        self.assertIn("bad", records[0]["error"])
+
+    def test_json_sink_from_env(self):
+        @instrumented("entry")
+        def entry():
+            current().count("purge_requests", 2)
+            return "done"
+
+        out=io.StringIO()
+        with patch.dict('os.environ', {'PURGE_METRICS': 'json'}), redirect_stdout(out):
+            self.assertEqual(entry(), "done")
+        record=json.loads(out.getvalue())
+        self.assertEqual((record["function"], record["counts"]), ("entry", {"purge_requests": 2}))
+
+    def test_off_by_default(self):
+        out=io.StringIO()
+        with patch.dict('os.environ', {'PURGE_METRICS': ''}), redirect_stdout(out):
+            with invocation("test"):
+                current().count("keys")
+        self.assertEqual(out.getvalue(), "")
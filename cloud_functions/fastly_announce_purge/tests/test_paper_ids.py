@@ -0,0 +1,45 @@
+import unittest
+from unittest.mock import patch
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from paper_ids import year_months, _modern_year_month
+from arxiv.identifier import Identifier, IdentifierException
+
+class TestYearMonths(unittest.TestCase):
+    def test_modern_ids(self):
+        years, months=year_months(["1204.1234", "2410.12345", "0704.0001v2", "1912.00001v12"])
+        self.assertEqual(list(years), [2012, 2024, 2007, 2019])
+        self.assertEqual(list(months), [4, 10, 4, 12])
+        self.assertEqual(years.typecode, "H")
+        self.assertEqual(months.typecode, "B")
+
+    def test_old_ids_use_identifier(self):
+        ids=["hep-th/9901001", "cs/0005003v3", "math/0102010"]
+        years, months=year_months(ids)
+        self.assertEqual(list(years), [Identifier(i).year for i in ids])
+        self.assertEqual(list(months), [Identifier(i).month for i in ids])
+
+    def test_matches_identifier(self):
+        ids=[f"{yy:02d}{mm:02d}.{n:05d}" for yy in range(15, 25) for mm in range(1, 13) for n in (1, 99999)]
+        years, months=year_months(ids)
+        self.assertEqual(list(zip(years, months)), [(Identifier(i).year, Identifier(i).month) for i in ids])
+
+    def test_invalid_id(self):
+        with self.assertRaises(IdentifierException):
+            year_months(["1213.12345"])
+
+    def test_fast_path_only_for_valid_modern_ids(self):
+        for paper_id in ["0703.1234", "9912.1234", "0713.1234", "1200.1234", "1204.12345", "2410.1234", "2410.123456",
+                         "1204.1234x", "1204.1234v", "1204.12a4", "hep-th/9901001"]:
+            self.assertEqual(_modern_year_month(paper_id), (0, 0), paper_id)
+        self.assertEqual(_modern_year_month("0704.0001"), (2007, 4))
+        self.assertEqual(_modern_year_month("1412.9999v3"), (2014, 12))
+        self.assertEqual(_modern_year_month("1501.00001"), (2015, 1))
+
+    def test_rejected_ids_go_to_identifier(self):
+        with patch("arxiv.identifier.Identifier", side_effect=IdentifierException("bad id")) as identifier:
+            for paper_id in ["0703.1234", "0713.1234", "2410.1234"]:
+                with self.assertRaises(IdentifierException):
+                    year_months([paper_id])
+        self.assertEqual([c.args[0] for c in identifier.call_args_list], ["0703.1234", "0713.1234", "2410.1234"])
@@ -0,0 +1,173 @@
+import threading
+import unittest
+from unittest.mock import AsyncMock, patch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from purge_dispatch import PurgeDispatcher, HttpPurgeTransport, PurgeError, TokenBucket, batched
+
+class FakeFastly(ThreadingHTTPServer):
+    """records the surrogate keys of each purge, fails the first `failures` requests"""
+    def __init__(self, failures: int=0):
+        super().__init__(("127.0.0.1", 0), FakeFastlyHandler)
+        self.failures=failures
+        self.requests=[]
+        self.lock=threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+class FakeFastlyHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        with self.server.lock:
+            fail= self.server.failures > 0
+            if fail:
+                self.server.failures-=1
+            else:
+                self.server.requests.append((self.path, self.headers.get("Surrogate-Key", "").split(), self.headers.get("Fastly-Soft-Purge")))
+        self.send_response(503 if fail else 200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+class TestPurgeDispatcher(unittest.TestCase):
+    keys=[f"list-2024-01-cat{i}" for i in range(1000)]
+
+    def _serve(self, failures=0):
+        server=FakeFastly(failures)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        transport=HttpPurgeTransport({"arxiv.org": "prod-id"}, "token", server.url, pool_size=4)
+        return server, transport
+
+    def test_batched(self):
+        batches=list(batched(iter(range(10)), 4))
+        self.assertEqual(batches, [[0,1,2,3],[4,5,6,7],[8,9]])
+
+    def test_batches_sent_to_fake_fastly(self):
+        server, transport=self._serve()
+        result=PurgeDispatcher(transport, batch_size=256, max_in_flight=4).purge(iter(self.keys))
+
+        self.assertEqual(result.batches, 4)
+        self.assertEqual(len(server.requests), 4)
+        self.assertTrue(all(path=="/service/prod-id/purge" for path, _, _ in server.requests))
+        self.assertTrue(all(len(keys)<=256 for _, keys, _ in server.requests))
+        sent=[key for _, keys, _ in server.requests for key in keys]
+        self.assertEqual(sorted(sent), sorted(self.keys))
+
+    def test_soft_purge_header(self):
+        server, transport=self._serve()
+        PurgeDispatcher(transport).purge(["abs-1234.5678"], soft_purge=True)
+        self.assertEqual(server.requests[0][2], "1")
+
+    def test_failed_batch_retried_alone(self):
+        server, transport=self._serve(failures=1)
+        result=PurgeDispatcher(transport, batch_size=100, max_in_flight=1, backoff=0).purge(self.keys)
+
+        self.assertEqual(result.retries, 1)
+        self.assertEqual(len(server.requests), 10, "only the failed batch is sent again")
+        sent=[key for _, keys, _ in server.requests for key in keys]
+        self.assertEqual(sorted(sent), sorted(self.keys))
+
+    def test_failure_reported_after_all_batches(self):
+        calls=[]
+        def transport(keys, service, soft):
+            calls.append(keys)
+            if "bad" in keys:
+                raise RuntimeError("fastly down")
+
+        with self.assertRaises(PurgeError) as cm:
+            PurgeDispatcher(transport, batch_size=2, attempts=2, backoff=0).purge(["a", "b", "bad", "c", "d"])
+        self.assertEqual(cm.exception.failed, [["bad", "c"]])
+        self.assertEqual(len(calls), 4, "good batches sent once, bad batch twice")
+
+    def _waits(self, transport, **options):
+        """the retry waits of a purge of one batch, without sleeping through them"""
+        sleep=AsyncMock()
+        with patch("purge_dispatch.asyncio.sleep", sleep):
+            PurgeDispatcher(transport, max_in_flight=1, **options).purge(["a"])
+        return [wait for (wait,), _ in sleep.call_args_list if wait]
+
+    def test_retry_backoff_jittered(self):
+        failures=iter([True, True, True])
+        def transport(keys, service, soft):
+            if next(failures, False):
+                raise RuntimeError("fastly down")
+        self.assertEqual(self._waits(transport, attempts=4, backoff=1, rand=lambda: 0.5), [0.5, 1.0, 2.0])
+
+    def test_rate_limited_retry_waits_retry_after(self):
+        class Response:
+            status_code=429
+            headers={"Retry-After": "3"}
+        class RateLimited(Exception):
+            response=Response()
+        failures=iter([True])
+        def transport(keys, service, soft):
+            if next(failures, False):
+                raise RateLimited("429")
+        self.assertEqual(self._waits(transport, backoff=0.5, rand=lambda: 1.0), [3.0])
+
+    def test_confirmed_batches_reported(self):
+        confirmed=[]
+        def transport(keys, service, soft):
+            if "bad" in keys:
+                raise RuntimeError("fastly down")
+
+        with self.assertRaises(PurgeError):
+            PurgeDispatcher(transport, batch_size=2, max_in_flight=2, attempts=1).purge(["a", "b", "bad", "c", "d"], on_batch=confirmed.append)
+        self.assertEqual(sorted(confirmed), [["a", "b"], ["d"]])
+
+    def test_batch_size_limit(self):
+        with self.assertRaises(ValueError):
+            PurgeDispatcher(batch_size=257)
+
+    def test_services_purged_together(self):
+        started=threading.Barrier(3, timeout=5)
+        sent=[]
+        def transport(keys, service, soft):
+            started.wait() #only passes once all three services have a request out
+            sent.append((service, keys))
+
+        results=PurgeDispatcher(transport).purge_services({"arxiv.org": ["announce"], "rss.arxiv.org": ["announce"], "export.arxiv.org": ["announce"]})
+        self.assertEqual(sorted(service for service, _ in sent), ["arxiv.org", "export.arxiv.org", "rss.arxiv.org"])
+        self.assertEqual(results["rss.arxiv.org"].keys, 1)
+
+    def test_service_failures_reported_together(self):
+        def transport(keys, service, soft):
+            if service != "arxiv.org":
+                raise RuntimeError("fastly down")
+
+        with self.assertRaises(PurgeError) as cm:
+            PurgeDispatcher(transport, attempts=1).purge_services({"arxiv.org": ["a"], "rss.arxiv.org": ["b"], "export.arxiv.org": ["c"]})
+        self.assertEqual(sorted(cm.exception.failed), [["b"], ["c"]])
+        self.assertEqual(cm.exception.result.batches, 3)
+        self.assertEqual({service: result.ok for service, result in cm.exception.services.items()},
+                         {"arxiv.org": True, "rss.arxiv.org": False, "export.arxiv.org": False})
+
+    def test_confirmed_batches_by_service(self):
+        confirmed=[]
+        results=PurgeDispatcher(lambda keys, service, soft: None, batch_size=2).purge_services(
+            {"arxiv.org": ["a", "b", "c"], "rss.arxiv.org": ["d"]}, on_batch=lambda service, batch: confirmed.append((service, batch)))
+        self.assertEqual(sorted(confirmed), [("arxiv.org", ["a", "b"]), ("arxiv.org", ["c"]), ("rss.arxiv.org", ["d"])])
+        self.assertTrue(all(result.seconds > 0 for result in results.values()))
+
+    def test_limiter_holds_every_request(self):
+        limiter=TokenBucket(1000, burst=1, clock=lambda: 0.0) #no refill however slowly the requests go
+        PurgeDispatcher(lambda keys, service, soft: None, batch_size=1, limiter=limiter).purge(["a", "b", "c"])
+        self.assertLessEqual(limiter._tokens, -1, "two requests had to wait for a token")
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_rate(self):
+        now=[0.0]
+        bucket=TokenBucket(10, burst=2, clock=lambda: now[0])
+        self.assertEqual([bucket.reserve(), bucket.reserve()], [0.0, 0.0])
+        self.assertAlmostEqual(bucket.reserve(), 0.1)
+        self.assertAlmostEqual(bucket.reserve(), 0.2, msg="later callers queue behind tokens already taken")
+        now[0]=1.0
+        self.assertEqual(bucket.reserve(), 0.0)
@@ -1,19 +1,29 @@
 import base64
+import json
 import unittest
 from unittest.mock import patch, call
 from cloudevents.http import CloudEvent
 
 import sys, os
 sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
-from main import purge_for_announce, _process_announcements
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "..") )
+from main import purge_for_announce, _process_announcements, _get_days_announcements, _purge_announced_papers, _list_keys_for
+from purge_dispatch import PurgeDispatcher, HttpPurgeTransport
+from fake_fastly import FakeFastly
+from key_priority import KeyPriority
+from announce_db import fixture_engine, fixture_session, add_mailing, schema
+from database import Database
+from metrics import invocation
+from purge_dispatch import PurgeError
+from run_state import SqliteRunState
 
 class TestAnnouncePurge(unittest.TestCase):
     production_calls = [
-        call("announce", "rss.arxiv.org"),
-        call("announce" ),
-        #call("announce","export.arxiv.org") #not currently enabled
+        call(["announce"], "rss.arxiv.org", soft_purge=False),
+        call(["announce"], "arxiv.org", soft_purge=False),
+        #call(["announce"], "export.arxiv.org", soft_purge=False) #not currently enabled
     ]
-    dev_calls=[call("announce", "browse.dev.arxiv.org"),]
+    dev_calls=[call(["announce"], "browse.dev.arxiv.org", soft_purge=False),]
 
     mock_data = {
         "message": {
@@ -155,4 +165,205 @@ class TestProcessAnnouncements(unittest.TestCase):
         self.assertEqual(len(result), len(set(result)),"no duplicate keys")
         expected = self.new_expected + self.cross_expected + self.rep_expected + self.jref_expected + self.wdr_expected + self.unneccessary_expected
         self.assertEqual(sorted(result), sorted(list(set(expected))), "all keys are as expected")
-        
\ No newline at end of file
+        
+    def test_paper_keys_deduplicated(self):
+        result=_process_announcements([
+            ("1104.1284", 7, "rep", "hep-lat", ""),
+            ("1104.1284", 7, "jref", "hep-lat", ""),
+        ])
+        self.assertEqual(result.count("abs-1104.1284"), 1)
+        self.assertEqual(len(result), len(set(result)))
+
+    def test_list_keys_cached(self):
+        _list_keys_for.cache_clear()
+        shared=[(f"1104.{n:04d}", 1, "jref", "hep-lat astro-ph.SR", "") for n in range(50)]
+        _process_announcements(shared)
+        info=_list_keys_for.cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 49)
+        self.assertIsInstance(_list_keys_for("hep-lat astro-ph.SR", 2011, 4), frozenset)
+
+class TestStreamingAnnouncements(unittest.TestCase):
+    todays_rows=[
+        ("1204.1234", 1, "new", "math.NA", ""),
+        ("1104.1234", 3, "cross", "hep-lat astro-ph.SR", "astro-ph.SR"),
+        ("0904.1234", 3, "rep", "hep-lat astro-ph.SR", ""),
+        ("1203.1234", 1, "jref", "cs.GL", ""),
+        ("1112.1234", 1, "wdr", "cs.GL", ""),
+    ]
+
+    def setUp(self):
+        engine=fixture_engine()
+        add_mailing(engine, "240101", [("1101.0001", 1, "new", "cs.AI", "")])
+        add_mailing(engine, "240102", self.todays_rows)
+        self.session=fixture_session(engine)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_only_latest_current_rows(self):
+        rows=[tuple(row) for row in _get_days_announcements(self.session, batch_size=2)]
+        self.assertEqual(sorted(rows), sorted(self.todays_rows))
+
+    def test_keys_from_stream_match(self):
+        streamed=_process_announcements(_get_days_announcements(self.session, batch_size=2))
+        self.assertEqual(sorted(streamed), sorted(_process_announcements(self.todays_rows)))
+
+    def test_pooled_session_when_none_given(self):
+        database=Database("sqlite://")
+        schema.create_all(database.engine)
+        add_mailing(database.engine, "240102", self.todays_rows)
+        with patch('main._get_database', return_value=database):
+            with invocation("first", sink=lambda record: None):
+                rows=[tuple(row) for row in _get_days_announcements(batch_size=2)]
+                stats=database.stats
+            with invocation("second", sink=lambda record: None):
+                rows_again=list(_get_days_announcements())
+                second=database.stats
+
+        self.assertEqual(sorted(rows), sorted(self.todays_rows))
+        self.assertEqual(len(rows_again), len(rows))
+        self.assertEqual((stats.rows, stats.queries), (len(self.todays_rows), 2)) #latest mail_id, then the mailing
+        self.assertEqual((second.connects, second.queries), (0, 2)) #second invocation reused the pooled connection
+
+    @patch('main._get_days_announcements')
+    def test_purge_starts_before_query_finishes(self, MockAnnouncements):
+        events=[]
+        def rows():
+            for row in self.todays_rows:
+                events.append("row")
+                yield row
+            events.append("done")
+        MockAnnouncements.return_value=rows()
+
+        def transport(keys, service, soft):
+            events.append("purge")
+        with patch('main._get_dispatcher', return_value=PurgeDispatcher(transport, batch_size=2, max_in_flight=1)), \
+             patch('main.ID_PARSE_BATCH', 2), \
+             patch.dict('os.environ', {'ENVIRONMENT': 'PRODUCTION'}):
+            _purge_announced_papers()
+
+        self.assertLess(events.index("purge"), events.index("done"))
+
+    def _run(self, state, transport, force=False):
+        data=b'{"event": "announcement_complete", "force": true}' if force else b'{"event": "announcement_complete"}'
+        event=CloudEvent({'type': 'test', 'source': 'test'}, {"message": {"data": base64.b64encode(data)}})
+        dispatcher=PurgeDispatcher(transport, batch_size=3, max_in_flight=1, attempts=1)
+        with patch('main._get_dispatcher', return_value=dispatcher), \
+             patch('main._get_run_state', return_value=state), \
+             patch('main._latest_mail_id', return_value="240102"), \
+             patch('main._get_days_announcements', side_effect=lambda **kwargs: iter(self.todays_rows)), \
+             patch('main.purge_fastly_keys') as announce_purge, \
+             patch.dict('os.environ', {'ENVIRONMENT': 'PRODUCTION'}):
+            purge_for_announce(event)
+        return announce_purge
+
+    def test_redelivery_resumes(self):
+        sent=[]
+        def failing(keys, service, soft):
+            if len(sent) >= 3:
+                raise ConnectionError("fastly timeout")
+            sent.extend(keys)
+        state=SqliteRunState(":memory:")
+        with self.assertRaises(PurgeError):
+            self._run(state, failing)
+        first=list(sent)
+        self.assertFalse(state.completed("240102"))
+
+        sent.clear()
+        self._run(state, lambda keys, service, soft: sent.extend(keys))
+        self.assertEqual(set(first).intersection(sent), set(), "confirmed keys not sent again")
+        self.assertTrue(sent)
+        self.assertTrue(state.completed("240102"))
+
+    def test_duplicate_event_ignored(self):
+        sent=[]
+        state=SqliteRunState(":memory:")
+        self._run(state, lambda keys, service, soft: sent.extend(keys))
+        count=len(sent)
+        announce_purge=self._run(state, lambda keys, service, soft: sent.extend(keys))
+
+        self.assertEqual(len(sent), count)
+        announce_purge.assert_not_called()
+
+    def test_forced_rerun(self):
+        sent=[]
+        state=SqliteRunState(":memory:")
+        self._run(state, lambda keys, service, soft: sent.extend(keys))
+        count=len(sent)
+        self._run(state, lambda keys, service, soft: sent.extend(keys), force=True)
+        self.assertEqual(len(sent), 2*count)
+
+    def test_metrics_record(self):
+        records=[]
+        with patch('metrics.sink_from_env', return_value=records.append):
+            self._run(SqliteRunState(":memory:"), lambda keys, service, soft: None)
+
+        record=records[0]
+        self.assertEqual((record["function"], record["event"], record["mail_id"]), ("purge_for_announce", "announcement_complete", "240102"))
+        self.assertEqual(record["counts"]["keys"], sum(record["keys_by_family"].values()))
+        self.assertEqual(record["counts"]["purge_batches"], -(-record["counts"]["keys"] // 3))
+        self.assertEqual(set(record["stages"]), {"query", "generate_keys", "purge"})
+
+class TestServiceFanOut(unittest.TestCase):
+    rows=TestStreamingAnnouncements.todays_rows
+    service_ids={"arxiv.org": "prod-id", "export.arxiv.org": "export-id", "rss.arxiv.org": "rss-id"}
+    services={"papers": ["arxiv.org", "export.arxiv.org"], "announce": ["arxiv.org", "rss.arxiv.org"]}
+
+    def setUp(self):
+        self.fake=FakeFastly().start()
+        self.addCleanup(self.fake.stop)
+        self.transport=HttpPurgeTransport(self.service_ids, "token", self.fake.url)
+
+    def _run(self, transport, state=None, max_in_flight=8):
+        event=CloudEvent({'type': 'test', 'source': 'test'}, {"message": {"data": base64.b64encode(b'{"event": "announcement_complete"}')}})
+        records=[]
+        with patch('main._get_dispatcher', return_value=PurgeDispatcher(transport, batch_size=3, max_in_flight=max_in_flight, attempts=1)), \
+             patch('main._get_run_state', return_value=state), \
+             patch('main._latest_mail_id', return_value="240102"), \
+             patch('main._get_days_announcements', side_effect=lambda **kwargs: iter(self.rows)), \
+             patch('metrics.sink_from_env', return_value=records.append), \
+             patch.dict('os.environ', {'ENVIRONMENT': 'PRODUCTION', 'PURGE_SERVICES': json.dumps(self.services)}):
+            try:
+                purge_for_announce(event)
+            finally:
+                self.record=records[0]
+
+    def test_every_service_purged(self):
+        self._run(self.transport)
+        keys=set(_process_announcements(self.rows))
+
+        self.assertEqual(self.fake.purged_keys("prod-id"), keys | {"announce"})
+        self.assertEqual(self.fake.purged_keys("export-id"), keys)
+        self.assertEqual(self.fake.purged_keys("rss-id"), {"announce"})
+        self.assertEqual(set(self.record["services"]), {"arxiv.org", "export.arxiv.org"})
+        self.assertTrue(all(service["ok"] and service["keys"] == len(keys) for service in self.record["services"].values()))
+        self.assertEqual(set(self.record["announce_services"]), {"arxiv.org", "rss.arxiv.org"})
+
+    def test_hot_keys_first(self):
+        self._run(self.transport, max_in_flight=1) #so requests arrive in the order they were sent
+        tiers=[KeyPriority().tier(key) for request in self.fake.requests if request.service_id == "prod-id" for key in request.keys]
+
+        self.assertEqual(tiers[:-1], sorted(tiers[:-1]), "tier by tier, then the announce key")
+        self.assertEqual(list(self.record["time_to_purge"]), ["hot", "versions", "archive"])
+        self.assertEqual(sum(self.record["keys_by_tier"].values()), self.record["counts"]["keys"])
+
+    def test_failing_service_resumed_alone(self):
+        def export_down(keys, service, soft):
+            if service == "export.arxiv.org":
+                raise ConnectionError("export down")
+            self.transport(keys, service, soft)
+        state=SqliteRunState(":memory:")
+        with self.assertRaises(PurgeError):
+            self._run(export_down, state)
+        keys=set(_process_announcements(self.rows))
+
+        self.assertEqual(self.fake.purged_keys("prod-id"), keys, "other services go through, the announce key waits")
+        self.assertEqual((self.record["services"]["arxiv.org"]["ok"], self.record["services"]["export.arxiv.org"]["ok"]), (True, False))
+        self.assertFalse(state.completed("240102"))
+
+        self.fake.reset()
+        self._run(self.transport, state)
+        self.assertEqual(self.fake.purged_keys("prod-id"), {"announce"}, "confirmed on arxiv.org, not sent again")
+        self.assertEqual(self.fake.purged_keys("export-id"), keys)
+        self.assertTrue(state.completed("240102"))
@@ -0,0 +1,136 @@
+import unittest
+import tempfile
+import threading
+from unittest.mock import patch
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from purge_dispatch import PurgeDispatcher, PurgeError
+from run_state import FileRunState, MailingRun, SqliteRunState, run_state_from_env
+from run_state_db import DbRunState
+
+KEYS=["abs-2401.00001", "paper-id-2401.00001v1", "list-2024-01-cs.AI", "list-2024-cs", "year-cs-2024", "abs-2312.00002"]
+
+class RunStateTests:
+    """run against each backend by the subclasses below"""
+    def make_store(self, directory, keep): ...
+
+    def setUp(self):
+        self.dir=tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.store=self.make_store(self.dir.name, keep=2)
+        self.sent=[]
+
+    def purge(self, mail_id, keys, transport=None):
+        run=MailingRun(self.store, mail_id, "arxiv.org")
+        dispatcher=PurgeDispatcher(transport or (lambda batch, service, soft: self.sent.extend(batch)), batch_size=2, max_in_flight=1, attempts=1, backoff=0)
+        dispatcher.purge(run.new(keys), on_batch=run.confirm)
+        return run
+
+    def test_resume_after_failure(self):
+        def transport(batch, service, soft):
+            if "list-2024-cs" in batch:
+                raise ConnectionError("fastly down")
+            self.sent.extend(batch)
+        with self.assertRaises(PurgeError):
+            self.purge("240102", KEYS, transport)
+        self.assertEqual(self.store.confirmed("240102", "arxiv.org"), set(KEYS) - {"list-2024-01-cs.AI", "list-2024-cs"})
+
+        self.sent.clear()
+        run=self.purge("240102", KEYS)
+        self.assertEqual(self.sent, ["list-2024-01-cs.AI", "list-2024-cs"])
+        self.assertEqual(run.skipped, 4)
+
+    def test_next_mailing_purges_everything(self):
+        self.purge("240102", KEYS)
+        self.sent.clear()
+        self.purge("240103", KEYS)
+        self.assertEqual(self.sent, KEYS)
+
+    def test_complete(self):
+        self.purge("240102", KEYS)
+        self.assertFalse(self.store.completed("240102"))
+        self.store.complete("240102")
+        self.assertTrue(self.store.completed("240102"))
+        self.assertFalse(self.store.completed("240103"))
+
+    def test_forget(self):
+        self.purge("240102", KEYS)
+        self.store.complete("240102")
+        self.store.forget("240102")
+        self.assertFalse(self.store.completed("240102"))
+        self.assertEqual(self.store.confirmed("240102", "arxiv.org"), set())
+
+    def test_services_kept_apart(self):
+        self.store.confirm("240102", "arxiv.org", ["list-2024-cs"])
+        self.assertEqual(self.store.confirmed("240102", "browse.dev.arxiv.org"), set())
+
+    def test_old_mailings_dropped(self):
+        for mail_id in ("240101", "240102", "240103"):
+            self.store.confirm(mail_id, "arxiv.org", ["list-2024-cs"])
+            self.store.complete(mail_id)
+        self.assertEqual(self.store.mailings(), ["240102", "240103"])
+        self.assertFalse(self.store.completed("240101"))
+
+class TestSqliteRunState(RunStateTests, unittest.TestCase):
+    def make_store(self, directory, keep):
+        store=SqliteRunState(os.path.join(directory, "state.db"), keep=keep)
+        self.addCleanup(store.close)
+        return store
+
+class TestFileRunState(RunStateTests, unittest.TestCase):
+    def make_store(self, directory, keep):
+        return FileRunState(os.path.join(directory, "state"), keep=keep)
+
+class TestDbRunState(RunStateTests, unittest.TestCase):
+    def make_store(self, directory, keep):
+        self.url=f"sqlite:///{os.path.join(directory, 'state.db')}"
+        store=DbRunState(self.url, keep=keep)
+        self.addCleanup(store.close)
+        return store
+
+    def test_shared_between_instances(self):
+        other=DbRunState(self.url, keep=2)
+        self.addCleanup(other.close)
+        def transport(batch, service, soft):
+            if "list-2024-cs" in batch:
+                raise ConnectionError("fastly down")
+        with self.assertRaises(PurgeError):
+            self.purge("240102", KEYS, transport)
+
+        run=MailingRun(other, "240102", "arxiv.org")
+        self.assertEqual(list(run.new(KEYS)), ["list-2024-01-cs.AI", "list-2024-cs"])
+        other.complete("240102")
+        self.assertTrue(self.store.completed("240102"))
+
+    def test_same_keys_confirmed_at_once(self):
+        stores=[DbRunState(self.url) for _ in range(4)]
+        start=threading.Barrier(len(stores))
+        def confirm(store):
+            start.wait()
+            for batch in range(5):
+                store.confirm("240102", "arxiv.org", KEYS[batch:])
+        threads=[threading.Thread(target=confirm, args=(store,)) for store in stores]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for store in stores:
+            store.close()
+        self.assertEqual(self.store.confirmed("240102", "arxiv.org"), set(KEYS))
+
+class TestRunStateFromEnv(unittest.TestCase):
+    def test_backends(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for backend, path, kind in (("sqlite", os.path.join(directory, "state.db"), SqliteRunState),
+                                        ("file", os.path.join(directory, "state"), FileRunState),
+                                        ("db", f"sqlite:///{os.path.join(directory, 'shared.db')}", DbRunState)):
+                with patch.dict('os.environ', {"PURGE_STATE_PATH": path, "PURGE_STATE_BACKEND": backend}):
+                    store=run_state_from_env()
+                self.assertIsInstance(store, kind)
+                if hasattr(store, "close"):
+                    store.close()
+
+    def test_unset(self):
+        with patch.dict('os.environ', {}, clear=True):
+            self.assertIsNone(run_state_from_env())
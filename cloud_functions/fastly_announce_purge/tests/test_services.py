@@ -0,0 +1,22 @@
+import unittest
+from unittest.mock import patch
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from services import ServicePlan, service_plan
+
+class TestServicePlan(unittest.TestCase):
+    def test_environments(self):
+        self.assertEqual(service_plan("PRODUCTION"), ServicePlan(("arxiv.org",), ("arxiv.org", "rss.arxiv.org")))
+        self.assertEqual(service_plan("DEVELOPMENT").announce, ("browse.dev.arxiv.org",))
+        self.assertEqual(service_plan("TESTING"), ServicePlan())
+        self.assertIsNone(service_plan("Nonsense"))
+        self.assertIsNone(service_plan(None))
+
+    def test_override(self):
+        with patch.dict(os.environ, {"PURGE_SERVICES": '{"papers": ["arxiv.org", "export.arxiv.org"]}'}):
+            self.assertEqual(service_plan("PRODUCTION"), ServicePlan(("arxiv.org", "export.arxiv.org"), ("arxiv.org", "rss.arxiv.org")))
+            self.assertEqual(service_plan("Nonsense"), ServicePlan(("arxiv.org", "export.arxiv.org"), ()))
+
+if __name__ == '__main__':
+    unittest.main()
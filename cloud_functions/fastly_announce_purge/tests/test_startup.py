@@ -0,0 +1,41 @@
+import unittest
+import threading
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from startup import Lazy
+
+class TestLazy(unittest.TestCase):
+    def test_builds_once(self):
+        calls=[]
+        lazy=Lazy(lambda: calls.append(1) or object())
+        self.assertFalse(lazy.built)
+        first=lazy.get()
+        self.assertIs(lazy.get(), first)
+        self.assertTrue(lazy.built)
+        self.assertEqual(len(calls), 1)
+
+    def test_reset(self):
+        lazy=Lazy(object)
+        first=lazy.get()
+        lazy.reset()
+        self.assertFalse(lazy.built)
+        self.assertIsNot(lazy.get(), first)
+
+    def test_concurrent_first_use(self):
+        calls=[]
+        start=threading.Barrier(8)
+        def build():
+            calls.append(1)
+            return object()
+        lazy=Lazy(build)
+        results=[]
+        def use():
+            start.wait()
+            results.append(lazy.get())
+        threads=[threading.Thread(target=use) for _ in range(8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(map(id, results))), 1)
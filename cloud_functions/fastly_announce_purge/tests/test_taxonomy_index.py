@@ -0,0 +1,70 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from arxiv.taxonomy.category import get_all_cats_from_string
+from arxiv.taxonomy.definitions import CATEGORIES
+from taxonomy_index import TaxonomyIndex, load, taxonomy_index_from_env, base_version
+
+def reference_list_keys(categories, year, month):
+    """list keys as they were worked out before the index, straight from the taxonomy objects"""
+    groups, archs, cats= get_all_cats_from_string(categories)
+    lists=set()
+    for item in list(cats) + list(archs):
+        lists.add(f"list-{year:04d}-{item.id}")
+        lists.add(f"list-{year:04d}-{month:02d}-{item.id}")
+    for group in groups:
+        if group.id=='grp_physics':
+            lists.add(f"list-{year:04d}-{month:02d}-{group.id}")
+    return lists
+
+class TestTaxonomyIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.index=TaxonomyIndex.build()
+
+    def test_every_category_matches_taxonomy(self):
+        self.assertEqual(set(self.index.entries), set(CATEGORIES))
+        for category in CATEGORIES:
+            self.assertEqual(self.index.list_keys(category, 2011, 4), reference_list_keys(category, 2011, 4), category)
+            _, archs, _= get_all_cats_from_string(category)
+            self.assertEqual(self.index.year_keys(category, 2011), {f"year-{arch.id}-2011" for arch in archs}, category)
+
+    def test_category_strings_match_taxonomy(self):
+        categories=sorted(CATEGORIES)
+        for n in range(0, len(categories) - 2, 3):
+            string=" ".join(categories[n:n+3])
+            self.assertEqual(self.index.list_keys(string, 2009, 12), reference_list_keys(string, 2009, 12), string)
+
+    def test_unknown_category_raises_key_error(self):
+        with self.assertRaises(KeyError):
+            self.index.list_keys("hep-lat bad.category", 2011, 4)
+
+    def test_immutable(self):
+        with self.assertRaises(TypeError):
+            self.index.entries["cs.LG"]=None
+
+    def test_json_round_trip_loaded_without_taxonomy(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path=os.path.join(tmp, "taxonomy_index.json")
+            self.index.write(path)
+            with patch.dict(os.environ, {"TAXONOMY_INDEX_PATH": path}), \
+                 patch.object(TaxonomyIndex, "build", side_effect=AssertionError("should be loaded, not built")):
+                loaded=taxonomy_index_from_env()
+        self.assertEqual(dict(loaded.entries), dict(self.index.entries))
+
+    def test_other_version_rebuilt(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path=os.path.join(tmp, "taxonomy_index.json")
+            with open(path, "w") as f:
+                json.dump({**self.index.to_json(), "arxiv_base": base_version() + "-old"}, f)
+            self.assertIsNone(load(path))
+            with patch.dict(os.environ, {"TAXONOMY_INDEX_PATH": path}):
+                self.assertEqual(len(taxonomy_index_from_env().entries), len(CATEGORIES))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,23 +1,15 @@
 import json
 import base64
-import os
+import logging
 import functions_framework
 from cloudevents.http import CloudEvent
 
-# quick and dirty override to get some logging verbosity on localhost
-if not(os.environ.get('LOG_LOCALLY')):
-    #cloud function logging setup
-    import google.cloud.logging
-    client = google.cloud.logging.Client()
-    client.setup_logging()
-
-import logging 
-log_level_str = os.getenv('LOG_LEVEL', 'INFO')
-log_level = getattr(logging, log_level_str.upper(), logging.INFO)
-logging.basicConfig(level=log_level)
+#cloud logging is set up on the first call of an entry point (LOG_LOCALLY for local logging), see startup.py
+from startup import setup_logging
 
 @functions_framework.http
 def hello_world_http(request):
+    setup_logging()
     try:
         handlers = logging.getLogger().handlers
         logging.info (f"Handlers: {handlers}")
@@ -31,6 +23,7 @@ def hello_world_http(request):
 
 @functions_framework.cloud_event
 def hello_world(cloud_event: CloudEvent):
+    setup_logging()
     event_data=cloud_event.get_data()
     logging.info (f"Event Data: {event_data}")
     logging.info (f"Event Attributes: {cloud_event.get_attributes()}")
@@ -0,0 +1,90 @@
+"""reports how long importing each function's main.py takes, using python -X importtime
+
+run from the cloud_functions folder with the function's requirements installed
+` python importtime.py ` for every function, or ` python importtime.py purge_on_bucket_change --top 20 `
+` python importtime.py fastly_announce_purge --max-ms 800 ` exits with 1 when the import takes longer, to catch cold start regressions
+LOG_LOCALLY is unset for the import, as it is when deployed
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, Iterable, List, Tuple
+
+HERE=os.path.dirname(os.path.abspath(__file__))
+FUNCTIONS=sorted(name for name in os.listdir(HERE) if os.path.exists(os.path.join(HERE, name, "src", "main.py")))
+
+
+def parse(lines: Iterable[str]) -> List[Tuple[str, int, int, int]]:
+    """(module, depth, self us, cumulative us) for each line of -X importtime output, in the order they are printed
+    a module is printed after the modules it imports, indented two more spaces than the module importing it
+    """
+    times=[]
+    for line in lines:
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, module=line[len("import time:"):].split("|")
+        name=module.lstrip()
+        depth=(len(module) - len(name) - 1) // 2 #one space after the bar, then two per level
+        times.append((name.rstrip(), depth, int(own), int(cumulative)))
+    return times
+
+
+def import_times(function: str) -> List[Tuple[str, int, int, int]]:
+    """parse of the importtime output of `import main` for function"""
+    env=dict(os.environ)
+    env.pop("LOG_LOCALLY", None)
+    proc=subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=os.path.join(HERE, function, "src"),
+                        env=env, capture_output=True, text=True)
+    if proc.returncode:
+        raise RuntimeError(f"importing {function}/src/main.py failed:\n{proc.stderr[-2000:]}")
+    return parse(proc.stderr.splitlines())
+
+
+def summarize(function: str, times: List[Tuple[str, int, int, int]], top: int) -> Dict:
+    """the import time of main and its heaviest direct imports, the modules printed one level in since the previous top level module"""
+    direct: List[Tuple[str, int, int, int]]=[]
+    total=0
+    for t in times:
+        module, depth, _, cumulative=t
+        if depth == 0:
+            if module == "main":
+                total=cumulative
+                break
+            direct=[]
+        elif depth == 1:
+            direct.append(t)
+    heaviest=sorted(direct, key=lambda t: -t[3])
+    return {"function": function,
+            "total_ms": total / 1000,
+            "modules": len(times),
+            "heaviest": [{"module": module, "cumulative_ms": cumulative / 1000} for module, _, _, cumulative in heaviest[:top]]}
+
+
+def report(function: str, top: int) -> Dict:
+    return summarize(function, import_times(function), top)
+
+
+def main() -> None:
+    parser=argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("functions", nargs="*", default=FUNCTIONS, choices=FUNCTIONS)
+    parser.add_argument("--top", type=int, default=10, help="heaviest imports of main.py to list")
+    parser.add_argument("--max-ms", type=float, help="fail if any function takes longer than this to import")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args=parser.parse_args()
+
+    reports=[report(function, args.top) for function in args.functions]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for r in reports:
+            print(f"{r['function']}: {r['total_ms']:.1f} ms, {r['modules']} modules")
+            for heavy in r["heaviest"]:
+                print(f"    {heavy['cumulative_ms']:8.1f} ms  {heavy['module']}")
+    if args.max_ms is not None and any(r["total_ms"] > args.max_ms for r in reports):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
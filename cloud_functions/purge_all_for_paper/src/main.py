@@ -1,45 +1,143 @@
 import json
 import base64
+import logging
 import os
+from typing import Any, Dict, List, Optional, Tuple
 
 import functions_framework
 from cloudevents.http import CloudEvent
 
-from arxiv.integration.fastly.purge import purge_cache_for_paper
-from arxiv.identifier import IdentifierException
+from metrics import current, instrumented
+from paper_keys import PAPER_SERVICE, paper_keys
+from purge_dispatch import DispatchResult, PurgeDispatcher, PurgeError, dispatcher_from_env
+from startup import Lazy, setup_logging
+from taxonomy_index import TaxonomyIndex, taxonomy_index_from_env
 
-#logging setup
-if not(os.environ.get('LOG_LOCALLY')):
-    import google.cloud.logging
-    client = google.cloud.logging.Client()
-    client.setup_logging()
-import logging 
-log_level_str = os.getenv('LOG_LEVEL', 'INFO')
-log_level = getattr(logging, log_level_str.upper(), logging.INFO)
-logging.basicConfig(level=log_level)
+def purge_fastly_keys(*args, **kwargs) -> None:
+    """arxiv.integration.fastly.purge.purge_fastly_keys, imported on first use"""
+    from arxiv.integration.fastly.purge import purge_fastly_keys as purge
+    purge(*args, **kwargs)
+
+def _send_through_base(keys: List[str], service_name: str, soft_purge: bool) -> None:
+    purge_fastly_keys(keys, service_name, soft_purge=soft_purge)
+
+def _build_dispatcher() -> PurgeDispatcher:
+    return dispatcher_from_env(_send_through_base)
+
+#kept between warm invocations so its connection pool gets reused
+_dispatcher: Lazy[PurgeDispatcher]=Lazy(_build_dispatcher)
+
+def _get_dispatcher() -> PurgeDispatcher:
+    return _dispatcher.get()
+
+#category expansions, built once per instance
+_taxonomy: Lazy[TaxonomyIndex]=Lazy(taxonomy_index_from_env)
 
 @functions_framework.cloud_event
+@instrumented("purge_all_for_paper")
 def purge_all_for_paper(cloud_event: CloudEvent):
     """ this function purges everything to do with a particular paper, inlcuding list pages it is on.
     old_cats is used in case fo a category change to also refresh any lists the paper was removed from, and any year tallies its been added to or removed from
+    a message with "papers", a list of {"paper_id", "old_categories"} entries, purges all of them together, see _purge_papers
     """
+    setup_logging()
 
     data=json.loads(base64.b64decode(cloud_event.get_data()['message']['data']).decode())
     logging.info(f"Received message: {data}")
+    enviro=os.environ.get('ENVIRONMENT')
+    if "papers" in data:
+        if enviro == "PRODUCTION":
+            _purge_papers(data["papers"])
+        else:
+            logging.info(f"Purge request ignored for non-production environment. Enviroment: {enviro} papers: {data['papers']}")
+        return
+
     paper= data.get("paper_id")
     old_cats= data.get("old_categories")
-    enviro=os.environ.get('ENVIRONMENT')
     if enviro == "PRODUCTION":
+        #a single paper is a batch of one, so it goes through the same key helper and purge client.
+        #message structure errors are logged and acknowledged so they don't repeat
+        _purge_papers([{"paper_id": paper, "old_categories": old_cats}])
+    else:
+        logging.info(f"Purge request ignored for non-production environment. Enviroment: {enviro} paper_id: {paper} old_categories: {old_cats}")
+
+
+def _purge_papers(entries: Any) -> Dict[str, str]:
+    """purges every paper in entries with one set of purge requests per service, the services at the same time
+    each paper's keys are worked out as purge_cache_for_paper would (paper_keys.py), then the union is purged so list and year pages shared by several papers are only sent once
+    entries that fail validation are logged and skipped without failing the rest, returns them as paper_id: reason
+    """
+    from arxiv.identifier import IdentifierException
+    metrics=current()
+    errors: Dict[str, str]={}
+    keys: Dict[str, Dict[str, None]]={} #service: insertion ordered set of keys
+    papers=0
+    for n, entry in enumerate(entries if isinstance(entries, list) else []):
+        paper, old_cats, problem=_parse_entry(entry)
+        if problem:
+            errors[str(paper or f"entry {n}")]=problem
+            continue
         try:
-            if old_cats=="Not specified":
-                purge_cache_for_paper(paper)
-            else:
-                purge_cache_for_paper(paper, old_cats)
-        #log message structure errors and acknowledge so they don't repeat    
+            with metrics.stage("generate_keys"):
+                found=_paper_keys(paper, old_cats)
+            for service, service_keys in found.items():
+                keys.setdefault(service, {}).update(dict.fromkeys(service_keys))
+                metrics.count("keys_requested", len(service_keys))
+            papers+=1
         except KeyError as e:
-            logging.error(f"Bad category string in old_categories: {old_cats}. Info: {e}")
+            errors[paper]=f"Bad category string in old_categories: {old_cats}. Info: {e}"
         except IdentifierException as e:
-            logging.error(f"Invalid paper_id provided: {paper}. Info: {e}")
-    else:
-        logging.info(f"Purge request ignored for non-production environment. Enviroment: {enviro} paper_id: {paper} old_categories: {old_cats}")
+            errors[paper]=f"Invalid paper_id provided: {paper}. Info: {e}"
+    if not isinstance(entries, list):
+        errors["papers"]=f"papers must be a list, got: {entries}"
+
+    for paper, reason in errors.items():
+        logging.error(f"Skipped {paper}: {reason}")
+    metrics.count("papers", papers)
+    metrics.count("papers_skipped", len(errors))
+    metrics.count("keys", sum(len(service_keys) for service_keys in keys.values()))
+    metrics.count("duplicate_keys_dropped", metrics.counts["keys_requested"] - metrics.counts["keys"])
+    result: Optional[DispatchResult]=None
+    try:
+        with metrics.stage("purge"):
+            results=_get_dispatcher().purge_services({service: list(service_keys) for service, service_keys in keys.items()})
+        for service, service_result in results.items():
+            logging.info(f"Purged {service_result.keys} keys on {service} for {papers} papers")
+        result=DispatchResult(sum(r.batches for r in results.values()), sum(r.keys for r in results.values()), sum(r.retries for r in results.values()))
+    except PurgeError as ex:
+        result=ex.result
+        raise
+    finally:
+        if result is not None:
+            metrics.count("purge_requests", result.batches)
+            metrics.count("purge_retries", result.retries)
+    logging.info(f"Batch purge done: {papers} papers purged, {len(errors)} skipped")
+    return errors
+
+def _parse_entry(entry: Any) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """paper_id, old categories (None when not specified) and what is wrong with the entry, if anything"""
+    if not isinstance(entry, dict):
+        return None, None, f"entry is not an object: {entry}"
+    paper=entry.get("paper_id")
+    old_cats=entry.get("old_categories", "Not specified")
+    if not isinstance(paper, str) or not paper:
+        return None, None, f"missing paper_id: {entry}"
+    if old_cats is not None and not isinstance(old_cats, str):
+        return paper, None, f"old_categories must be a string: {old_cats}"
+    return paper, None if old_cats in (None, "Not specified") else old_cats, None
+
+def _current_categories(paper_id: str) -> str:
+    """the categories of the paper's current version, from the classic db"""
+    from arxiv.db import Session
+    from arxiv.db.models import Metadata
+    from arxiv.identifier import IdentifierException
+    categories=Session.query(Metadata.abs_categories).filter(Metadata.paper_id == paper_id, Metadata.is_current == 1).scalar()
+    if categories is None:
+        raise IdentifierException(f"no current metadata for {paper_id}")
+    return categories
 
+def _paper_keys(paper: str, old_cats: Optional[str]) -> Dict[str, List[str]]:
+    """the keys purge_cache_for_paper purges for a paper, by service, without purging them"""
+    from arxiv.identifier import Identifier
+    arxiv_id=Identifier(paper)
+    return {PAPER_SERVICE: paper_keys(_taxonomy.get(), arxiv_id, _current_categories(arxiv_id.id), old_cats)}
@@ -0,0 +1,38 @@
+"""the keys to purge for a change to a paper, worked out without purging anything
+
+these are the keys arxiv-base's purge_cache_for_paper purges, which only exposes them through the purge itself:
+the paper's own pages: every page tagged with its id, the abstract, and the html, pdf and unavailable pages
+of the current version and, when the id has one, of that version.
+the list pages of its categories for the month of its id, before and after a category change,
+and the year pages of archives it was added to or removed from, whose counts change.
+categories are expanded with the shared taxonomy index, the same one fastly_announce_purge uses.
+tests/test_purge_all_for_paper.py pins the key sets, check them against purge_cache_for_paper when arxiv-base is updated
+"""
+from typing import TYPE_CHECKING, List, Optional
+
+from taxonomy_index import TaxonomyIndex
+
+if TYPE_CHECKING:
+    from arxiv.identifier import Identifier
+
+PAPER_SERVICE="arxiv.org"
+
+
+def page_keys(paper_id: str, paper_idv: Optional[str]=None) -> List[str]:
+    keys=[f"paper-id-{paper_id}", f"abs-{paper_id}"]
+    for kind in ("html", "pdf", "unavailable"):
+        keys.append(f"{kind}-{paper_id}-current")
+        if paper_idv:
+            keys.append(f"{kind}-{paper_idv}")
+    return keys
+
+def paper_keys(index: TaxonomyIndex, arxiv_id: "Identifier", categories: str, old_categories: Optional[str]=None) -> List[str]:
+    """the keys purge_cache_for_paper purges for a paper with its current categories, and old_categories if they changed
+    raises KeyError for an unknown category
+    """
+    keys=page_keys(arxiv_id.id, arxiv_id.idv if arxiv_id.has_version else None)
+    lists=index.list_keys(categories, arxiv_id.year, arxiv_id.month)
+    if old_categories:
+        lists|=index.list_keys(old_categories, arxiv_id.year, arxiv_id.month)
+        lists|=index.year_keys(categories, arxiv_id.year) ^ index.year_keys(old_categories, arxiv_id.year)
+    return keys + sorted(lists)
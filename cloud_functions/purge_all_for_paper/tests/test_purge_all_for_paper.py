@@ -1,11 +1,18 @@
 import base64
+import json
+import threading
+import time
+import types
 import unittest
 from unittest.mock import patch, call
 from cloudevents.http import CloudEvent
 
 import sys, os
 sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
-from main import purge_all_for_paper
+from main import purge_all_for_paper, _purge_papers
+from paper_keys import paper_keys
+from purge_dispatch import PurgeDispatcher
+from taxonomy_index import TaxonomyIndex
 
 class TestAnnouncePurge(unittest.TestCase):
     mock_data1 = {
@@ -21,20 +28,181 @@ class TestAnnouncePurge(unittest.TestCase):
     non_cat_cloud_event = CloudEvent({'type': 'test', 'source': 'test'}, mock_data1)
     cat_cloud_event = CloudEvent({'type': 'test', 'source': 'test'}, mock_data2)
 
-    @patch('main.purge_cache_for_paper')
+    @staticmethod
+    def paper_keys(paper, old_cats):
+        from arxiv.identifier import IdentifierException
+        if paper == "not-an-id":
+            raise IdentifierException("bad id")
+        return {"arxiv.org": [f"abs-{paper}", "list-2012-hep-th"] + ([f"list-2012-{old_cats}"] if old_cats else [])}
+
+    @patch('main.purge_fastly_keys')
     def test_not_prod_environment(self, MockPurgeFun):
-        with patch.dict('os.environ', {'ENVIRONMENT': 'Nonsense'}):
+        with patch('main._paper_keys') as MockKeys, patch.dict('os.environ', {'ENVIRONMENT': 'Nonsense'}):
             purge_all_for_paper(self.non_cat_cloud_event)
-            MockPurgeFun.assert_not_called()
+        MockKeys.assert_not_called()
+        MockPurgeFun.assert_not_called()
 
-    @patch('main.purge_cache_for_paper')
+    @patch('main.purge_fastly_keys')
     def test_with_old_cats(self, MockPurgeFun):
-        with patch.dict('os.environ', {'ENVIRONMENT': 'PRODUCTION'}):
+        with patch('main._paper_keys', side_effect=self.paper_keys) as MockKeys, patch.dict('os.environ', {'ENVIRONMENT': 'PRODUCTION'}):
             purge_all_for_paper(self.cat_cloud_event)
-            MockPurgeFun.assert_called_once_with("1205.1234","hep-lat cs.NA")
+        MockKeys.assert_called_once_with("1205.1234", "hep-lat cs.NA")
+        MockPurgeFun.assert_called_once_with(["abs-1205.1234", "list-2012-hep-th", "list-2012-hep-lat cs.NA"], "arxiv.org", soft_purge=False)
 
-    @patch('main.purge_cache_for_paper')
+    @patch('main.purge_fastly_keys')
     def test_no_old_cats(self, MockPurgeFun):
-        with patch.dict('os.environ', {'ENVIRONMENT': 'PRODUCTION'}):
+        with patch('main._paper_keys', side_effect=self.paper_keys) as MockKeys, patch.dict('os.environ', {'ENVIRONMENT': 'PRODUCTION'}):
             purge_all_for_paper(self.non_cat_cloud_event)
-            MockPurgeFun.assert_called_once_with("1205.1234")
+        MockKeys.assert_called_once_with("1205.1234", None)
+        MockPurgeFun.assert_called_once_with(["abs-1205.1234", "list-2012-hep-th"], "arxiv.org", soft_purge=False)
+
+    @patch('main.purge_fastly_keys')
+    def test_bad_id_logged_not_raised(self, MockPurgeFun):
+        event=CloudEvent({'type': 'test', 'source': 'test'}, {"message": {"data": base64.b64encode(b'{"paper_id": "not-an-id"}')}})
+        with patch('main._paper_keys', side_effect=self.paper_keys), patch.dict('os.environ', {'ENVIRONMENT': 'PRODUCTION'}), \
+             self.assertLogs(level="ERROR") as logs:
+            purge_all_for_paper(event)
+        self.assertIn("Invalid paper_id provided: not-an-id", logs.output[0])
+        MockPurgeFun.assert_not_called()
+
+class TestBatchPurge(unittest.TestCase):
+    papers = [
+        {"paper_id": "1205.1234", "old_categories": "Not specified"},
+        {"paper_id": "1205.5678", "old_categories": "hep-lat"},
+        {"paper_id": "not-an-id"},
+        {"old_categories": "hep-lat"},
+    ]
+    batch_cloud_event = CloudEvent({'type': 'test', 'source': 'test'},
+                                   {"message": {"data": base64.b64encode(json.dumps({"papers": papers}).encode())}})
+
+    @staticmethod
+    def paper_keys(paper, old_cats):
+        from arxiv.identifier import IdentifierException
+        if paper == "not-an-id":
+            raise IdentifierException("bad id")
+        keys=[f"abs-{paper}", f"paper-id-{paper}", "list-2012-05-hep-th", "list-2012-hep-th"]
+        if old_cats:
+            keys.append(f"list-2012-{old_cats}")
+        return {"arxiv.org": keys}
+
+    @patch('main.purge_fastly_keys')
+    def test_union_purged_once(self, MockPurgeFun):
+        with patch('main._paper_keys', side_effect=self.paper_keys) as MockKeys, \
+             patch.dict('os.environ', {'ENVIRONMENT': 'PRODUCTION'}):
+            purge_all_for_paper(self.batch_cloud_event)
+
+        MockKeys.assert_has_calls([call("1205.1234", None), call("1205.5678", "hep-lat")])
+        MockPurgeFun.assert_called_once_with(
+            ["abs-1205.1234", "paper-id-1205.1234", "list-2012-05-hep-th", "list-2012-hep-th",
+             "abs-1205.5678", "paper-id-1205.5678", "list-2012-hep-lat"], "arxiv.org", soft_purge=False)
+
+    @patch('main.purge_fastly_keys')
+    def test_bad_entries_reported(self, MockPurgeFun):
+        with patch('main._paper_keys', side_effect=self.paper_keys):
+            errors=_purge_papers(self.papers)
+        self.assertEqual(sorted(errors), ["entry 3", "not-an-id"])
+        MockPurgeFun.assert_called_once()
+
+    @patch('main.purge_fastly_keys')
+    def test_large_batch_split(self, MockPurgeFun):
+        papers=[{"paper_id": f"1205.{n:04d}"} for n in range(200)]
+        with patch('main._paper_keys', side_effect=self.paper_keys):
+            _purge_papers(papers)
+        sent=[key for args, _ in MockPurgeFun.call_args_list for key in args[0]]
+        self.assertEqual(len(sent), 2*200 + 2)
+        self.assertTrue(all(len(args[0]) <= 256 for args, _ in MockPurgeFun.call_args_list))
+
+    @patch('main.purge_fastly_keys')
+    def test_not_prod_environment(self, MockPurgeFun):
+        with patch.dict('os.environ', {'ENVIRONMENT': 'Nonsense'}):
+            purge_all_for_paper(self.batch_cloud_event)
+        MockPurgeFun.assert_not_called()
+
+class TestPaperKeys(unittest.TestCase):
+    """the key sets purge_cache_for_paper purges in arxiv-base, written out so a difference from base shows up here"""
+    index=TaxonomyIndex.build(["hep-th", "hep-lat", "cs.LG"])
+
+    def test_category_change(self):
+        from arxiv.identifier import Identifier
+        keys=paper_keys(self.index, Identifier("1205.1234"), "hep-th cs.LG", "hep-lat cs.LG")
+        self.assertEqual(len(keys), len(set(keys)))
+        self.assertEqual(set(keys), {
+            "paper-id-1205.1234", "abs-1205.1234",
+            "html-1205.1234-current", "pdf-1205.1234-current", "unavailable-1205.1234-current",
+            #lists the paper is on and was removed from
+            "list-2012-hep-th", "list-2012-05-hep-th", "list-2012-hep-lat", "list-2012-05-hep-lat",
+            "list-2012-cs.LG", "list-2012-05-cs.LG", "list-2012-cs", "list-2012-05-cs",
+            "list-2012-05-grp_physics",
+            #year counts of the archives it was added to and removed from, cs is in both
+            "year-hep-th-2012", "year-hep-lat-2012"})
+
+    def test_no_old_categories(self):
+        from arxiv.identifier import Identifier
+        keys=paper_keys(self.index, Identifier("1205.1234"), "cs.LG")
+        self.assertEqual(keys, [
+            "paper-id-1205.1234", "abs-1205.1234",
+            "html-1205.1234-current", "pdf-1205.1234-current", "unavailable-1205.1234-current",
+            "list-2012-05-cs", "list-2012-05-cs.LG", "list-2012-cs", "list-2012-cs.LG"])
+
+    def test_new_version(self):
+        from arxiv.identifier import Identifier
+        keys=paper_keys(self.index, Identifier("1205.1234v3"), "hep-th")
+        self.assertEqual(keys, [
+            "paper-id-1205.1234", "abs-1205.1234",
+            "html-1205.1234-current", "html-1205.1234v3", "pdf-1205.1234-current", "pdf-1205.1234v3",
+            "unavailable-1205.1234-current", "unavailable-1205.1234v3",
+            "list-2012-05-grp_physics", "list-2012-05-hep-th", "list-2012-hep-th"])
+
+    def test_unknown_category(self):
+        from arxiv.identifier import Identifier
+        with self.assertRaises(KeyError):
+            paper_keys(self.index, Identifier("1205.1234"), "hep-th", "bad.CAT")
+
+    @patch('main.purge_fastly_keys')
+    @patch('main._current_categories', return_value="hep-th cs.LG")
+    def test_purged_for_message(self, MockCategories, MockPurgeFun):
+        from arxiv.identifier import Identifier
+        event=CloudEvent({'type': 'test', 'source': 'test'},
+                         {"message": {"data": base64.b64encode(b'{"paper_id": "1205.1234", "old_categories": "hep-lat cs.LG"}')}})
+        with patch('main._taxonomy.get', return_value=self.index), patch.dict('os.environ', {'ENVIRONMENT': 'PRODUCTION'}):
+            purge_all_for_paper(event)
+        MockCategories.assert_called_once_with("1205.1234")
+        MockPurgeFun.assert_called_once()
+        self.assertEqual(MockPurgeFun.call_args[0][0], paper_keys(self.index, Identifier("1205.1234"), "hep-th cs.LG", "hep-lat cs.LG"))
+
+    @patch('main._current_categories', return_value="hep-th")
+    def test_real_purge_while_keys_collected(self, MockCategories):
+        """key collection used to swap arxiv-base's purge_fastly_keys, so a purge sent meanwhile was collected instead of sent"""
+        real_purges=[]
+        base=types.ModuleType("arxiv.integration.fastly.purge")
+        base.purge_fastly_keys=lambda keys, service_name="arxiv.org", soft_purge=False: real_purges.append(keys)
+        modules={"arxiv.integration": types.ModuleType("arxiv.integration"),
+                 "arxiv.integration.fastly": types.ModuleType("arxiv.integration.fastly"),
+                 "arxiv.integration.fastly.purge": base}
+        sent=[]
+        dispatcher=PurgeDispatcher(lambda keys, service, soft: sent.extend(keys), max_in_flight=1, attempts=1)
+        def slow_categories(paper_id):
+            time.sleep(0.001)
+            return "hep-th"
+        MockCategories.side_effect=slow_categories
+        done=threading.Event()
+        def purge_meanwhile():
+            import main
+            while not done.is_set():
+                main.purge_fastly_keys([f"announce-{len(real_purges)}"])
+
+        with patch.dict(sys.modules, modules), patch('main._get_dispatcher', return_value=dispatcher):
+            thread=threading.Thread(target=purge_meanwhile)
+            thread.start()
+            try:
+                _purge_papers([{"paper_id": f"1205.{n:04d}"} for n in range(50)])
+            finally:
+                done.set()
+                thread.join()
+            self.assertIs(sys.modules["arxiv.integration.fastly.purge"].purge_fastly_keys, base.purge_fastly_keys)
+
+        self.assertGreater(len(real_purges), 0)
+        self.assertEqual(real_purges, [[f"announce-{n}"] for n in range(len(real_purges))])
+        self.assertEqual(len(set(sent)), len(sent))
+        self.assertIn("abs-1205.0049", sent)
+        self.assertFalse([key for key in sent if key.startswith("announce")])
@@ -0,0 +1,30 @@
+"""measures how fast Classifier.classify_many gets through a synthetic bucket listing
+
+run from the purge_on_bucket_change folder
+` python benchmarks/bench_classify.py --keys 1000000 `
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("LOG_LOCALLY", "True")
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "tests") )
+from classifier import Classifier
+from test_classifier import synthetic_corpus
+
+def main() -> None:
+    parser=argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--keys", type=int, default=1000000)
+    args=parser.parse_args()
+
+    corpus=synthetic_corpus(args.keys)
+    classifier=Classifier("latexml_document_conversions")
+    start=time.perf_counter()
+    found=sum(1 for classification in classifier.classify_many(corpus, "arxiv-production-data") if classification.arxiv_id)
+    seconds=time.perf_counter()-start
+    print(f"{args.keys} keys in {seconds:.2f}s, {args.keys/seconds*60:,.0f} keys/minute, {found} with a paper id")
+
+if __name__ == "__main__":
+    main()
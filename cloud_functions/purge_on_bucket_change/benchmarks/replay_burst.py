@@ -0,0 +1,79 @@
+"""replays a burst of bucket change events, like a bulk pdf or html regeneration, and reports how many purge requests were sent
+
+run from the purge_on_bucket_change folder
+` python benchmarks/replay_burst.py --papers 200 --objects-per-paper 10 --window 0.5 `
+nothing is sent to fastly, purges are counted instead
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+from unittest.mock import patch
+
+os.environ.setdefault("LOG_LOCALLY", "True")
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from main import invalidate_for_gs_change, BatchingInvalidator, Invalidator
+from pull_consumer import InMemorySource, drain
+
+def burst(papers: int, objects_per_paper: int) -> List[Tuple[str, str]]:
+    """(bucket, name) for the pdf and html assets of each paper, interleaved the way a regeneration writes them"""
+    events=[]
+    for n in range(objects_per_paper):
+        for p in range(papers):
+            paper_id=f"2409.{p:05d}v1"
+            if n == 0:
+                events.append(("arxiv-production-data", f"ps_cache/arxiv/pdf/2409/{paper_id}.pdf"))
+            else:
+                events.append(("arxiv-production-data", f"ps_cache/arxiv/html/2409/{paper_id}/x{n}.png"))
+    return events
+
+class _Counter:
+    def __init__(self) -> None:
+        self.sent: List[int]=[]
+        self.lock=threading.Lock()
+
+    def __call__(self, keys, *args, **kwargs) -> None:
+        with self.lock:
+            self.sent.append(len(keys))
+
+def replay(events: List[Tuple[str, str]], invalidator: Invalidator, concurrency: int) -> Tuple[int, int, float]:
+    """events pushed to the function one at a time, returns purge requests sent, keys sent and seconds taken"""
+    counter=_Counter()
+    start=time.perf_counter()
+    with patch("main.purge_fastly_keys", counter), ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(lambda event: invalidate_for_gs_change(event[0], event[1], invalidator), events))
+    return len(counter.sent), sum(counter.sent), time.perf_counter() - start
+
+def replay_pulled(events: List[Tuple[str, str]], batch_size: int) -> Tuple[int, int, float]:
+    """events pulled from an in memory subscription batch_size at a time"""
+    counter=_Counter()
+    source=InMemorySource([{"bucket": bucket, "name": name} for bucket, name in events])
+    start=time.perf_counter()
+    with patch("main.purge_fastly_keys", counter):
+        drain(source, invalidate_for_gs_change, Invalidator(), batch_size, max_batches=len(events))
+    return len(counter.sent), sum(counter.sent), time.perf_counter() - start
+
+def main() -> None:
+    parser=argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--papers", type=int, default=200)
+    parser.add_argument("--objects-per-paper", type=int, default=10)
+    parser.add_argument("--window", type=float, default=0.5, help="PURGE_BATCH_WINDOW to test")
+    parser.add_argument("--max-keys", type=int, default=256, help="PURGE_BATCH_MAX_KEYS to test")
+    parser.add_argument("--concurrency", type=int, default=80, help="events handled at once by an instance")
+    parser.add_argument("--pull-batch", type=int, default=1000, help="PULL_BATCH_SIZE to test")
+    args=parser.parse_args()
+
+    events=burst(args.papers, args.objects_per_paper)
+    print(f"events: {len(events)}")
+    for name, invalidator in (("one purge per event", Invalidator()),
+                              (f"batched, window {args.window}s max {args.max_keys} keys", BatchingInvalidator(window=args.window, max_keys=args.max_keys))):
+        requests, keys, seconds=replay(events, invalidator, args.concurrency)
+        print(f"{name}: {requests} purge requests, {keys} keys, {seconds:.2f}s")
+    requests, keys, seconds=replay_pulled(events, args.pull_batch)
+    print(f"pulled {args.pull_batch} at a time: {requests} purge requests, {keys} keys, {seconds:.2f}s, {len(events)/seconds:.0f} events/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""purges everything for a bucket listing, ex after a conversion pipeline reran for a prefix
+
+` gsutil ls -r gs://arxiv-production-data/ps_cache/cs/pdf/0005/ | python backfill.py - --checkpoint cs-pdf-0005.json `
+` python backfill.py listing.txt --bucket arxiv-production-data --checkpoint listing.json `
+
+listing lines are gs://bucket/name urls, or object names when --bucket is given. keys are deduplicated across the run
+and purged in concurrent batches by the purge dispatcher, which tries each batch up to PURGE_MAX_ATTEMPTS times, as the function does.
+the checkpoint records how many listing lines have been fully purged, rerunning with the same listing and checkpoint skips those lines.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from itertools import groupby, islice
+from operator import itemgetter
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+from arxiv.identifier import IdentifierException
+
+from classifier import classifier_for
+from metrics import current, invocation
+from purge_dispatch import PurgeDispatcher, dispatcher_from_env
+from retry_policy import RetryPolicy
+from startup import setup_logging
+
+
+def parse_listing(lines: Iterable[str], bucket: Optional[str]=None) -> Iterator[Tuple[str, str]]:
+    """(bucket, name) for each object line, one per input line so line counts stay aligned with the checkpoint
+    directory headers and blank lines from gsutil ls give ("", "")
+    """
+    for line in lines:
+        line=line.strip()
+        if not line or line.endswith(":") or line.endswith("/"):
+            yield "", ""
+        elif line.startswith("gs://"):
+            object_bucket, _, name=line[len("gs://"):].partition("/")
+            yield object_bucket, name
+        elif bucket:
+            yield bucket, line
+        else:
+            raise ValueError(f"listing line is not a gs:// url and no --bucket given: {line}")
+
+
+def read_checkpoint(path: Optional[str]) -> int:
+    """listing lines already purged"""
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f)["lines_done"]
+
+
+def write_checkpoint(path: Optional[str], lines_done: int, keys_purged: int) -> None:
+    if not path:
+        return
+    tmp=f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"lines_done": lines_done, "keys_purged": keys_purged}, f)
+    os.replace(tmp, path)
+
+
+def run_backfill(objects: Iterable[Tuple[str, str]], dispatcher: PurgeDispatcher, checkpoint: Optional[str]=None,
+                 chunk_lines: int=10000, service_name: str="arxiv.org", soft_purge: bool=False) -> int:
+    """classifies objects and purges their keys with dispatcher, returns the number of keys purged this run
+    objects are read chunk_lines at a time, the checkpoint is written once every key of a chunk has been purged.
+    lines with a paper id arxiv-base rejects are logged, counted as lines_skipped in the metrics and passed over
+    """
+    metrics=current()
+    latexml_bucket=os.environ.get('LATEXML_BUCKET', "latexml_document_conversions")
+    classifier=classifier_for(latexml_bucket)
+    lines_done=read_checkpoint(checkpoint)
+    if lines_done:
+        logging.info(f"Resuming after {lines_done} listing lines")
+    it=islice(iter(objects), lines_done, None)
+    seen: Set[str]=set()
+    purged=0
+    while chunk := list(islice(it, chunk_lines)):
+        keys: List[str]=[]
+        for bucket, lines in groupby(chunk, key=itemgetter(0)):
+            if not bucket:
+                continue
+            names=[name for _, name in lines]
+            for name, found in zip(names, classifier.classify_many(names, bucket)):
+                try:
+                    purge_keys=found.purge_keys()
+                except IdentifierException as ex:
+                    logging.warning(f"Skipping gs://{bucket}/{name}: {ex}")
+                    metrics.count("lines_skipped")
+                    continue
+                for key in purge_keys or ():
+                    if key not in seen:
+                        seen.add(key)
+                        keys.append(key)
+        if keys:
+            with metrics.stage("purge"):
+                dispatcher.purge(keys, service_name, soft_purge)
+        purged+=len(keys)
+        lines_done+=len(chunk)
+        metrics.count("keys_purged", len(keys))
+        write_checkpoint(checkpoint, lines_done, purged)
+        logging.info(f"{lines_done} listing lines done, {purged} keys purged, {metrics.counts['lines_skipped']} lines skipped")
+    return purged
+
+
+def _dry_run(keys: List[str], service_name: str, soft_purge: bool) -> None:
+    logging.info(f"DRY_RUN: Would have purged keys: {keys} service: {service_name} soft purge: {soft_purge}")
+
+
+def main(argv: Optional[List[str]]=None) -> None:
+    parser=argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("listing", help="file with one object per line, - for stdin")
+    parser.add_argument("--bucket", help="bucket for listing lines that are plain object names")
+    parser.add_argument("--checkpoint", help="progress file, lets an interrupted run resume")
+    parser.add_argument("--chunk-lines", type=int, default=10000)
+    parser.add_argument("--max-in-flight", type=int, help="overrides PURGE_MAX_IN_FLIGHT")
+    args=parser.parse_args(argv)
+
+    os.environ.setdefault("LOG_LOCALLY", "True")
+    if args.max_in_flight:
+        os.environ["PURGE_MAX_IN_FLIGHT"]=str(args.max_in_flight)
+    setup_logging()
+    from main import _send_through_base
+    #the dispatcher is the only batching and retrying layer, with the function's PURGE_MAX_ATTEMPTS tries per batch
+    #a dry run overrides FASTLY_SERVICE_IDS so nothing reaches fastly
+    dry_run=os.environ.get("DRY_RUN", "0") == "1"
+    dispatcher=dispatcher_from_env(_send_through_base, attempts=RetryPolicy.from_env().max_attempts,
+                                   transport=_dry_run if dry_run else None)
+    listing=sys.stdin if args.listing == "-" else open(args.listing)
+    with listing, invocation("purge_on_bucket_change.backfill") as metrics:
+        purged=run_backfill(parse_listing(listing, args.bucket), dispatcher, args.checkpoint, args.chunk_lines,
+                            soft_purge=os.environ.get('ALWAYS_SOFT_PURGE', "0") == "1")
+    print(f"purged {purged} keys, skipped {metrics.counts['lines_skipped']} lines with invalid paper ids")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""decides what, if anything, to purge for a changed bucket object"""
+import re
+from functools import lru_cache
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from arxiv.identifier import Identifier, STANDARD as MODERN_ID, _archive, _category
+
+PS_CACHE_OLD_ID = re.compile(r'(%s)\/[^\/]*\/\d*\/(\d{2}[01]\d{4}(v\d*)?)' % f'{_archive}|{_category}')
+"EX /ps_cache/hep-ph/pdf/0511/0511005v2.pdf"
+
+FILES_TO_IGNORE=['outcome.tar.gz','LaTeXML.cache','__stdout.txt']
+IGNORED_FILES=frozenset(FILES_TO_IGNORE)
+#every part of an object name its kind depends on, found in one scan: the ignored files, /pdf/ and /html/ folders and a .pdf ending.
+#the folders' closing slash is a lookahead so /html/pdf/ finds both
+OBJECT_PARTS=re.compile(r"/(?:pdf|html)(?=/)|\.pdf\Z|" + "|".join(re.escape(name) for name in FILES_TO_IGNORE))
+
+IGNORE="ignore"
+NONE="none" #not an html or pdf object
+PDF="pdf"
+HTML="html"
+
+
+class Classification(NamedTuple):
+    kind: str
+    arxiv_id: Optional[str]=None #only found for pdf and html objects
+
+    def purge_keys(self) -> Optional[List[str]]:
+        """keys to purge for the object, None if there is nothing to purge"""
+        if self.arxiv_id is None:
+            return None
+        paper_id=_identifier(self.arxiv_id)
+        return [f'{self.kind}-{paper_id.id}-current', f'{self.kind}-{paper_id.idv}', f'unavailable-{paper_id.id}-current', f'unavailable-{paper_id.idv}'] #always purge current just to be sure
+
+
+def arxiv_id_in(name: str) -> Optional[str]:
+    """the paper id in an object name, modern ids anywhere in the name win over old style ps_cache paths"""
+    if not name:
+        return None
+    if match := MODERN_ID.search(name):
+        return match.group("arxiv_id")
+    if match := PS_CACHE_OLD_ID.search(name):
+        return match.group(1) + "/" + match.group(2)
+    return None
+
+
+@lru_cache(maxsize=1024)
+def _identifier(arxiv_id: str) -> Identifier:
+    """a paper's many objects usually change together, so the same ids get parsed repeatedly"""
+    return Identifier(arxiv_id)
+
+
+class Classifier:
+    """classifies objects as ignore, none, pdf or html and finds their paper id in one call per object"""
+    def __init__(self, latexml_bucket: str) -> None:
+        self.latexml_bucket=latexml_bucket
+
+    def classify(self, bucket: str, key: str) -> Classification:
+        return self._classify(key, bucket == self.latexml_bucket)
+
+    def classify_many(self, keys: Iterable[str], bucket: str) -> Iterator[Classification]:
+        """classifies every key of a bucket listing, in order, without building Identifiers"""
+        in_latexml= bucket == self.latexml_bucket
+        classify=self._classify
+        return (classify(key, in_latexml) for key in keys)
+
+    @staticmethod
+    def _classify(key: str, in_latexml: bool) -> Classification:
+        """one OBJECT_PARTS scan, then one id search for pdf and html objects"""
+        parts=set(OBJECT_PARTS.findall(key))
+        if not IGNORED_FILES.isdisjoint(parts):
+            return Classification(IGNORE)
+        is_pdf=".pdf" in parts
+        if in_latexml:
+            kind=HTML
+        elif is_pdf and "/pdf" in parts:
+            kind=PDF
+        elif "/html" in parts: #native html files
+            kind=HTML
+        elif is_pdf: #processed pdfs, as well as source pdfs
+            kind=PDF
+        else:
+            return Classification(NONE)
+        return Classification(kind, arxiv_id_in(key))
+
+
+@lru_cache(maxsize=8)
+def classifier_for(latexml_bucket: str) -> Classifier:
+    return Classifier(latexml_bucket)
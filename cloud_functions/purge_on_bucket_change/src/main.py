@@ -1,77 +1,148 @@
-import re
+import logging
 from typing import Optional, List
 import os
 
 import functions_framework
 from cloudevents.http import CloudEvent
-from google.api_core import retry
 
-from arxiv.identifier import Identifier, STANDARD as MODERN_ID, _archive, _category
-from arxiv.integration.fastly.purge import purge_fastly_keys
+from arxiv.identifier import Identifier
 
-#logging configuration
-if not(os.environ.get('LOG_LOCALLY')):
-    import google.cloud.logging
-    client = google.cloud.logging.Client()
-    client.setup_logging()
-import logging 
-log_level_str = os.getenv('LOG_LEVEL', 'INFO')
-log_level = getattr(logging, log_level_str.upper(), logging.INFO)
-logging.basicConfig(level=log_level)
+from classifier import arxiv_id_in, classifier_for, _identifier, IGNORE, NONE
+from metrics import current, instrumented
+from purge_batcher import PurgeBatcher
+from pull_consumer import PubSubSource, drain
+from purge_dispatch import dispatcher_from_env
+from recent_purges import RecentPurges
+from retry_policy import CircuitBreaker, PurgeFailed, RetryPolicy, RetryingPurger
+from startup import Lazy, setup_logging
 
-PS_CACHE_OLD_ID = re.compile(r'(%s)\/[^\/]*\/\d*\/(\d{2}[01]\d{4}(v\d*)?)' % f'{_archive}|{_category}')
-"EX /ps_cache/hep-ph/pdf/0511/0511005v2.pdf"
-
-FILES_TO_IGNORE=['outcome.tar.gz','LaTeXML.cache','__stdout.txt']
+def purge_fastly_keys(*args, **kwargs) -> None:
+    """arxiv.integration.fastly.purge.purge_fastly_keys, imported on first use since it pulls in arxiv.db"""
+    from arxiv.integration.fastly.purge import purge_fastly_keys as purge
+    purge(*args, **kwargs)
 
 def _paperid(name: str) -> Optional[Identifier]:
-    if not name:
-        return None
-    if match := MODERN_ID.search(name):
-        return Identifier(match.group("arxiv_id"))
-    if match := PS_CACHE_OLD_ID.search(name):
-        return Identifier(match.group(1) + "/" + match.group(2))
-    else:
-        return None
+    arxiv_id=arxiv_id_in(name)
+    return _identifier(arxiv_id) if arxiv_id else None
+
+def _send_purge(keys: List[str], soft_purge: bool) -> None:
+    purge_fastly_keys(keys, soft_purge=soft_purge)
 
 class Invalidator:
-    def __init__(self, always_soft_purge: bool=False, dry_run: bool=False) -> None:
+    def __init__(self, always_soft_purge: bool=False, dry_run: bool=False, recent: Optional[RecentPurges]=None,
+                 purger: Optional[RetryingPurger]=None) -> None:
+        """recent, when given, is used to skip keys that were already purged within its window
+        purger sends the keys, retrying failed batches with its retry policy
+        """
         self.always_soft_purge = always_soft_purge
         self.dry_run = dry_run
+        self.recent = recent
+        self.purger = purger or RetryingPurger(_send_purge)
 
-    @retry.Retry()
     def invalidate(self, keys: List[str], soft_purge: bool=False) -> None:
+        metrics=current()
+        metrics.count("keys_requested", len(keys))
+        if self.recent is not None:
+            requested=len(keys)
+            keys=self.recent.fresh(keys)
+            metrics.count("keys_suppressed_recent", requested-len(keys))
+            if len(keys) < requested:
+                logging.info(f"Skipping {requested-len(keys)} of {requested} keys purged in the last {self.recent.window}s, suppression rate: {self.recent.suppression_rate:.1%}")
+            if not keys:
+                return
+
         if self.dry_run:
             logging.info(f"DRY_RUN: Would have purged keys: {keys} soft purge: {soft_purge}")
-            return
+        else:
+            try:
+                with metrics.stage("purge"):
+                    metrics.count("purge_requests", self.purger.purge(keys, soft_purge=(self.always_soft_purge or soft_purge)))
+                metrics.count("keys_purged", len(keys))
+            except PurgeFailed as ex:
+                metrics.count("keys_failed", len(ex.keys))
+                if self.recent is not None:
+                    failed=set(ex.keys)
+                    self.recent.add(key for key in keys if key not in failed)
+                raise
+
+        if self.recent is not None:
+            self.recent.add(keys)
 
-        purge_fastly_keys(keys, soft_purge=(self.always_soft_purge or soft_purge))
+
+class BatchingInvalidator(Invalidator):
+    """invalidator that merges the keys of events arriving within window seconds of each other into one purge
+    only useful when the function handles several events at once, see README
+    """
+    def __init__(self, always_soft_purge: bool=False, dry_run: bool=False, window: float=0.5, max_keys: int=256,
+                 recent: Optional[RecentPurges]=None, purger: Optional[RetryingPurger]=None) -> None:
+        super().__init__(always_soft_purge, dry_run, recent, purger)
+        self.batcher=PurgeBatcher(lambda keys: Invalidator.invalidate(self, keys), window, max_keys)
+
+    def invalidate(self, keys: List[str], soft_purge: bool=False) -> None:
+        if soft_purge and not self.always_soft_purge:
+            return super().invalidate(keys, soft_purge)
+        self.batcher.submit(keys)
+
+
+_batching_invalidator: Optional[BatchingInvalidator]=None
+_recent_purges: Optional[RecentPurges]=None
+
+def _recent() -> Optional[RecentPurges]:
+    """recently purged keys, shared across warm invocations, when PURGE_DEDUP_WINDOW is set"""
+    global _recent_purges
+    window=float(os.environ.get("PURGE_DEDUP_WINDOW", "0"))
+    if window <= 0:
+        return None
+    if _recent_purges is None or _recent_purges.window != window:
+        _recent_purges=RecentPurges(window, int(os.environ.get("PURGE_DEDUP_MAX_KEYS", "10000")))
+    return _recent_purges
+
+def _send_through_base(keys: List[str], service_name: str, soft_purge: bool) -> None:
+    purge_fastly_keys(keys, service_name, soft_purge=soft_purge)
+
+def _build_purger() -> RetryingPurger:
+    """purges go through the shared purge client, for its pooled connections and PURGE_RATE_LIMIT, retried by the policy here"""
+    dispatcher=dispatcher_from_env(_send_through_base, attempts=1)
+    return RetryingPurger(lambda keys, soft_purge: dispatcher.send(keys, "arxiv.org", soft_purge), RetryPolicy.from_env(), CircuitBreaker.from_env())
+
+#shared across warm invocations so the circuit breaker sees every purge of the instance
+_retrying_purger: Lazy[RetryingPurger]=Lazy(_build_purger)
+
+def _purger() -> RetryingPurger:
+    return _retrying_purger.get()
+
+def _invalidator() -> Invalidator:
+    """the invalidator for an event, a batching one shared by all events when PURGE_BATCH_WINDOW is set"""
+    global _batching_invalidator
+    always_soft_purge=os.environ.get('ALWAYS_SOFT_PURGE', "0") == "1"
+    dry_run=os.environ.get("DRY_RUN", "0") == "1"
+    window=float(os.environ.get("PURGE_BATCH_WINDOW", "0"))
+    if window <= 0:
+        return Invalidator(always_soft_purge, dry_run, _recent(), _purger())
+    if _batching_invalidator is None:
+        _batching_invalidator=BatchingInvalidator(always_soft_purge, dry_run, window,
+                                                  int(os.environ.get("PURGE_BATCH_MAX_KEYS", "256")), _recent(), _purger())
+    return _batching_invalidator
 
 
 def invalidate_for_gs_change(bucket: str, key: str, invalidator: Invalidator) -> None:
-    if any(ignored in key for ignored in FILES_TO_IGNORE):
+    metrics=current()
+    classifier=classifier_for(os.environ.get('LATEXML_BUCKET', "latexml_document_conversions"))
+    with metrics.stage("classify"):
+        found=classifier.classify(bucket, key)
+    metrics.count(f"{found.kind}_objects")
+    if found.kind == IGNORE:
         logging.debug(f"No purge for ignored file type: gs://{bucket}/{key}")
         return
-    
-    latexml_bucket=os.environ.get('LATEXML_BUCKET', "latexml_document_conversions")
-    if bucket==latexml_bucket:
-        path="html"
-    elif "/pdf/" in key and key.endswith('.pdf'):
-        path="pdf"
-    elif '/html/' in key: #native html files
-        path="html"
-    elif key.endswith('.pdf'): #processed pdfs, as well as source pdfs 
-        path="pdf"
-    else:
+    if found.kind == NONE:
         logging.debug(f"No purge: gs://{bucket}/{key} not an html or pdf path")
         return
     
-    paper_id = _paperid(key)
-    if not paper_id:
+    purge_keys = found.purge_keys()
+    if not purge_keys:
         logging.debug(f"No purge: gs://{bucket}/{key} not related to an arxiv paper id")
         return
      
-    purge_keys=[f'{path}-{paper_id.id}-current', f'{path}-{paper_id.idv}', f'unavailable-{paper_id.id}-current', f'unavailable-{paper_id.idv}'] #always purge current just to be sure
     logging.info(f"attempting purge keys: {purge_keys} for location: {key} in bucket: {bucket}")
    
     try:
@@ -82,7 +153,9 @@ def invalidate_for_gs_change(bucket: str, key: str, invalidator: Invalidator) ->
 
 
 @functions_framework.cloud_event
+@instrumented("purge_on_bucket_change")
 def main(cloud_event: CloudEvent) -> None:
+    setup_logging()
     try:
         data = cloud_event.get_data()
         bucket=data.get("bucket")
@@ -91,10 +164,33 @@ def main(cloud_event: CloudEvent) -> None:
             logging.error(f"bad message data format. bucket: {bucket}, name: {name}, message data: {data}")
             return #dont retry
 
-        invalidate_for_gs_change(bucket,
-                                 name,
-                                 Invalidator(os.environ.get('ALWAYS_SOFT_PURGE', "0") == "1",
-                                             os.environ.get("DRY_RUN", "0") == "1"))
+        invalidate_for_gs_change(bucket, name, _invalidator())
     except Exception as ex:
         logging.error(cloud_event)
         raise ex
+
+
+_pull_source: Optional[PubSubSource]=None
+
+@functions_framework.http
+@instrumented("purge_on_bucket_change.pull")
+def pull_main(request):
+    """ second entry point, pulls bucket notifications from PURGE_SUBSCRIPTION PULL_BATCH_SIZE at a time,
+    purges the combined keys of each batch and acks it once the purge succeeded. meant to be called on a schedule.
+    functions-framework --target=pull_main
+    """
+    setup_logging()
+    global _pull_source
+    subscription=os.environ.get("PURGE_SUBSCRIPTION")
+    if not subscription:
+        logging.error("pull_main called without PURGE_SUBSCRIPTION set")
+        return "PURGE_SUBSCRIPTION not set", 500
+    if _pull_source is None or _pull_source.subscription != subscription:
+        _pull_source=PubSubSource(subscription)
+
+    invalidator=Invalidator(os.environ.get('ALWAYS_SOFT_PURGE', "0") == "1", os.environ.get("DRY_RUN", "0") == "1", _recent(), _purger())
+    handled=drain(_pull_source, invalidate_for_gs_change, invalidator,
+                  int(os.environ.get("PULL_BATCH_SIZE", "1000")),
+                  int(os.environ.get("PULL_MAX_BATCHES", "100")))
+    current().count("messages", handled)
+    return f"handled {handled} messages"
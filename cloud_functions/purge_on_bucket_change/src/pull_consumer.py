@@ -0,0 +1,126 @@
+"""pulls bucket change notifications from a pub/sub subscription in batches and purges their keys together"""
+import json
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Protocol
+
+
+class PulledMessage(NamedTuple):
+    ack_id: str
+    data: Dict[str, Any]
+    attributes: Dict[str, str]
+
+
+class MessageSource(Protocol):
+    def pull(self, max_messages: int) -> List[PulledMessage]: ...
+    def ack(self, ack_ids: List[str]) -> None: ...
+    def nack(self, ack_ids: List[str]) -> None: ...
+
+
+class PubSubSource:
+    """synchronous pull from a subscription, uses the emulator when PUBSUB_EMULATOR_HOST is set"""
+    ACK_CHUNK=1000 #stay under the request size limit for acks
+
+    def __init__(self, subscription: str, timeout: float=30) -> None:
+        from google.cloud import pubsub_v1
+        self.client=pubsub_v1.SubscriberClient()
+        self.subscription=subscription
+        self.timeout=timeout
+
+    def pull(self, max_messages: int) -> List[PulledMessage]:
+        response=self.client.pull(request={"subscription": self.subscription, "max_messages": max_messages}, timeout=self.timeout)
+        return [PulledMessage(received.ack_id, json.loads(received.message.data or b"{}"), dict(received.message.attributes))
+                for received in response.received_messages]
+
+    def ack(self, ack_ids: List[str]) -> None:
+        for i in range(0, len(ack_ids), self.ACK_CHUNK):
+            self.client.acknowledge(request={"subscription": self.subscription, "ack_ids": ack_ids[i:i+self.ACK_CHUNK]})
+
+    def nack(self, ack_ids: List[str]) -> None:
+        for i in range(0, len(ack_ids), self.ACK_CHUNK):
+            self.client.modify_ack_deadline(request={"subscription": self.subscription, "ack_ids": ack_ids[i:i+self.ACK_CHUNK], "ack_deadline_seconds": 0})
+
+
+class InMemorySource:
+    """queue stand in for a subscription, for tests and offline throughput runs"""
+    def __init__(self, messages: List[Dict[str, Any]]) -> None:
+        self.queue: Deque[PulledMessage]=deque(PulledMessage(str(n), data, {}) for n, data in enumerate(messages))
+        self.outstanding: Dict[str, PulledMessage]={}
+        self.acked: List[str]=[]
+        self.pulls=0
+
+    def pull(self, max_messages: int) -> List[PulledMessage]:
+        self.pulls+=1
+        messages=[self.queue.popleft() for _ in range(min(max_messages, len(self.queue)))]
+        self.outstanding.update((message.ack_id, message) for message in messages)
+        return messages
+
+    def ack(self, ack_ids: List[str]) -> None:
+        for ack_id in ack_ids:
+            del self.outstanding[ack_id]
+        self.acked.extend(ack_ids)
+
+    def nack(self, ack_ids: List[str]) -> None:
+        self.queue.extend(self.outstanding.pop(ack_id) for ack_id in ack_ids)
+
+
+class _KeyCollector:
+    """stands in for an Invalidator while a batch is read, gathering keys instead of purging them"""
+    def __init__(self) -> None:
+        self.keys: Dict[str, None]={} #insertion ordered set
+
+    def invalidate(self, keys: List[str], soft_purge: bool=False) -> None:
+        self.keys.update(dict.fromkeys(keys))
+
+
+def consume_batch(source: MessageSource, handle: Callable[[str, str, Any], None], invalidator: Any, max_messages: int) -> int:
+    """pulls up to max_messages, runs each through handle (invalidate_for_gs_change) and purges the combined keys once
+    messages are acked together only after the purge succeeded, and released for redelivery if it failed
+    a message handle raises on is released on its own and the rest of the batch goes on, give the subscription a dead letter topic
+    so one that always fails stops coming back
+    returns the number of messages pulled
+    """
+    messages=source.pull(max_messages)
+    if not messages:
+        return 0
+    collector=_KeyCollector()
+    failed: List[str]=[]
+    for message in messages:
+        event_type=message.attributes.get("eventType", "OBJECT_FINALIZE")
+        bucket=message.data.get("bucket")
+        name=message.data.get("name")
+        if event_type != "OBJECT_FINALIZE":
+            continue
+        if bucket is None or name is None:
+            logging.error(f"bad message data format. bucket: {bucket}, name: {name}, message data: {message.data}")
+            continue #acked below so it isn't retried
+        try:
+            handle(bucket, name, collector)
+        except Exception as ex:
+            logging.error(f"Could not handle {bucket}/{name}, releasing the message for redelivery: {ex}")
+            failed.append(message.ack_id)
+
+    if failed:
+        source.nack(failed)
+    ack_ids=[message.ack_id for message in messages if message.ack_id not in failed]
+    if collector.keys:
+        try:
+            invalidator.invalidate(list(collector.keys))
+        except Exception as ex:
+            logging.error(f"Purge failed for batch of {len(messages)} messages, releasing them for redelivery: {ex}")
+            source.nack(ack_ids)
+            raise
+    source.ack(ack_ids)
+    logging.info(f"Purged {len(collector.keys)} keys for {len(ack_ids)} messages, {len(failed)} released")
+    return len(messages)
+
+
+def drain(source: MessageSource, handle: Callable[[str, str, Any], None], invalidator: Any, max_messages: int=1000, max_batches: int=100) -> int:
+    """consumes batches until a pull comes back empty or max_batches have been handled, returns messages handled"""
+    total=0
+    for _ in range(max_batches):
+        pulled=consume_batch(source, handle, invalidator, max_messages)
+        if not pulled:
+            break
+        total+=pulled
+    return total
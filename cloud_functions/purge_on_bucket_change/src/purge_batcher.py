@@ -0,0 +1,73 @@
+"""combines the purge keys of events arriving close together into one purge request"""
+import threading
+import logging
+from typing import Callable, Dict, List, Optional
+
+
+class _Batch:
+    def __init__(self) -> None:
+        self.keys: Dict[str, None]={} #insertion ordered set
+        self.full=threading.Event()
+        self.done=threading.Event()
+        self.error: Optional[BaseException]=None
+
+
+class PurgeBatcher:
+    """collects keys submitted by concurrent events and purges them together once window seconds have passed
+    since the first submission, or sooner when max_keys unique keys have been collected.
+    submit blocks until the batch holding the callers keys has been purged and raises if that purge failed,
+    so each event still only succeeds once its keys are purged
+    """
+    def __init__(self, purge: Callable[[List[str]], None], window: float=0.5, max_keys: int=256) -> None:
+        self.purge=purge
+        self.window=window
+        self.max_keys=max_keys
+        self._lock=threading.Lock()
+        self._current: Optional[_Batch]=None
+        self.keys_submitted=0
+        self.keys_sent=0
+        self.requests=0
+
+    def submit(self, keys: List[str]) -> None:
+        with self._lock:
+            batch=self._current
+            if batch is not None and batch.keys and len(batch.keys) + len(set(keys).difference(batch.keys)) > self.max_keys:
+                self._close(batch)
+                batch=None
+            leader= batch is None
+            if leader:
+                batch=self._current=_Batch()
+            batch.keys.update(dict.fromkeys(keys))
+            self.keys_submitted+=len(keys)
+            if len(batch.keys) >= self.max_keys:
+                self._close(batch)
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._current is batch:
+                    self._current=None
+            self._flush(batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+
+    def _close(self, batch: _Batch) -> None:
+        """stops batch taking more keys and wakes its leader, caller holds the lock"""
+        if self._current is batch:
+            self._current=None
+        batch.full.set()
+
+    def _flush(self, batch: _Batch) -> None:
+        keys=list(batch.keys)
+        try:
+            self.purge(keys)
+        except BaseException as ex:
+            batch.error=ex
+        finally:
+            with self._lock:
+                self.requests+=1
+                self.keys_sent+=len(keys)
+            batch.done.set()
+        logging.debug(f"Batched purge of {len(keys)} keys, totals: {self.keys_submitted} keys submitted {self.keys_sent} sent in {self.requests} requests")
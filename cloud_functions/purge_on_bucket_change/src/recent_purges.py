@@ -0,0 +1,51 @@
+"""remembers recently purged keys so repeat purges within a short window can be skipped"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, List
+
+
+class RecentPurges:
+    """keys purged in the last window seconds, holding at most max_keys (oldest dropped first)"""
+    def __init__(self, window: float, max_keys: int=10000, clock: Callable[[], float]=time.monotonic) -> None:
+        self.window=window
+        self.max_keys=max_keys
+        self.clock=clock
+        self._purged: "OrderedDict[str, float]"=OrderedDict() #key -> time purged, oldest first
+        self._lock=threading.Lock()
+        self.requested=0
+        self.suppressed=0
+
+    def fresh(self, keys: Iterable[str]) -> List[str]:
+        """the keys that have not been purged within the window, counting the rest as suppressed"""
+        keys=list(keys)
+        with self._lock:
+            self._expire(self.clock())
+            fresh=[key for key in keys if key not in self._purged]
+            self.requested+=len(keys)
+            self.suppressed+=len(keys) - len(fresh)
+        return fresh
+
+    def add(self, keys: Iterable[str]) -> None:
+        """records keys as purged now"""
+        with self._lock:
+            now=self.clock()
+            for key in keys:
+                self._purged[key]=now
+                self._purged.move_to_end(key)
+            while len(self._purged) > self.max_keys:
+                self._purged.popitem(last=False)
+
+    @property
+    def suppression_rate(self) -> float:
+        return self.suppressed / self.requested if self.requested else 0.0
+
+    def __len__(self) -> int:
+        return len(self._purged)
+
+    def _expire(self, now: float) -> None:
+        while self._purged:
+            key, purged_at=next(iter(self._purged.items()))
+            if now - purged_at < self.window:
+                break
+            self._purged.popitem(last=False)
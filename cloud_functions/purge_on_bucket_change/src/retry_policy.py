@@ -0,0 +1,127 @@
+"""bounded, jittered retrying of purges that only resends the keys that failed, with a circuit breaker for fastly outages"""
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from purge_dispatch import FASTLY_MAX_KEYS_PER_PURGE, batched, retry_after
+
+
+class PurgeFailed(Exception):
+    """keys that could not be purged within the retry policy"""
+    def __init__(self, keys: List[str], reason: str):
+        self.keys=keys
+        super().__init__(f"{len(keys)} keys not purged: {reason}")
+
+
+class CircuitOpenError(PurgeFailed):
+    """fastly has been failing, purges are not being sent for a while"""
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int=4
+    deadline: float=30 #seconds from the first attempt after which no retry is started
+    initial_backoff: float=0.5
+    max_backoff: float=8
+    multiplier: float=2
+
+    def backoff(self, retry: int, rand: Callable[[], float]=random.random) -> float:
+        """full jitter backoff before the given retry, 1 for the first"""
+        return rand() * min(self.max_backoff, self.initial_backoff * self.multiplier ** (retry - 1))
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        return cls(max_attempts=int(os.environ.get("PURGE_MAX_ATTEMPTS", cls.max_attempts)),
+                   deadline=float(os.environ.get("PURGE_RETRY_DEADLINE", cls.deadline)))
+
+
+class CircuitBreaker:
+    """opens after failure_threshold failures in a row and rejects sends until reset_after seconds have passed,
+    then lets sends through again, opening straight away if the next one fails
+    """
+    def __init__(self, failure_threshold: int=5, reset_after: float=30, clock: Callable[[], float]=time.monotonic) -> None:
+        self.failure_threshold=failure_threshold
+        self.reset_after=reset_after
+        self.clock=clock
+        self.failures=0
+        self.opened_at: Optional[float]=None
+        self._lock=threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            return self.opened_at is None or self.clock() - self.opened_at >= self.reset_after
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures=0
+            self.opened_at=None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures+=1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logging.error(f"Purges failed {self.failures} times in a row, not sending purges for {self.reset_after}s")
+                self.opened_at=self.clock()
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreaker":
+        return cls(int(os.environ.get("PURGE_BREAKER_FAILURES", "5")), float(os.environ.get("PURGE_BREAKER_RESET", "30")))
+
+
+class RetryingPurger:
+    """sends keys in batches with send(batch, soft_purge), retrying only the batches that failed"""
+    def __init__(self, send: Callable[[List[str], bool], None], policy: Optional[RetryPolicy]=None,
+                 breaker: Optional[CircuitBreaker]=None, batch_size: int=FASTLY_MAX_KEYS_PER_PURGE,
+                 sleep: Callable[[float], None]=time.sleep, clock: Callable[[], float]=time.monotonic,
+                 rand: Callable[[], float]=random.random) -> None:
+        self.send=send
+        self.policy=policy or RetryPolicy()
+        self.breaker=breaker or CircuitBreaker()
+        self.batch_size=batch_size
+        self.sleep=sleep
+        self.clock=clock
+        self.rand=rand
+
+    def purge(self, keys: List[str], soft_purge: bool=False) -> int:
+        """returns the number of purge requests it took,
+        raises PurgeFailed with the keys still not purged once the policy gives up, or CircuitOpenError as soon as the breaker stops sends
+        """
+        pending=list(batched(keys, self.batch_size))
+        start=self.clock()
+        attempt=0
+        requests=0
+        while True:
+            attempt+=1
+            failed: List[List[str]]=[]
+            wait=0.0
+            last_error: Optional[BaseException]=None
+            for batch in pending:
+                if not self.breaker.allow():
+                    failed.append(batch)
+                    continue
+                try:
+                    requests+=1
+                    self.send(batch, soft_purge)
+                    self.breaker.record_success()
+                except Exception as ex:
+                    self.breaker.record_failure()
+                    failed.append(batch)
+                    last_error=ex
+                    wait=max(wait, retry_after(ex) or 0.0)
+
+            if not failed:
+                return requests
+            failed_keys=[key for batch in failed for key in batch]
+            if not self.breaker.allow():
+                raise CircuitOpenError(failed_keys, "circuit open") from last_error
+            wait=max(wait, self.policy.backoff(attempt, self.rand))
+            if attempt >= self.policy.max_attempts or self.clock() - start + wait > self.policy.deadline:
+                raise PurgeFailed(failed_keys, f"gave up after {attempt} attempts: {last_error}") from last_error
+            logging.warning(f"Purge of {len(failed_keys)} of {len(keys)} keys failed, retrying in {wait:.1f}s: {last_error}")
+            self.sleep(wait)
+            pending=failed
@@ -0,0 +1,128 @@
+import pytest
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from backfill import parse_listing, run_backfill, read_checkpoint
+from metrics import invocation
+from purge_dispatch import PurgeDispatcher
+
+def _dispatcher(purge, batch_size=256, max_in_flight=8):
+    return PurgeDispatcher(lambda keys, service, soft: purge(keys), batch_size, max_in_flight, attempts=1)
+
+def _listing(papers):
+    lines=["gs://arxiv-production-data/ps_cache/cs/pdf/0005/:"]
+    for n in range(papers):
+        lines.append(f"gs://arxiv-production-data/ps_cache/cs/pdf/0005/0005{n:03d}v1.pdf")
+        lines.append(f"gs://arxiv-production-data/ps_cache/cs/pdf/0005/0005{n:03d}v1.outcome.tar.gz")
+        lines.append(f"gs://arxiv-production-data/ps_cache/arxiv/html/2409/2409.{n:05d}v1/index.html")
+        lines.append(f"gs://arxiv-production-data/ps_cache/arxiv/html/2409/2409.{n:05d}v1/fig.png")
+    lines.append("")
+    return lines
+
+def _expected(papers):
+    keys=set()
+    for n in range(papers):
+        keys.update([f"pdf-cs/0005{n:03d}-current", f"pdf-cs/0005{n:03d}v1", f"unavailable-cs/0005{n:03d}-current", f"unavailable-cs/0005{n:03d}v1",
+                     f"html-2409.{n:05d}-current", f"html-2409.{n:05d}v1", f"unavailable-2409.{n:05d}-current", f"unavailable-2409.{n:05d}v1"])
+    return keys
+
+def test_parse_listing():
+    assert list(parse_listing(["gs://b/a/x.pdf", "gs://b/a/:", "", "a/y.pdf"], bucket="other")) == [("b", "a/x.pdf"), ("", ""), ("", ""), ("other", "a/y.pdf")]
+    with pytest.raises(ValueError):
+        list(parse_listing(["a/y.pdf"]))
+
+def test_backfill_deduplicates_and_batches():
+    batches=[]
+    purged=run_backfill(parse_listing(_listing(100)), _dispatcher(batches.append))
+
+    sent=[key for batch in batches for key in batch]
+    assert purged == 800
+    assert len(sent) == len(set(sent))
+    assert set(sent) == _expected(100)
+    assert all(len(batch) <= 256 for batch in batches)
+
+def test_interrupted_backfill_resumes(tmp_path):
+    checkpoint=str(tmp_path / "checkpoint.json")
+    listing=_listing(100)
+    batches=[]
+    def failing_purge(keys):
+        if len(batches) == 3:
+            raise RuntimeError("interrupted")
+        batches.append(keys)
+
+    with pytest.raises(Exception):
+        run_backfill(parse_listing(listing), _dispatcher(failing_purge, 50, 1), checkpoint, chunk_lines=40)
+    lines_done=read_checkpoint(checkpoint)
+    assert 0 < lines_done < len(listing)
+
+    resumed=[]
+    run_backfill(parse_listing(listing), _dispatcher(resumed.append, 50), checkpoint, chunk_lines=40)
+    sent={key for batch in batches + resumed for key in batch}
+    assert sent == _expected(100)
+    assert read_checkpoint(checkpoint) == len(listing)
+    #only the chunk that was in progress gets purged twice
+    assert sum(len(batch) for batch in resumed) < len(_expected(100))
+
+def test_invalid_ids_skipped_and_counted(monkeypatch):
+    import classifier
+    from arxiv.identifier import IdentifierException
+    parse=classifier._identifier
+    def identifier(arxiv_id):
+        if arxiv_id.startswith("2409.00003"):
+            raise IdentifierException(f"bad id {arxiv_id}")
+        return parse(arxiv_id)
+    monkeypatch.setattr(classifier, "_identifier", identifier)
+    batches=[]
+
+    with invocation("test", sink=lambda record: None) as metrics:
+        purged=run_backfill(parse_listing(_listing(5)), _dispatcher(batches.append))
+    assert metrics.counts["lines_skipped"] == 2 #index.html and fig.png of the paper
+    assert purged == 36
+    assert not {key for batch in batches for key in batch} & {"html-2409.00003-current", "unavailable-2409.00003-current"}
+
+def test_mixed_buckets_classified_per_bucket(monkeypatch):
+    monkeypatch.setenv("LATEXML_BUCKET", "latexml")
+    batches=[]
+    listing=["gs://latexml/arxiv/2409.00001v1/index.html", "gs://data/ps_cache/arxiv/pdf/2409/2409.00002v1.pdf",
+             "gs://latexml/arxiv/2409.00003v1/fig.png"]
+
+    run_backfill(parse_listing(listing), _dispatcher(batches.append))
+    sent={key for batch in batches for key in batch}
+    assert {"html-2409.00001-current", "pdf-2409.00002-current", "html-2409.00003-current"} <= sent
+
+def test_dry_run_sends_nothing_with_service_ids(monkeypatch, tmp_path):
+    import backfill
+    import purge_dispatch
+    import requests
+    monkeypatch.setenv("DRY_RUN", "1")
+    monkeypatch.setenv("FASTLY_SERVICE_IDS", '{"arxiv.org": "service-id"}')
+    def post(*args, **kwargs):
+        raise AssertionError("dry run posted to fastly")
+    monkeypatch.setattr(requests.Session, "post", post)
+    dry_run=[]
+    monkeypatch.setattr(backfill, "_dry_run", lambda keys, service, soft: dry_run.extend(keys))
+    monkeypatch.setattr(purge_dispatch, "base_transport", lambda keys, service, soft: pytest.fail("dry run purged through base"))
+    listing=tmp_path / "listing.txt"
+    listing.write_text("\n".join(_listing(3)))
+
+    backfill.main([str(listing)])
+    assert {key for key in _expected(3) if key.endswith("-current")} <= set(dry_run)
+
+def test_attempts_from_purge_max_attempts(monkeypatch, tmp_path):
+    import backfill
+    import main
+    from purge_dispatch import PurgeError
+    monkeypatch.setenv("PURGE_MAX_ATTEMPTS", "2")
+    monkeypatch.setenv("PURGE_ATTEMPTS", "5")
+    monkeypatch.delenv("FASTLY_SERVICE_IDS", raising=False)
+    sends=[]
+    def send(keys, service, soft):
+        sends.append(keys)
+        raise ConnectionError("fastly down")
+    monkeypatch.setattr(main, "_send_through_base", send)
+    listing=tmp_path / "listing.txt"
+    listing.write_text("\n".join(_listing(1)))
+
+    with pytest.raises(PurgeError):
+        backfill.main([str(listing)])
+    assert len(sends) == 2
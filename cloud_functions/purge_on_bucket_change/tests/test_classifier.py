@@ -0,0 +1,103 @@
+import random
+import re
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from arxiv.identifier import Identifier, STANDARD as MODERN_ID, _archive, _category
+from classifier import Classifier, IGNORE, NONE
+
+LATEXML_BUCKET="latexml_document_conversions"
+
+#the classification invalidate_for_gs_change did before Classifier, kept verbatim as the golden reference
+_OLD_ID = re.compile(r'(%s)\/[^\/]*\/\d*\/(\d{2}[01]\d{4}(v\d*)?)' % f'{_archive}|{_category}')
+_IGNORE=['outcome.tar.gz','LaTeXML.cache','__stdout.txt']
+
+def _reference_paperid(name):
+    if not name:
+        return None
+    if match := MODERN_ID.search(name):
+        return Identifier(match.group("arxiv_id"))
+    if match := _OLD_ID.search(name):
+        return Identifier(match.group(1) + "/" + match.group(2))
+    else:
+        return None
+
+def _reference(bucket, key):
+    if any(ignored in key for ignored in _IGNORE):
+        return IGNORE
+    if bucket==LATEXML_BUCKET:
+        path="html"
+    elif "/pdf/" in key and key.endswith('.pdf'):
+        path="pdf"
+    elif '/html/' in key:
+        path="html"
+    elif key.endswith('.pdf'):
+        path="pdf"
+    else:
+        return NONE
+    paper_id = _reference_paperid(key)
+    if not paper_id:
+        return path
+    return [f'{path}-{paper_id.id}-current', f'{path}-{paper_id.idv}', f'unavailable-{paper_id.id}-current', f'unavailable-{paper_id.idv}']
+
+def _outcome(classification):
+    if classification.kind in (IGNORE, NONE):
+        return classification.kind
+    return classification.purge_keys() or classification.kind
+
+def _safely(fun, *args):
+    """result of fun, or the type of exception it raised so invalid ids compare equal too"""
+    try:
+        return fun(*args)
+    except Exception as ex:
+        return type(ex)
+
+def synthetic_corpus(size, seed=0):
+    """object names in the shapes found in the buckets, plus noise"""
+    rand=random.Random(seed)
+    archives=["cs", "hep-th", "hep-ph", "math", "astro-ph", "cond-mat", "quant-ph", "physics", "notanarchive"]
+    files=["index.html", "fancy.png", "LaTeXML.cache", "__stdout.txt", "x.css", "main.pdf", "a.outcome.tar.gz"]
+    keys=[]
+    for _ in range(size):
+        yymm=f"{rand.randint(7, 25):02d}{rand.randint(0, 13):02d}"
+        modern=f"{yymm}.{rand.randint(0, 99999):0{rand.choice([4, 5])}d}" + rand.choice(["", "v1", "v12", "v"])
+        old=f"{rand.randint(91, 99) if rand.random() < .5 else rand.randint(0, 7):02d}{rand.randint(0, 13):02d}{rand.randint(0, 999):03d}" + rand.choice(["", "v2", "v"])
+        arch=rand.choice(archives)
+        keys.append(rand.choice([
+            f"ps_cache/arxiv/html/{yymm}/{modern}/{rand.choice(files)}",
+            f"ps_cache/{arch}/pdf/{old[:4]}/{old}.pdf",
+            f"ps_cache/{arch}/pdf/{yymm}/{modern}.pdf",
+            f"ps_cache/{arch}/ps/{old[:4]}/{old}.ps.gz",
+            f"ps_cache/{arch}/html/{old[:4]}/{old}/{rand.choice(files)}",
+            f"ftp/arxiv/papers/{yymm}/{modern}.pdf",
+            f"orig/{arch}/papers/{old[:4]}/{old}.pdf",
+            f"{modern}/{modern}.html",
+            f"{modern}/{rand.choice(files)}",
+            f"ps_cache/{arch}/pdf/{old[:4]}/{old}{rand.choice(['.pdf', '.outcome.tar.gz', ''])}",
+            "".join(rand.choice("abc/.0123456789v-_") for _ in range(rand.randint(0, 40))),
+        ]))
+    return keys
+
+def test_classify_many_matches_reference():
+    corpus=synthetic_corpus(20000)
+    classifier=Classifier(LATEXML_BUCKET)
+    for bucket in ("arxiv-production-data", LATEXML_BUCKET):
+        for key, classification in zip(corpus, classifier.classify_many(corpus, bucket)):
+            assert _safely(_outcome, classification) == _safely(_reference, bucket, key), f"gs://{bucket}/{key}"
+
+def test_classify_single():
+    classifier=Classifier(LATEXML_BUCKET)
+    assert classifier.classify("b", "ps_cache/cs/pdf/0005/0005003v1.pdf").arxiv_id == "cs/0005003v1"
+    assert classifier.classify("b", "ps_cache/arxiv/html/0712/0712.3116v1/index.html").kind == "html"
+    assert classifier.classify("b", "ps_cache/cs/ps/0005/0005003v1.ps.gz").kind == NONE
+    assert classifier.classify("b", "ps_cache/arxiv/html/0712/0712.3116v1/LaTeXML.cache").kind == IGNORE
+    assert classifier.classify(LATEXML_BUCKET, "0802.3414v4/0802.3414v4.html").kind == "html"
+
+def test_object_parts_found_anywhere():
+    """names where the parts OBJECT_PARTS finds sit next to or inside each other"""
+    classifier=Classifier(LATEXML_BUCKET)
+    for key in ["ps_cache/arxiv/html/pdf/2409.00001v1.pdf", "ps_cache/cs/pdf/pdf/0005003v1.pdf", "x/html/html/2409.00001v1/a.png",
+                "x/outcome.tar.gz/pdf/2409.00001v1.pdf", "x/LaTeXML.cache.pdf", "x/pdf/2409.00001v1.pdf.gz", "x/.pdf", "pdf/2409.00001.pdf",
+                "x/__stdout.txt/html/2409.00001", "x/pdf.pdf", "/pdf/", "/html/"]:
+        for bucket in ("arxiv-production-data", LATEXML_BUCKET):
+            assert _safely(_outcome, classifier.classify(bucket, key)) == _safely(_reference, bucket, key), f"gs://{bucket}/{key}"
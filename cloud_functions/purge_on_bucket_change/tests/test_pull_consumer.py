@@ -0,0 +1,68 @@
+from unittest.mock import Mock
+
+import pytest
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from pull_consumer import InMemorySource, consume_batch, drain
+
+def _handle(bucket, name, invalidator):
+    paper=name.split("/")[-1].split(".pdf")[0]
+    invalidator.invalidate([f"pdf-{paper}", f"unavailable-{paper}"])
+
+def _messages(n):
+    return [{"bucket": "b", "name": f"ps_cache/arxiv/pdf/2409/2409.{i % 10:05d}v1.pdf"} for i in range(n)]
+
+def test_batch_purged_once_and_acked():
+    source=InMemorySource(_messages(50))
+    invalidator=Mock()
+
+    assert consume_batch(source, _handle, invalidator, 25) == 25
+    invalidator.invalidate.assert_called_once()
+    assert len(invalidator.invalidate.call_args[0][0]) == 20 #10 papers, duplicates removed
+    assert len(source.acked) == 25
+    assert len(source.queue) == 25
+
+def test_drain_until_empty():
+    source=InMemorySource(_messages(95))
+    invalidator=Mock()
+
+    assert drain(source, _handle, invalidator, max_messages=20) == 95
+    assert invalidator.invalidate.call_count == 5
+    assert len(source.acked) == 95
+    assert source.outstanding == {}
+
+def test_failed_purge_released_for_redelivery():
+    source=InMemorySource(_messages(10))
+    invalidator=Mock()
+    invalidator.invalidate.side_effect=RuntimeError("fastly down")
+
+    with pytest.raises(RuntimeError):
+        consume_batch(source, _handle, invalidator, 10)
+    assert source.acked == []
+    assert len(source.queue) == 10
+
+def test_bad_and_other_messages_acked_without_purge():
+    source=InMemorySource([{"bucket": "b"}, {"name": "x"}])
+    invalidator=Mock()
+
+    assert consume_batch(source, _handle, invalidator, 10) == 2
+    invalidator.invalidate.assert_not_called()
+    assert len(source.acked) == 2
+
+def test_failing_message_released_alone():
+    messages=_messages(5)
+    messages[2]={"bucket": "b", "name": "poison"}
+    def handle(bucket, name, invalidator):
+        if name == "poison":
+            raise ValueError("can't parse poison")
+        _handle(bucket, name, invalidator)
+    source=InMemorySource(messages)
+    invalidator=Mock()
+
+    assert consume_batch(source, handle, invalidator, 10) == 5
+    invalidator.invalidate.assert_called_once()
+    assert source.acked == ["0", "1", "3", "4"]
+    assert [message.data["name"] for message in source.queue] == ["poison"]
+    assert source.outstanding == {}
+
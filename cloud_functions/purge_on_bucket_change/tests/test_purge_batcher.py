@@ -0,0 +1,60 @@
+import threading
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from purge_batcher import PurgeBatcher
+
+def _submit_all(batcher, key_lists):
+    errors=[]
+    def run(keys):
+        try:
+            batcher.submit(keys)
+        except Exception as ex:
+            errors.append(ex)
+    threads=[threading.Thread(target=run, args=(keys,)) for keys in key_lists]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+def _paper_keys(n):
+    return [f"pdf-0712.{n:04d}-current", f"pdf-0712.{n:04d}v1", f"unavailable-0712.{n:04d}-current", f"unavailable-0712.{n:04d}v1"]
+
+def test_events_in_window_share_one_purge():
+    purged=[]
+    batcher=PurgeBatcher(purged.append, window=0.5, max_keys=256)
+    #many objects for the same few papers
+    errors=_submit_all(batcher, [_paper_keys(n % 5) for n in range(40)])
+
+    assert errors == []
+    assert len(purged) == 1
+    assert sorted(purged[0]) == sorted(k for n in range(5) for k in _paper_keys(n))
+    assert batcher.requests == 1
+    assert batcher.keys_submitted == 160
+    assert batcher.keys_sent == 20
+
+def test_max_keys_splits_batches():
+    purged=[]
+    batcher=PurgeBatcher(purged.append, window=0.5, max_keys=8)
+    errors=_submit_all(batcher, [_paper_keys(n) for n in range(10)])
+
+    assert errors == []
+    assert all(len(keys) <= 8 for keys in purged)
+    assert sorted(k for keys in purged for k in keys) == sorted(k for n in range(10) for k in _paper_keys(n))
+
+def test_failure_reaches_every_event():
+    def purge(keys):
+        raise RuntimeError("fastly down")
+    batcher=PurgeBatcher(purge, window=0.3)
+    errors=_submit_all(batcher, [_paper_keys(n) for n in range(5)])
+
+    assert len(errors) == 5
+    assert all(isinstance(ex, RuntimeError) for ex in errors)
+
+def test_next_batch_after_flush():
+    purged=[]
+    batcher=PurgeBatcher(purged.append, window=0.01)
+    batcher.submit(_paper_keys(1))
+    batcher.submit(_paper_keys(1))
+    assert len(purged) == 2
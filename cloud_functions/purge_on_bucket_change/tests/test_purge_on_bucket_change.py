@@ -1,9 +1,11 @@
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 from arxiv.identifier import Identifier
 
 import sys, os
 sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
-from main import _paperid, invalidate_for_gs_change
+from main import _paperid, invalidate_for_gs_change, Invalidator
+from recent_purges import RecentPurges
+from pull_consumer import InMemorySource, consume_batch
 
 def test_paper_id():
     #nonsense text
@@ -94,3 +96,30 @@ def test_ignored_files():
     path="ps_cache/cs/pdf/0005/0005003v1.outcome.tar.gz"
     invalidate_for_gs_change("bucket", path, mock_invalidator)
     mock_invalidator.invalidate.assert_not_called()
+
+
+def test_pulled_batch():
+    mock_invalidator = Mock()
+    source=InMemorySource([
+        {"bucket":"bucket", "name":"ps_cache/arxiv/html/0712/0712.3116v1/index.html"},
+        {"bucket":"bucket", "name":"ps_cache/arxiv/html/0712/0712.3116v1/fancy.png"},
+        {"bucket":"bucket", "name":"ps_cache/cs/pdf/0005/0005003v1.pdf"},
+        {"bucket":"bucket", "name":"ps_cache/arxiv/html/0712/0712.3116v1/LaTeXML.cache"},
+    ])
+    consume_batch(source, invalidate_for_gs_change, mock_invalidator, 10)
+
+    expected=["html-0712.3116v1", "html-0712.3116-current", "unavailable-0712.3116v1", "unavailable-0712.3116-current",
+              "pdf-cs/0005003v1", "pdf-cs/0005003-current", "unavailable-cs/0005003v1", "unavailable-cs/0005003-current"]
+    mock_invalidator.invalidate.assert_called_once()
+    assert sorted(expected)==sorted(mock_invalidator.invalidate.call_args[0][0])
+    assert len(source.acked)==4
+
+@patch('main.purge_fastly_keys')
+def test_recent_purges_skipped(MockPurgeFun):
+    invalidator=Invalidator(recent=RecentPurges(window=60))
+    invalidate_for_gs_change("bucket", "ps_cache/arxiv/html/0712/0712.3116v1/index.html", invalidator)
+    invalidate_for_gs_change("bucket", "ps_cache/arxiv/html/0712/0712.3116v1/fancy.png", invalidator)
+    MockPurgeFun.assert_called_once()
+
+    invalidate_for_gs_change("bucket", "ps_cache/arxiv/pdf/0712/0712.3116v1.pdf", invalidator)
+    assert sorted(MockPurgeFun.call_args[0][0]) == ["pdf-0712.3116-current", "pdf-0712.3116v1"]
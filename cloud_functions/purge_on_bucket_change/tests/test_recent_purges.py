@@ -0,0 +1,38 @@
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from recent_purges import RecentPurges
+
+class FakeClock:
+    def __init__(self):
+        self.now=0.0
+    def __call__(self):
+        return self.now
+
+def test_repeats_suppressed_within_window():
+    clock=FakeClock()
+    recent=RecentPurges(window=10, clock=clock)
+    keys=["pdf-0712.3116-current", "pdf-0712.3116v1"]
+
+    assert recent.fresh(keys) == keys
+    recent.add(keys)
+    clock.now=5
+    assert recent.fresh(keys + ["html-0712.3116v1"]) == ["html-0712.3116v1"]
+    assert recent.requested == 5
+    assert recent.suppressed == 2
+    assert recent.suppression_rate == 0.4
+
+def test_keys_expire():
+    clock=FakeClock()
+    recent=RecentPurges(window=10, clock=clock)
+    recent.add(["a"])
+    clock.now=4
+    recent.add(["b"])
+    clock.now=11
+    assert recent.fresh(["a", "b"]) == ["a"]
+    assert len(recent) == 1
+
+def test_bounded():
+    recent=RecentPurges(window=60, max_keys=3)
+    recent.add(["a", "b", "c", "d"])
+    assert len(recent) == 3
+    assert recent.fresh(["a", "d"]) == ["a"]
@@ -0,0 +1,117 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import sys, os
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "src") )
+from purge_dispatch import HttpPurgeTransport
+from retry_policy import CircuitBreaker, CircuitOpenError, PurgeFailed, RetryPolicy, RetryingPurger
+
+class StubFastly(ThreadingHTTPServer):
+    """answers each purge with fail(keys) -> (status, headers) and records the keys it got"""
+    def __init__(self, fail):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.fail=fail
+        self.requests=[]
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        keys=self.headers.get("Surrogate-Key", "").split()
+        self.server.requests.append(keys)
+        status, headers=self.server.fail(keys) or (200, {})
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub():
+    servers=[]
+    def start(fail):
+        server=StubFastly(fail)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        transport=HttpPurgeTransport({"arxiv.org": "id"}, "token", f"http://127.0.0.1:{server.server_address[1]}")
+        return server, lambda keys, soft: transport(keys, "arxiv.org", soft)
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+class Clock:
+    def __init__(self):
+        self.now=0.0
+    def __call__(self):
+        return self.now
+    def sleep(self, seconds):
+        self.now+=seconds
+
+def _purger(send, clock, **policy):
+    return RetryingPurger(send, RetryPolicy(**policy), CircuitBreaker(100, clock=clock), batch_size=2,
+                          sleep=clock.sleep, clock=clock, rand=lambda: 1.0)
+
+def test_only_failed_batch_resent(stub):
+    failures=[1]
+    def fail(keys):
+        if "c" in keys and failures[0]:
+            failures[0]-=1
+            return 503, {}
+    server, send=stub(fail)
+    clock=Clock()
+    requests=_purger(send, clock).purge(["a", "b", "c", "d", "e", "f"])
+
+    assert server.requests == [["a", "b"], ["c", "d"], ["e", "f"], ["c", "d"]]
+    assert requests == 4
+    assert clock.now == 0.5 #jittered backoff with rand at its maximum
+
+def test_rate_limit_waits_as_asked(stub):
+    responses=[(429, {"Retry-After": "3"})]
+    server, send=stub(lambda keys: responses.pop() if responses else None)
+    clock=Clock()
+    _purger(send, clock).purge(["a"])
+
+    assert len(server.requests) == 2
+    assert clock.now == 3
+
+def test_gives_up_after_max_attempts(stub):
+    server, send=stub(lambda keys: (503, {}) if "b" in keys else None)
+    clock=Clock()
+    with pytest.raises(PurgeFailed) as info:
+        _purger(send, clock, max_attempts=3).purge(["a", "b", "c"])
+
+    assert info.value.keys == ["a", "b"]
+    assert server.requests == [["a", "b"], ["c"], ["a", "b"], ["a", "b"]]
+
+def test_gives_up_at_deadline(stub):
+    server, send=stub(lambda keys: (503, {}))
+    clock=Clock()
+    with pytest.raises(PurgeFailed):
+        _purger(send, clock, max_attempts=100, deadline=3, max_backoff=1).purge(["a"])
+    assert clock.now <= 3
+    assert len(server.requests) == 4 #at 0, 0.5, 1.5 and 2.5 seconds
+
+def test_circuit_breaker(stub):
+    down=[True]
+    server, send=stub(lambda keys: (503, {}) if down[0] else None)
+    clock=Clock()
+    purger=RetryingPurger(send, RetryPolicy(max_attempts=10), CircuitBreaker(2, reset_after=30, clock=clock),
+                          sleep=clock.sleep, clock=clock, rand=lambda: 0.0)
+
+    with pytest.raises(CircuitOpenError):
+        purger.purge(["a"])
+    assert len(server.requests) == 2
+
+    with pytest.raises(CircuitOpenError):
+        purger.purge(["b"])
+    assert len(server.requests) == 2, "nothing sent while open"
+
+    clock.now+=30
+    down[0]=False
+    purger.purge(["b"])
+    assert server.requests[-1] == ["b"]
@@ -0,0 +1,136 @@
+"""a structured metrics record for each invocation: stage timings, counts and whatever else the function sets, emitted once when it ends
+
+off unless PURGE_METRICS is set, no code changes are needed to turn it on
+json  one json line per invocation on stdout, cloud logging reads it as a structured entry and it is easy to grep locally
+log   the same record through logging at info level
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+Sink = Callable[[Dict[str, Any]], None]
+
+
+def stdout_sink(record: Dict[str, Any]) -> None:
+    print(json.dumps(record, default=str), file=sys.stdout, flush=True)
+
+def log_sink(record: Dict[str, Any]) -> None:
+    logging.info(f"metrics: {json.dumps(record, default=str)}")
+
+SINKS: Dict[str, Sink]={"json": stdout_sink, "log": log_sink}
+
+def sink_from_env() -> Optional[Sink]:
+    name=os.environ.get("PURGE_METRICS", "").lower()
+    if name in ("", "0", "off"):
+        return None
+    if name not in SINKS:
+        logging.warning(f"Unknown PURGE_METRICS {name}, expected one of {sorted(SINKS)}, metrics are off")
+        return None
+    return SINKS[name]
+
+
+class Metrics:
+    """one invocation's record, kept even without a sink so callers never need to check
+    counts and times may be added from any thread working for the invocation
+    """
+    def __init__(self, function: str, sink: Optional[Sink]=None, clock: Callable[[], float]=time.perf_counter) -> None:
+        self.function=function
+        self.sink=sink
+        self.clock=clock
+        self.start=clock()
+        self.stages: Dict[str, float]=Counter()
+        self.counts: Counter=Counter()
+        self.fields: Dict[str, Any]={}
+        self._lock=threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sink is not None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """adds the time spent in the block to stage name"""
+        start=self.clock()
+        try:
+            yield
+        finally:
+            self.add_time(name, self.clock() - start)
+
+    def timed(self, items: Iterable[T], stage: str) -> Iterator[T]:
+        """yields items, adding the time spent producing each one to stage, for work done lazily by a generator"""
+        it=iter(items)
+        while True:
+            start=self.clock()
+            try:
+                item=next(it)
+            except StopIteration:
+                self.add_time(stage, self.clock() - start)
+                return
+            self.add_time(stage, self.clock() - start)
+            yield item
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage]+=seconds
+
+    def count(self, name: str, n: int=1) -> None:
+        with self._lock:
+            self.counts[name]+=n
+
+    def set(self, name: str, value: Any) -> None:
+        self.fields[name]=value
+
+    def record(self) -> Dict[str, Any]:
+        return {
+            "message": f"{self.function} metrics",
+            "severity": "INFO",
+            "function": self.function,
+            "seconds": round(self.clock() - self.start, 6),
+            "stages": {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            "counts": dict(self.counts),
+            **self.fields,
+        }
+
+    def emit(self) -> None:
+        if self.sink is not None:
+            self.sink(self.record())
+
+
+_current: ContextVar[Optional[Metrics]]=ContextVar("invocation_metrics", default=None)
+
+def current() -> Metrics:
+    """the running invocation's metrics, or a record that is never emitted outside of one"""
+    return _current.get() or Metrics("none")
+
+@contextmanager
+def invocation(function: str, sink: Optional[Sink]=None) -> Iterator[Metrics]:
+    """metrics for one invocation of function, emitted when the block ends, with the error if it raised"""
+    metrics=Metrics(function, sink if sink is not None else sink_from_env())
+    token=_current.set(metrics)
+    try:
+        yield metrics
+    except BaseException as ex:
+        metrics.set("error", repr(ex))
+        raise
+    finally:
+        _current.reset(token)
+        metrics.emit()
+
+def instrumented(function: str) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """runs the decorated entry point inside invocation(function), put it under the functions_framework decorator"""
+    def decorate(entry_point: Callable[..., T]) -> Callable[..., T]:
+        @wraps(entry_point)
+        def run(*args: Any, **kwargs: Any) -> T:
+            with invocation(function):
+                return entry_point(*args, **kwargs)
+        return run
+    return decorate
@@ -0,0 +1,314 @@
+"""splits large surrogate key lists into fastly sized batches and purges them concurrently
+
+purges are sent from an asyncio event loop: the batches of one purge, and the purges of several services, go out together.
+the transport is blocking, a pooled keep-alive requests session, so requests run on the client's thread pool,
+which also caps the requests in flight across everything the instance purges at once.
+a token bucket, when PURGE_RATE_LIMIT is set, holds every request of the instance to the fastly api quota.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+FASTLY_MAX_KEYS_PER_PURGE=256 #fastly limit on surrogate keys in a single purge request
+MAX_BACKOFF=8 #seconds
+DEFAULT_API_URL="https://api.fastly.com"
+
+#sends one batch of keys to one service, raises on failure
+PurgeTransport = Callable[[List[str], str, bool], None]
+
+
+class PurgeError(Exception):
+    """raised when some batches could still not be purged after retrying, result has the counts for the whole purge
+    and services, for a purge of several services, the result of each
+    """
+    def __init__(self, failed: List[List[str]], result: Optional["DispatchResult"]=None, services: Optional[Dict[str, "DispatchResult"]]=None):
+        self.failed=failed
+        self.result=result
+        self.services=services or {}
+        super().__init__(f"{len(failed)} batch(es) failed to purge ({sum(len(b) for b in failed)} keys)")
+
+
+@dataclass
+class DispatchResult:
+    batches: int=0
+    keys: int=0
+    retries: int=0
+    failed: List[List[str]]=field(default_factory=list)
+    seconds: float=0.0 #from the first batch being taken to the last one answered
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+
+def batched(keys: Iterable[str], size: int) -> Iterator[List[str]]:
+    """yields lists of at most size keys, consuming keys lazily"""
+    it=iter(keys)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+def base_transport(keys: List[str], service_name: str, soft_purge: bool) -> None:
+    """purges through arxiv-base, which knows the service ids and token"""
+    from arxiv.integration.fastly.purge import purge_fastly_keys
+    purge_fastly_keys(keys, service_name, soft_purge=soft_purge)
+
+
+class HttpPurgeTransport:
+    """posts surrogate key purges directly to the fastly api, reusing connections from one pooled session
+    api_url can point at a local fake fastly for testing
+    """
+    def __init__(self, service_ids: Dict[str, str], token: str, api_url: str=DEFAULT_API_URL, pool_size: int=8, timeout: float=10) -> None:
+        self.service_ids=service_ids
+        self.token=token
+        self.api_url=api_url.rstrip("/")
+        self.timeout=timeout
+        self.session=requests.Session()
+        adapter=HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def __call__(self, keys: List[str], service_name: str, soft_purge: bool) -> None:
+        headers={
+            "Fastly-Key": self.token,
+            "Accept": "application/json",
+            "Surrogate-Key": " ".join(keys),
+        }
+        if soft_purge:
+            headers["Fastly-Soft-Purge"]="1"
+        service_id=self.service_ids[service_name]
+        response=self.session.post(f"{self.api_url}/service/{service_id}/purge", headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+
+
+def retry_after(ex: BaseException) -> Optional[float]:
+    """seconds fastly asked us to wait, when ex is a rate limited (429) http error"""
+    response=getattr(ex, "response", None)
+    if response is None or getattr(response, "status_code", None) != 429:
+        return None
+    headers=response.headers
+    if (value := headers.get("Retry-After", "")).isdigit():
+        return float(value)
+    if reset := headers.get("Fastly-RateLimit-Reset"): #epoch seconds
+        return max(0.0, float(reset) - time.time())
+    return None
+
+
+class TokenBucket:
+    """allows rate requests a second on average, in bursts of up to burst
+    thread safe, so the event loops of concurrent invocations draw on the same quota
+    """
+    def __init__(self, rate: float, burst: Optional[float]=None, clock: Callable[[], float]=time.monotonic) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be above 0")
+        self.rate=rate
+        self.burst=burst if burst else max(1.0, rate)
+        self.clock=clock
+        self._tokens=self.burst
+        self._updated=clock()
+        self._lock=threading.Lock()
+
+    def reserve(self) -> float:
+        """takes a token, returns the seconds to wait before using it, tokens taken ahead are paid back before later callers get theirs"""
+        with self._lock:
+            now=self.clock()
+            self._tokens=min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated=now
+            self._tokens-=1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def wait(self) -> None:
+        if delay := self.reserve():
+            time.sleep(delay)
+
+    async def acquire(self) -> None:
+        if delay := self.reserve():
+            await asyncio.sleep(delay)
+
+
+class _BatchFailed(Exception):
+    def __init__(self, batch: List[str], retries: int):
+        self.batch=batch
+        self.retries=retries
+
+
+class AsyncPurgeClient:
+    """purges keys in batches of batch_size with at most max_in_flight requests running at once
+    each batch is retried on its own, so a failure only resends the keys in that batch, after a full jitter backoff
+    or, when fastly rate limited it, as long as its Retry-After asks
+    """
+    def __init__(self, transport: PurgeTransport=base_transport, batch_size: int=FASTLY_MAX_KEYS_PER_PURGE,
+                 max_in_flight: int=8, attempts: int=3, backoff: float=0.5, limiter: Optional[TokenBucket]=None,
+                 rand: Callable[[], float]=random.random) -> None:
+        if not 0 < batch_size <= FASTLY_MAX_KEYS_PER_PURGE:
+            raise ValueError(f"batch_size must be between 1 and {FASTLY_MAX_KEYS_PER_PURGE}")
+        self.transport=transport
+        self.batch_size=batch_size
+        self.max_in_flight=max(1, max_in_flight)
+        self.attempts=max(1, attempts)
+        self.backoff=backoff
+        self.limiter=limiter
+        self.rand=rand
+        self._executor=ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="purge")
+
+    def send(self, batch: List[str], service_name: str="arxiv.org", soft_purge: bool=False) -> None:
+        """sends one batch from the calling thread, once, held to the limiter, for callers with their own retrying"""
+        if self.limiter is not None:
+            self.limiter.wait()
+        self.transport(batch, service_name, soft_purge)
+
+    async def purge(self, keys: Iterable[str], service_name: str="arxiv.org", soft_purge: bool=False,
+                    on_batch: Optional[Callable[[List[str]], None]]=None) -> DispatchResult:
+        """purges all keys, raises PurgeError after every batch has been attempted if any of them failed
+        keys may be a generator, batches are sent as soon as they fill and no more are taken while max_in_flight are out
+        on_batch is called, from the event loop, with each batch once fastly has confirmed it
+        """
+        result=DispatchResult()
+        started=time.monotonic()
+        pending: Set[asyncio.Future]=set()
+        for batch in batched(keys, self.batch_size):
+            if len(pending) >= self.max_in_flight:
+                done, pending=await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                self._collect(done, result, on_batch)
+            pending.add(asyncio.ensure_future(self._send(batch, service_name, soft_purge)))
+            await asyncio.sleep(0) #lets the batch go out before the next one is read from keys
+            result.batches+=1
+            result.keys+=len(batch)
+        if pending:
+            done, _=await asyncio.wait(pending)
+            self._collect(done, result, on_batch)
+        result.seconds=time.monotonic() - started
+
+        logging.info(f"Purged {result.keys} keys in {result.batches} batches for {service_name} in {result.seconds:.3f}s, retries: {result.retries}, failed batches: {len(result.failed)}")
+        if result.failed:
+            raise PurgeError(result.failed, result)
+        return result
+
+    async def purge_services(self, purges: Mapping[str, Iterable[str]], soft_purge: bool=False,
+                             on_batch: Optional[Callable[[str, List[str]], None]]=None) -> Dict[str, Union[DispatchResult, PurgeError]]:
+        """purges each service's keys at the same time, the result of each service, or its PurgeError, by service
+        on_batch is called with the service and each batch it confirmed
+        """
+        services=list(purges)
+        outcomes=await asyncio.gather(*(self.purge(purges[service], service, soft_purge, partial(on_batch, service) if on_batch else None)
+                                        for service in services), return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException) and not isinstance(outcome, PurgeError):
+                raise outcome
+        return dict(zip(services, outcomes)) # type: ignore[arg-type]
+
+    async def _send(self, batch: List[str], service_name: str, soft_purge: bool) -> Tuple[List[str], int]:
+        """sends one batch, returns it with the number of retries it took"""
+        loop=asyncio.get_running_loop()
+        attempt=0
+        while True:
+            if self.limiter is not None:
+                await self.limiter.acquire()
+            try:
+                await loop.run_in_executor(self._executor, self.transport, batch, service_name, soft_purge)
+                return batch, attempt
+            except Exception as ex:
+                attempt+=1
+                if attempt >= self.attempts:
+                    logging.error(f"Purge of {len(batch)} keys for {service_name} failed after {self.attempts} attempts: {ex}")
+                    raise _BatchFailed(batch, attempt - 1) from ex
+                wait=max(retry_after(ex) or 0.0, self.rand() * min(MAX_BACKOFF, self.backoff * 2**(attempt - 1)))
+                logging.warning(f"Purge of {len(batch)} keys for {service_name} failed, retrying in {wait:.1f}s: {ex}")
+                await asyncio.sleep(wait)
+
+    @staticmethod
+    def _collect(futures: Iterable[asyncio.Future], result: DispatchResult, on_batch: Optional[Callable[[List[str]], None]]) -> None:
+        for future in futures:
+            try:
+                batch, retries=future.result()
+            except _BatchFailed as ex:
+                result.retries+=ex.retries
+                result.failed.append(ex.batch)
+                continue
+            result.retries+=retries
+            if on_batch is not None:
+                on_batch(batch)
+
+
+class PurgeDispatcher:
+    """blocking front to AsyncPurgeClient for callers without an event loop, each call runs on a loop of its own until it is done"""
+    def __init__(self, transport: PurgeTransport=base_transport, batch_size: int=FASTLY_MAX_KEYS_PER_PURGE,
+                 max_in_flight: int=8, attempts: int=3, backoff: float=0.5, limiter: Optional[TokenBucket]=None,
+                 rand: Callable[[], float]=random.random) -> None:
+        self.client=AsyncPurgeClient(transport, batch_size, max_in_flight, attempts, backoff, limiter, rand)
+
+    def purge(self, keys: Iterable[str], service_name: str="arxiv.org", soft_purge: bool=False,
+              on_batch: Optional[Callable[[List[str]], None]]=None) -> DispatchResult:
+        """see AsyncPurgeClient.purge"""
+        return asyncio.run(self.client.purge(keys, service_name, soft_purge, on_batch))
+
+    def purge_services(self, purges: Mapping[str, Iterable[str]], soft_purge: bool=False,
+                       on_batch: Optional[Callable[[str, List[str]], None]]=None) -> Dict[str, DispatchResult]:
+        """purges each service's keys at the same time, the result by service
+        raises PurgeError with the failed batches of every service once all are done, its services has the result of each
+        """
+        outcomes=asyncio.run(self.client.purge_services(purges, soft_purge, on_batch))
+        results: Dict[str, DispatchResult]={}
+        for service, outcome in outcomes.items():
+            counts=outcome.result if isinstance(outcome, PurgeError) else outcome
+            results[service]=counts if counts is not None else DispatchResult(failed=outcome.failed) # type: ignore[union-attr]
+        if all(result.ok for result in results.values()):
+            return results
+        total=DispatchResult(seconds=max(result.seconds for result in results.values()))
+        for counts in results.values():
+            total.batches+=counts.batches
+            total.keys+=counts.keys
+            total.retries+=counts.retries
+            total.failed.extend(counts.failed)
+        raise PurgeError(total.failed, total, results)
+
+    def send(self, batch: List[str], service_name: str="arxiv.org", soft_purge: bool=False) -> None:
+        """see AsyncPurgeClient.send"""
+        self.client.send(batch, service_name, soft_purge)
+
+
+_limiter: Optional[TokenBucket]=None
+
+def limiter_from_env() -> Optional[TokenBucket]:
+    """one token bucket for the instance from PURGE_RATE_LIMIT, requests a second, and PURGE_RATE_BURST, None when no limit is set"""
+    global _limiter
+    rate=float(os.environ.get("PURGE_RATE_LIMIT", "0"))
+    if rate <= 0:
+        return None
+    burst=float(os.environ.get("PURGE_RATE_BURST", "0")) or None
+    if _limiter is None or _limiter.rate != rate or (burst and _limiter.burst != burst):
+        _limiter=TokenBucket(rate, burst)
+    return _limiter
+
+def dispatcher_from_env(fallback: PurgeTransport=base_transport, attempts: Optional[int]=None,
+                        transport: Optional[PurgeTransport]=None) -> PurgeDispatcher:
+    """builds a dispatcher from environment variables
+    FASTLY_SERVICE_IDS (json object of service name to service id) switches to the pooled http transport,
+    otherwise batches are sent with fallback, through arxiv-base by default
+    transport, when given, is used whatever FASTLY_SERVICE_IDS says, ex for a dry run that must not reach fastly
+    attempts, when given, overrides PURGE_ATTEMPTS, for callers that do their own retrying
+    """
+    max_in_flight=int(os.environ.get("PURGE_MAX_IN_FLIGHT", "8"))
+    service_ids: Optional[str]=os.environ.get("FASTLY_SERVICE_IDS")
+    if transport is None and service_ids:
+        transport=HttpPurgeTransport(json.loads(service_ids),
+                                     os.environ.get("FASTLY_PURGE_TOKEN", ""),
+                                     os.environ.get("FASTLY_API_URL", DEFAULT_API_URL),
+                                     pool_size=max_in_flight)
+    return PurgeDispatcher(transport or fallback,
+                           batch_size=int(os.environ.get("PURGE_BATCH_SIZE", str(FASTLY_MAX_KEYS_PER_PURGE))),
+                           max_in_flight=max_in_flight,
+                           attempts=attempts or int(os.environ.get("PURGE_ATTEMPTS", "3")),
+                           limiter=limiter_from_env())
@@ -0,0 +1,52 @@
+"""lazy startup for the cloud functions
+nothing expensive is done at import, clients and other heavy objects are built on first use and kept for warm invocations.
+"""
+import logging
+import os
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Lazy(Generic[T]):
+    """builds a value with build() the first time get() is called, later calls return the same value"""
+    def __init__(self, build: Callable[[], T]) -> None:
+        self._build=build
+        self._value: Optional[T]=None
+        self._built=False
+        self._lock=threading.Lock()
+
+    def get(self) -> T:
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._value=self._build()
+                    self._built=True
+        return self._value # type: ignore[return-value]
+
+    @property
+    def built(self) -> bool:
+        return self._built
+
+    def reset(self) -> None:
+        """forget the value so the next get() builds a new one"""
+        with self._lock:
+            self._value=None
+            self._built=False
+
+
+def _configure_logging() -> None:
+    if not(os.environ.get('LOG_LOCALLY')):
+        import google.cloud.logging
+        client = google.cloud.logging.Client()
+        client.setup_logging()
+    log_level_str = os.getenv('LOG_LEVEL', 'INFO')
+    log_level = getattr(logging, log_level_str.upper(), logging.INFO)
+    logging.basicConfig(level=log_level)
+
+_logging: Lazy[None]=Lazy(_configure_logging)
+
+def setup_logging() -> None:
+    """sets up cloud logging (or local logging with LOG_LOCALLY) the first time it is called, call at the top of each entry point"""
+    _logging.get()
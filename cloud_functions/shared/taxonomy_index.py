@@ -0,0 +1,129 @@
+"""the list and year page ids of every category, worked out once from arxiv.taxonomy
+
+expanding a category string through get_all_cats_from_string resolves taxonomy objects, canonical names and parent archives
+on every call. the index has it done once per category, so a category string is a few dict lookups.
+it can be written to a json file, e.g. at build time, and loaded from TAXONOMY_INDEX_PATH so a cold start doesn't import the taxonomy at all.
+a file written by another arxiv-base version is ignored and the index rebuilt.
+"""
+import json
+import logging
+import os
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+PHYSICS_GROUP="grp_physics"
+
+
+class Entry(NamedTuple):
+    lists: FrozenSet[str] #ids with list pages: the category, its canonical name and parent archives
+    archives: FrozenSet[str] #ids with year pages
+    physics: bool #in the physics group, which has a catchup list page by month
+
+
+def _entry(category: str) -> Entry:
+    from arxiv.taxonomy.category import get_all_cats_from_string
+    groups, archs, cats= get_all_cats_from_string(category)
+    return Entry(frozenset(cat.id for cat in cats) | frozenset(arch.id for arch in archs),
+                 frozenset(arch.id for arch in archs),
+                 any(group.id == PHYSICS_GROUP for group in groups))
+
+def base_version() -> str:
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        return version("arxiv-base")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+class TaxonomyIndex:
+    """read only map of category id to its Entry
+    a category missing from it, not expected outside of a taxonomy change, is worked out from the taxonomy, unknown ones raise KeyError as before
+    """
+    def __init__(self, entries: Mapping[str, Entry], version: str="unknown") -> None:
+        self.entries: Mapping[str, Entry]=MappingProxyType(dict(entries))
+        self.version=version
+
+    @classmethod
+    def build(cls, categories: Optional[Iterable[str]]=None) -> "TaxonomyIndex":
+        """every category of arxiv.taxonomy, or just categories"""
+        if categories is None:
+            from arxiv.taxonomy.definitions import CATEGORIES
+            categories=CATEGORIES.keys()
+        return cls({category: _entry(category) for category in categories}, base_version())
+
+    def entry(self, category: str) -> Entry:
+        found=self.entries.get(category)
+        return found if found is not None else _entry(category)
+
+    def expand(self, categories: str) -> Tuple[FrozenSet[str], FrozenSet[str], bool]:
+        """list page ids, archive ids and whether any is in the physics group, for a category string"""
+        entries=[self.entry(category) for category in categories.split()]
+        if len(entries) == 1:
+            return entries[0]
+        return (frozenset().union(*(entry.lists for entry in entries)),
+                frozenset().union(*(entry.archives for entry in entries)),
+                any(entry.physics for entry in entries))
+
+    def list_keys(self, categories: str, year: int, month: int) -> FrozenSet[str]:
+        """all list pages a paper with the category string is on, for its year and month"""
+        lists, _, physics= self.expand(categories)
+        keys=[f"list-{year:04d}-{id}" for id in lists] #the year listing
+        keys.extend(f"list-{year:04d}-{month:02d}-{id}" for id in lists) #the year and month the paper came out
+        if physics: #catchup filters by and tags for the physics group
+            keys.append(f"list-{year:04d}-{month:02d}-{PHYSICS_GROUP}")
+        return frozenset(keys)
+
+    def year_keys(self, categories: str, year: int) -> FrozenSet[str]:
+        """year pages for the archives of a category string"""
+        _, archives, _= self.expand(categories)
+        return frozenset(f"year-{arch}-{year}" for arch in archives)
+
+    def to_json(self) -> Dict:
+        return {"arxiv_base": self.version,
+                "categories": {category: [sorted(entry.lists), sorted(entry.archives), entry.physics] for category, entry in self.entries.items()}}
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "TaxonomyIndex":
+        entries: Dict[str, Entry]={category: Entry(frozenset(lists), frozenset(archives), bool(physics))
+                                   for category, (lists, archives, physics) in data["categories"].items()}
+        return cls(entries, data.get("arxiv_base", "unknown"))
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, separators=(",", ":"))
+
+
+def load(path: str) -> Optional[TaxonomyIndex]:
+    """the index in path, None if it can't be read or was written by another arxiv-base version"""
+    try:
+        with open(path) as f:
+            index=TaxonomyIndex.from_json(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError) as ex:
+        logging.warning(f"Could not load the taxonomy index from {path}, building it instead: {ex}")
+        return None
+    if index.version != base_version():
+        logging.warning(f"Taxonomy index {path} is for arxiv-base {index.version}, not {base_version()}, building it instead")
+        return None
+    return index
+
+def taxonomy_index_from_env() -> TaxonomyIndex:
+    """loaded from TAXONOMY_INDEX_PATH when set and current, otherwise built from arxiv.taxonomy"""
+    path=os.environ.get("TAXONOMY_INDEX_PATH")
+    index=load(path) if path else None
+    if index is None:
+        index=TaxonomyIndex.build()
+    logging.debug(f"Taxonomy index of {len(index.entries)} categories for arxiv-base {index.version}")
+    return index
+
+
+def main(argv: Optional[List[str]]=None) -> None:
+    import argparse
+    parser=argparse.ArgumentParser(description="writes the taxonomy index to a json file for TAXONOMY_INDEX_PATH")
+    parser.add_argument("path")
+    args=parser.parse_args(argv)
+    index=TaxonomyIndex.build()
+    index.write(args.path)
+    print(f"wrote {len(index.entries)} categories for arxiv-base {index.version} to {args.path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""copies the modules in shared/ into the src folder of each function that uses them
+
+each function deploys only its own src folder, so shared code is edited in shared/ and copied with this.
+run from anywhere after changing a shared module
+` python sync_shared.py ` copies every shared module over its copies
+` python sync_shared.py --check ` only lists copies that differ from shared/ and exits with 1 if there are any, the deploy builds run it
+"""
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+from typing import Dict, List, Tuple
+
+HERE=os.path.dirname(os.path.abspath(__file__))
+SHARED=os.path.join(HERE, "shared")
+FUNCTIONS=sorted(name for name in os.listdir(HERE) if os.path.exists(os.path.join(HERE, name, "src", "main.py")))
+PURGE_FUNCTIONS=["fastly_announce_purge", "purge_all_for_paper", "purge_on_bucket_change"]
+
+#shared module: the functions it is copied into
+USED_BY: Dict[str, List[str]]={
+    "startup.py": FUNCTIONS,
+    "metrics.py": PURGE_FUNCTIONS,
+    "purge_dispatch.py": PURGE_FUNCTIONS,
+    "taxonomy_index.py": ["fastly_announce_purge", "purge_all_for_paper"],
+}
+
+
+def copies(root: str=HERE) -> List[Tuple[str, str]]:
+    """(shared module, copy) paths for every copy under root"""
+    return [(os.path.join(root, "shared", module), os.path.join(root, function, "src", module))
+            for module, functions in USED_BY.items() for function in functions]
+
+def stale(root: str=HERE) -> List[str]:
+    """copies that are missing or differ from their shared module, relative to root"""
+    return [os.path.relpath(copy, root) for source, copy in copies(root)
+            if not os.path.exists(copy) or not filecmp.cmp(source, copy, shallow=False)]
+
+def sync(root: str=HERE) -> List[str]:
+    """copies the shared modules over the stale copies, returns them"""
+    updated=stale(root)
+    for source, copy in copies(root):
+        if os.path.relpath(copy, root) in updated:
+            shutil.copyfile(source, copy)
+    return updated
+
+
+def main() -> None:
+    parser=argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check", action="store_true", help="list the stale copies without changing them, exit 1 if there are any")
+    args=parser.parse_args()
+
+    if args.check:
+        if out_of_date := stale():
+            print("differ from shared/, edit shared/ and run python sync_shared.py:", *out_of_date, sep="\n    ")
+            sys.exit(1)
+        print("shared modules in sync")
+    else:
+        for copy in sync():
+            print(f"updated {copy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+import requests
+
+sys.path.append( os.path.join(os.path.dirname(__file__), "..") )
+sys.path.append( os.path.join(os.path.dirname(__file__), "..", "shared") )
+from fake_fastly import FakeFastly
+from purge_dispatch import PurgeDispatcher, HttpPurgeTransport, PurgeError
+
+SERVICE_IDS={"arxiv.org": "prod-id", "browse.dev.arxiv.org": "dev-id"}
+
+class TestFakeFastly(unittest.TestCase):
+    def _serve(self, **options):
+        fake=FakeFastly(**options).start()
+        self.addCleanup(fake.stop)
+        return fake, HttpPurgeTransport(SERVICE_IDS, "token", fake.url, pool_size=8)
+
+    def test_multi_key_and_soft_purge(self):
+        fake, transport=self._serve()
+        transport(["abs-2401.00001", "list-2401-cs.LG"], "arxiv.org", False)
+        transport(["abs-2401.00002"], "browse.dev.arxiv.org", True)
+
+        self.assertEqual([(r.service_id, r.keys, r.soft, r.status) for r in fake.requests], [
+            ("prod-id", ["abs-2401.00001", "list-2401-cs.LG"], False, 200),
+            ("dev-id", ["abs-2401.00002"], True, 200)])
+        self.assertEqual(fake.purged_keys("prod-id"), {"abs-2401.00001", "list-2401-cs.LG"})
+        self.assertEqual(fake.purged_keys(soft=True), {"abs-2401.00002"})
+
+    def test_single_key_and_json_body(self):
+        fake, _=self._serve()
+        single=requests.post(f"{fake.url}/service/prod-id/purge/abs-2401.00001")
+        body=requests.post(f"{fake.url}/service/prod-id/purge", json={"surrogate_keys": ["a", "b"]})
+
+        self.assertEqual(single.json()["status"], "ok")
+        self.assertEqual(set(body.json()), {"a", "b"})
+        self.assertEqual(fake.purged, ["abs-2401.00001", "a", "b"])
+
+    def test_rejects_bad_requests(self):
+        fake, _=self._serve(token="secret")
+        self.assertEqual(requests.post(f"{fake.url}/service/prod-id/purge", headers={"Surrogate-Key": "a"}).status_code, 401)
+        headers={"Fastly-Key": "secret", "Surrogate-Key": " ".join(f"k{i}" for i in range(257))}
+        self.assertEqual(requests.post(f"{fake.url}/service/prod-id/purge", headers=headers).status_code, 400)
+        self.assertEqual(requests.post(f"{fake.url}/service/prod-id/purge", headers={"Fastly-Key": "secret"}).status_code, 400)
+        self.assertEqual(requests.post(f"{fake.url}/nowhere", headers={"Fastly-Key": "secret"}).status_code, 404)
+        self.assertEqual(fake.requests, [], "only purges are recorded")
+
+    def test_injected_failures_retried_by_dispatcher(self):
+        fake, transport=self._serve(fail_keys=["never"])
+        fake.fail_next(2)
+        keys=[f"key-{i}" for i in range(600)]
+        result=PurgeDispatcher(transport, max_in_flight=1, backoff=0).purge(keys)
+
+        self.assertEqual(result.retries, 2)
+        self.assertEqual(fake.purged, keys)
+        self.assertEqual(fake.stats()["failed"], 2)
+        with self.assertRaises(PurgeError):
+            PurgeDispatcher(transport, attempts=2, backoff=0).purge(["never"])
+
+    def test_rate_limit(self):
+        fake, transport=self._serve(rate_limit=2)
+        transport(["a"], "arxiv.org", False)
+        transport(["b"], "arxiv.org", False)
+        with self.assertRaises(requests.HTTPError) as info:
+            transport(["c"], "arxiv.org", False)
+        self.assertEqual(info.exception.response.status_code, 429)
+        self.assertEqual(info.exception.response.headers["Retry-After"], "1")
+        self.assertEqual(fake.stats()["rate_limited"], 1)
+        self.assertEqual(fake.purged_keys(), {"a", "b"})
+
+    def test_exact_purge_set_under_load(self):
+        fake, transport=self._serve(latency=0.001, jitter=0.002, error_rate=0.05, seed=1)
+        dispatcher=PurgeDispatcher(transport, batch_size=100, max_in_flight=8, attempts=10, backoff=0)
+        purges=[[f"paper-{n}-key-{i}" for i in range(1000)] for n in range(8)]
+        threads=[threading.Thread(target=dispatcher.purge, args=(keys,)) for keys in purges]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats=fake.stats()
+        self.assertEqual(sorted(fake.purged), sorted(key for keys in purges for key in keys))
+        self.assertEqual(stats["accepted"], 80)
+        self.assertEqual(stats["requests"], 80 + stats["failed"])
+
+    def test_log_and_stats_endpoints(self):
+        log=os.path.join(self._tmpdir(), "purges.jsonl")
+        fake, transport=self._serve(log=log)
+        transport(["a", "b"], "arxiv.org", True)
+
+        self.assertEqual(requests.get(f"{fake.url}/_stats").json()["keys"], 2)
+        self.assertEqual(requests.get(f"{fake.url}/_requests").json()[0]["keys"], ["a", "b"])
+        with open(log) as f:
+            logged=[json.loads(line) for line in f]
+        self.assertEqual([(entry["keys"], entry["soft"]) for entry in logged], [(["a", "b"], True)])
+        requests.post(f"{fake.url}/_reset")
+        self.assertEqual(fake.stats()["requests"], 0)
+
+    def _tmpdir(self):
+        tmp=tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        return tmp.name
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import sys
+import unittest
+
+sys.path.append( os.path.join(os.path.dirname(__file__), "..") )
+from importtime import parse, summarize
+
+#python -X importtime -c "import main", trimmed
+SAMPLE="""import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   sitecustomize
+import time:      3331 |      70736 | site
+import time:       359 |        359 |       _json
+import time:       830 |       1188 |     json.scanner
+import time:       783 |       1971 |   json.decoder
+import time:       499 |       3341 | json
+import time:       210 |        210 |       google.auth
+import time:      9000 |      41000 |     google.cloud.logging
+import time:       300 |      45000 |   startup
+import time:       150 |        150 |   metrics
+import time:      4000 |      12000 |   arxiv.taxonomy
+import time:      1200 |      58350 | main
+import time:        50 |         50 | atexit
+""".splitlines()
+
+
+class TestImportTime(unittest.TestCase):
+    def test_parse_depths(self):
+        times=parse(SAMPLE)
+        self.assertEqual(len(times), 13)
+        self.assertEqual(times[0], ("sitecustomize", 1, 120, 120))
+        self.assertEqual(times[2], ("_json", 3, 359, 359))
+        self.assertEqual(times[11], ("main", 0, 1200, 58350))
+
+    def test_summary_lists_only_direct_imports_of_main(self):
+        summary=summarize("fastly_announce_purge", parse(SAMPLE), top=2)
+        self.assertEqual(summary["total_ms"], 58.35)
+        self.assertEqual(summary["modules"], 13)
+        self.assertEqual(summary["heaviest"], [{"module": "startup", "cumulative_ms": 45.0},
+                                               {"module": "arxiv.taxonomy", "cumulative_ms": 12.0}])
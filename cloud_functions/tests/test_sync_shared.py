@@ -0,0 +1,33 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append( os.path.join(os.path.dirname(__file__), "..") )
+from sync_shared import SHARED, USED_BY, copies, stale, sync
+
+
+class TestSyncShared(unittest.TestCase):
+    def test_copies_match_shared(self):
+        self.assertEqual(stale(), [], "edit the module in cloud_functions/shared and run python sync_shared.py")
+
+    def test_drift_found_and_synced(self):
+        with tempfile.TemporaryDirectory() as root:
+            for source, copy in copies(root):
+                os.makedirs(os.path.dirname(source), exist_ok=True)
+                os.makedirs(os.path.dirname(copy), exist_ok=True)
+                shutil.copyfile(os.path.join(SHARED, os.path.basename(source)), source)
+                shutil.copyfile(source, copy)
+            self.assertEqual(stale(root), [])
+
+            with open(os.path.join(root, "purge_all_for_paper", "src", "metrics.py"), "a") as f:
+                f.write("#edited in place\n")
+            os.remove(os.path.join(root, "hello_world", "src", "startup.py"))
+            self.assertEqual(sorted(stale(root)), [os.path.join("hello_world", "src", "startup.py"),
+                                                   os.path.join("purge_all_for_paper", "src", "metrics.py")])
+            self.assertEqual(len(sync(root)), 2)
+            self.assertEqual(stale(root), [])
+
+    def test_every_shared_module_listed(self):
+        self.assertEqual(sorted(USED_BY), sorted(name for name in os.listdir(SHARED) if name.endswith(".py")))